@@ -3,33 +3,54 @@ from flask import Flask
 from flask_cors import CORS
 from flask_restx import Api
 from flask_limiter import Limiter
-from .utils.APIKEY.get_key import get_api_key
+from .utils.APIKEY.get_key import load_api_key, get_rate_limit_key
+from .utils.pool_metrics import MeteredQueuePool, pool_metrics
+from .utils.limiter_storage import SQLiteStorage  # registers the sqlite:// limiter storage
+from .utils.foreign_keys import enforce_foreign_keys
+from .utils.statement_timeout import limit_statement_time
+from config import get_config
 
 
 app = Flask(__name__)
-app.config.from_object("config.DevConfig")
-db = SQLAlchemy(app)
-CORS(app)
+app.config.from_object(get_config())
+pool_metrics.slow_checkout = app.config["DB_POOL_SLOW_CHECKOUT"]
+db = SQLAlchemy(app, engine_options={
+                "poolclass": MeteredQueuePool} if app.config["DB_POOL_METRICS"] else None)
+with app.app_context():
+    enforce_foreign_keys(db.engine)
+    limit_statement_time(db.engine, app.config["DB_STATEMENT_TIMEOUT_MS"])
+CORS(app, expose_headers=["X-Next-Cursor", "Idempotent-Replayed"])
 api = Api(app)
-limiter = Limiter(key_func=get_api_key, app=app, default_limits=[
-                  "1000 per day", "30 per hour"], storage_uri="memory://")
+app.before_request(load_api_key)
+limiter = Limiter(key_func=get_rate_limit_key, app=app, default_limits=[
+                  "1000 per day", "30 per hour"], storage_uri=app.config["RATELIMIT_STORAGE_URI"],
+                  strategy=app.config["RATELIMIT_STRATEGY"])
 
 video_ns = api.namespace("Videos", description="Dash Cam Videos")
 user_ns = api.namespace("Users", description="Users")
 comment_ns = api.namespace("Comments", description="Comments on videos")
+city_ns = api.namespace("Cities", description="Cities where videos were taken")
+search_ns = api.namespace("Search", description="Full-text search of videos and comments")
 
 
 def create_app():
     """
-    Returns an app object.
+    Returns an app object, configured from the config class named by the APP_CONFIG environment variable.
+    Only checks that the database schema is current; migrations are run beforehand with migrate.py.
+    Also installs the request instrumentation, which stays idle unless INSTRUMENTATION is set: Server-Timing headers,
+    per-route metrics at /metrics and, with PROFILE_SAMPLE_RATE, cProfile dumps of the slowest sampled requests.
     """
+    from .utils import instrumentation
+
     with app.app_context():
         from .routes.comment_routes import Comments, CommentList
         from .routes.video_routes import Videos, VideoList
         from .routes.user_routes import Users, UserList
+        from .routes.city_routes import Cities, CityList
+        from .routes.search_routes import Search
 
-        from .utils.db_management import db_cleanup
+        from .utils.migrations import check_schema
 
-        db_cleanup()
+        check_schema()
 
     return app
@@ -0,0 +1,192 @@
+import asyncio
+import io
+import sys
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.util import await_only, greenlet_spawn
+from . import db, create_app
+from .utils.async_io import start_serving, stop_serving
+from .utils.foreign_keys import enforce_foreign_keys
+from .utils.instrumentation import instrument_engine
+from .utils.pool_metrics import MeteredAsyncQueuePool
+from .utils.statement_timeout import limit_statement_time
+from .utils.url import open_async_session, close_async_session
+
+
+ASYNC_DRIVERS = {
+    "sqlite": "aiosqlite",
+    "postgresql": "asyncpg",
+}
+
+
+def async_database_uri(uri):
+    """
+    Returns the given database URI with the asyncio driver of its database in place of the default one.
+    """
+    url = make_url(uri)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No asyncio driver for {backend}")
+
+    return url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
+
+
+class AsyncApp:
+    """
+    ASGI application that serves the Flask app with its database queries and URL verifications awaited on one
+    event loop. Every request runs the Flask app in a greenlet, the way SQLAlchemy's asyncio extension runs the ORM,
+    so the handlers, marshalling and Swagger docs are the same as over WSGI, while a request waiting on the
+    database or on YouTube only holds a suspended greenlet instead of a worker thread. The SQLite rate limit,
+    response cache and idempotency stores have no asyncio driver, so their calls run in worker threads instead,
+    and waiting on one of their file locks holds up only the request that made it.
+    The async engine and HTTP client are opened at lifespan startup and closed at shutdown.
+    """
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.async_engine = None
+        self.sync_engine = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+        elif scope["type"] == "http":
+            body = await read_body(receive)
+            await greenlet_spawn(self.respond, wsgi_environ(scope, body), send)
+        else:
+            raise ValueError(f"Unsupported ASGI scope type {scope['type']}")
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await self.startup()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def startup(self):
+        """
+        Switches the app's database engine to the asyncio driver and opens the async HTTP client.
+        The async engine gets the sync engine's options and a queue pool like it, metered if DB_POOL_METRICS is set,
+        since the asyncio drivers would otherwise default to a pool that takes no size options.
+        """
+        config = self.flask_app.config
+        self.async_engine = create_async_engine(
+            async_database_uri(config["SQLALCHEMY_DATABASE_URI"]),
+            poolclass=MeteredAsyncQueuePool if config["DB_POOL_METRICS"] else AsyncAdaptedQueuePool,
+            **config.get("SQLALCHEMY_ENGINE_OPTIONS", {}))
+        enforce_foreign_keys(self.async_engine.sync_engine)
+        limit_statement_time(self.async_engine.sync_engine, config["DB_STATEMENT_TIMEOUT_MS"])
+        instrument_engine(self.async_engine.sync_engine)
+
+        with self.flask_app.app_context():
+            # sessions pick their engine from this mapping, so every query from now on goes through the async driver
+            self.sync_engine = db.engines[None]
+            db.engines[None] = self.async_engine.sync_engine
+
+        open_async_session()
+        start_serving(asyncio.get_running_loop())
+
+    async def shutdown(self):
+        """
+        Waits for background verifications, then closes the async HTTP client and engine and restores the sync engine.
+        """
+        await stop_serving()
+        await close_async_session()
+        with self.flask_app.app_context():
+            db.engines[None] = self.sync_engine
+
+        await self.async_engine.dispose()
+
+    def respond(self, environ, send):
+        """
+        Calls the Flask app with the given WSGI environ and sends its response, awaiting every send.
+        """
+        start = {}
+
+        def start_response(status, headers, exc_info=None):
+            start.update(type="http.response.start", status=int(status.split(" ", 1)[0]),
+                         headers=[(name.lower().encode("latin1"), value.encode("latin1")) for name, value in headers])
+
+        body = self.flask_app(environ, start_response)
+        try:
+            started = False
+            for chunk in body:
+                if not chunk:
+                    continue
+
+                if not started:
+                    await_only(send(start))
+                    started = True
+
+                await_only(send({"type": "http.response.body", "body": chunk, "more_body": True}))
+
+            if not started:
+                await_only(send(start))
+
+            await_only(send({"type": "http.response.body", "body": b""}))
+
+        finally:
+            if hasattr(body, "close"):
+                body.close()
+
+
+async def read_body(receive):
+    """
+    Returns the whole body of the request being received.
+    """
+    body = bytearray()
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return bytes(body)
+
+
+def wsgi_environ(scope, body):
+    """
+    Returns the WSGI environ of the request with the given ASGI scope and body.
+    """
+    server = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf8").decode("latin1"),
+        "PATH_INFO": scope["path"].encode("utf8").decode("latin1"),
+        "QUERY_STRING": scope["query_string"].decode("latin1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1] or 80),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    if scope.get("client"):
+        environ["REMOTE_ADDR"] = scope["client"][0]
+
+    for name, value in scope["headers"]:
+        name, value = name.decode("latin1"), value.decode("latin1")
+        if name == "content-length":
+            key = "CONTENT_LENGTH"
+        elif name == "content-type":
+            key = "CONTENT_TYPE"
+        else:
+            key = "HTTP_" + name.upper().replace("-", "_")
+
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+
+    return environ
+
+
+def create_asgi_app():
+    """
+    Returns the ASGI application serving the app created by create_app.
+    """
+    return AsyncApp(create_app())
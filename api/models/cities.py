@@ -0,0 +1,62 @@
+import datetime
+from sqlalchemy.orm import relationship
+from .. import db
+from ..utils.etags import version_column
+from ..utils.unit_of_work import finish_write
+
+
+class City(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    videos = relationship("Video", back_populates="city")
+    name = db.Column(db.String(100), unique=True, index=True, nullable=False)
+    lat = db.Column(db.Float, nullable=False)
+    lon = db.Column(db.Float, nullable=False)
+    version = version_column()
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow,
+                           onupdate=datetime.datetime.utcnow)
+
+    def save(self):
+        """
+        Saves current city to database.
+        """
+        db.session.add(self)
+        db.session.flush()
+        finish_write()
+
+    def to_dict(self):
+        """
+        Returns a dictionary of data from the given city.
+        """
+        city_dict = {}
+        city_dict["name"] = self.name
+        city_dict["lat"] = self.lat
+        city_dict["lon"] = self.lon
+        city_dict["id"] = self.id
+
+        return city_dict
+
+    @classmethod
+    def serialized_relationships(cls):
+        """
+        Returns the many-to-one relationships whose data to_dict includes.
+        """
+        return ()
+
+    @classmethod
+    def get_by_id(cls, id):
+        """
+        Returns the city object from the given ID if it exists, otherwise raises a 404 error.
+        """
+        city = db.get_or_404(cls, id)
+
+        return city
+
+    @classmethod
+    def get_by_name(cls, name):
+        """
+        Returns the city object with the given name if it exists, otherwise raises a 404 error.
+        """
+        city = db.first_or_404(db.select(cls).filter_by(name=name),
+                               description="City not found")
+
+        return city
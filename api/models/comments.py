@@ -1,21 +1,38 @@
-from sqlalchemy.orm import relationship
+import datetime
+from sqlalchemy.orm import relationship, joinedload
 from .. import db
 from ..models.users import User
 from ..models.videos import Video
+from ..utils.response_cache import response_cache
+from ..utils.etags import bump_table_versions, version_column
+from ..utils.search import index_entry, remove_entries
+from ..utils.unit_of_work import finish_write, after_commit
 
 
 class Comment(db.Model):
+    SEARCH_KIND = "comment"
+
     id = db.Column(db.Integer, primary_key=True)
-    video_id = db.Column(db.Integer, db.ForeignKey("video.id"))
+    video_id = db.Column(db.Integer, db.ForeignKey("video.id", ondelete="CASCADE"))
     video = relationship("Video", back_populates="comments")
-    user_id = db.Column(db.Integer, db.ForeignKey("user.id"))
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id", ondelete="CASCADE"))
     user = relationship("User", back_populates="comments")
     body = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    version = version_column()
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow,
+                           onupdate=datetime.datetime.utcnow)
+    __table_args__ = (
+        db.Index("ix_comment_video_id_id", video_id, id),
+    )
 
     def update_from_args(self, args):
         """
-        Updates properties of entry using provided args.
+        Updates properties of entry using provided args, moving it between the comment counts of its old and new video,
+        and invalidating the cached lists it left or joined once committed.
         """
+        stale_tags = self.cache_tags()
+        old_video_id = self.video_id
         if args["user_id"]:
             user = User.get_by_id(int(args["user_id"]))
             self.user = user
@@ -25,14 +42,58 @@ class Comment(db.Model):
             self.video = video
 
         self.body = args["body"]
-        db.session.commit()
+        db.session.flush()
+        if self.video_id != old_video_id:
+            stale_tags |= Video.count_comments({old_video_id: -1, self.video_id: 1})
+
+        index_entry(self)
+        finish_write()
+        after_commit(response_cache.invalidate, stale_tags | self.cache_tags())
 
     def save(self):
         """
-        Saves current video to database.
+        Saves current comment to database along with its search index entry and its video's comment count,
+        invalidating the cached lists it appears in once committed.
         """
         db.session.add(self)
-        db.session.commit()
+        db.session.flush()
+        stale_tags = Video.count_comments({self.video_id: 1})
+        index_entry(self)
+        finish_write()
+        after_commit(response_cache.invalidate, stale_tags | self.cache_tags())
+
+    def search_text(self):
+        """
+        Returns the text of this comment that full-text search matches.
+        """
+        return self.body
+
+    def cache_tags(self):
+        """
+        Returns the response cache tags of the comment lists this comment appears in.
+        """
+        return {"comments", f"comments:video={self.video_id}", f"comments:user={self.user_id}"}
+
+    @classmethod
+    def prepare_cascade_delete(cls, condition, count=True):
+        """
+        Readies the comments matching condition for the database to delete by cascade, without loading them:
+        removes them from the search index, bumps the comment collection version and returns the cache tags to
+        invalidate, starting with the one every comment list depends on. Their videos' comment counts are taken down
+        too, unless count is False because the videos are being deleted along with them.
+        """
+        if not db.session.execute(db.select(db.exists().where(condition))).scalar():
+            return set()
+
+        remove_entries(cls, condition)
+        bump_table_versions(db.session.connection(), {cls.__tablename__})
+        stale_tags = {"comments:all"}
+        if count:
+            counts = db.session.execute(db.select(cls.video_id, db.func.count(cls.id))
+                                        .where(condition).group_by(cls.video_id)).all()
+            stale_tags |= Video.count_comments({video_id: -count for video_id, count in counts}, excluded=condition)
+
+        return stale_tags
 
     def to_dict(self):
         """
@@ -46,6 +107,20 @@ class Comment(db.Model):
 
         return comment_dict
 
+    @classmethod
+    def serialized_relationships(cls):
+        """
+        Returns the many-to-one relationships whose data to_dict includes.
+        """
+        return (cls.video, cls.user)
+
+    @classmethod
+    def serialization_options(cls):
+        """
+        Returns the loader options that eagerly load the relationships used by to_dict.
+        """
+        return tuple(joinedload(relationship) for relationship in cls.serialized_relationships())
+
     @classmethod
     def get_by_id(cls, id):
         """
@@ -1,15 +1,21 @@
-from sqlalchemy.orm import relationship
+import datetime
+from sqlalchemy.orm import relationship, selectinload
 from sqlalchemy.exc import NoResultFound
-from ..models.videos import Video
 from .. import db
+from ..utils.response_cache import response_cache
+from ..utils.etags import version_column
+from ..utils.unit_of_work import finish_write, after_commit
 
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    videos = relationship("Video", back_populates="user")
-    comments = relationship("Comment", back_populates="user")
+    videos = relationship("Video", back_populates="user", cascade="all", passive_deletes=True)
+    comments = relationship("Comment", back_populates="user", cascade="all", passive_deletes=True)
     username = db.Column(db.String(20), unique=True)
-    key = db.Column(db.String(80))
+    key = db.Column(db.String(80), unique=True, index=True)
+    version = version_column()
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow,
+                           onupdate=datetime.datetime.utcnow)
 
     def __init__(self, username, key, **kwargs):
         super().__init__(**kwargs)
@@ -18,34 +24,66 @@ class User(db.Model):
 
     def update_from_args(self, args):
         """
-        Updates properties of entry using provided args.
+        Updates properties of entry using provided args, invalidating the cached lists that show them once committed.
         """
+        stale_tags = self.cache_tags()
+        if "username" in args and args["username"] != self.username:
+            stale_tags.add("usernames")
+
         if "username" in args:
             self.username = args["username"]
 
-        db.session.commit()
+        finish_write()
+        after_commit(response_cache.invalidate, stale_tags)
 
     def save(self):
         """
-        Saves current user to database.
+        Saves current user to database, invalidating the cached lists it appears in once committed.
         """
         db.session.add(self)
-        db.session.commit()
+        db.session.flush()
+        finish_write()
+        after_commit(response_cache.invalidate, self.cache_tags())
+
+    def cache_tags(self):
+        """
+        Returns the response cache tags of this user and of the lists it appears in.
+        Lists that only show usernames depend on the usernames tag instead, which creating a user leaves alone.
+        """
+        return {"users", f"user:{self.id}"}
 
-    def to_dict(self):
+    def to_dict(self, expand_videos=False):
         """
-        Returns a dictionary of data from the given user.
+        Returns a dictionary of data from the given user, including their videos only if expand_videos is set.
         """
         user_dict = {}
         user_dict["username"] = self.username
         user_dict["id"] = self.id
-        user_videos = db.session.execute(
-            db.select(Video).filter_by(user=self)).all()
-        user_dict["videos"] = [video[0].to_dict()
-                               for video in user_videos]
+
+        if expand_videos:
+            user_dict["videos"] = [video.to_dict() for video in self.videos]
 
         return user_dict
 
+    @classmethod
+    def serialized_relationships(cls):
+        """
+        Returns the many-to-one relationships whose data to_dict includes.
+        """
+        return ()
+
+    @classmethod
+    def serialization_options(cls, expand_videos=False):
+        """
+        Returns the loader options that load the videos of every selected user in one batched query when they are expanded.
+        """
+        if expand_videos:
+            from .videos import Video
+
+            return (selectinload(cls.videos).joinedload(Video.city),)
+
+        return ()
+
     @classmethod
     def get_by_id(cls, id):
         """
@@ -67,3 +105,16 @@ class User(db.Model):
 
         except NoResultFound:
             return None
+
+    @classmethod
+    def get_from_key(cls, key):
+        """
+        Returns the user object with given API key if it exists, otherwise returns None.
+        """
+        try:
+            user = db.session.execute(
+                db.select(User).filter_by(key=key)).one()[0]
+            return user
+
+        except NoResultFound:
+            return None
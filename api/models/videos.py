@@ -1,24 +1,58 @@
+import datetime
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy.orm import relationship
+from sqlalchemy import event
+from sqlalchemy.orm import relationship, joinedload
 from .. import db
+from ..utils.response_cache import response_cache
+from ..utils.geo import grid_cell
+from ..utils.etags import bump_table_versions, version_column
+from ..utils.search import index_entry, remove_entries
+from ..utils.unit_of_work import finish_write, after_commit
+from ..utils.youtube import url_hash, URL_HASH_SIZE
+from ..models.cities import City
 
 
 class Video(db.Model):
+    PENDING = "pending"
+    VERIFIED = "verified"
+    INVALID = "invalid"
+    SEARCH_KIND = "video"
+
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey("user.id"))
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id", ondelete="CASCADE"))
     user = relationship("User", back_populates="videos")
-    comments = relationship("Comment", back_populates="video")
-    url = db.Column(db.String(2000), unique=True, nullable=False)
+    comments = relationship("Comment", back_populates="video", cascade="all", passive_deletes=True)
+    url = db.Column(db.String(2000), nullable=False)
+    # unique in place of the url, so that two links to the same YouTube video cannot both be stored
+    url_hash = db.Column(db.LargeBinary(URL_HASH_SIZE), nullable=False, unique=True, index=True)
     date = db.Column(db.Date, nullable=True)
     description = db.Column(db.Text)
-    city_id = db.Column(db.Integer, db.ForeignKey("city.id"))
+    city_id = db.Column(db.Integer, db.ForeignKey("city.id"), index=True)
     city = relationship("City", back_populates="videos")
+    lat = db.Column(db.Float)
+    lon = db.Column(db.Float)
+    geo_cell = db.Column(db.Integer, index=True)
+    status = db.Column(db.String(10), nullable=False,
+                       default=VERIFIED, server_default=VERIFIED)
+    comment_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    last_comment_at = db.Column(db.DateTime)
+    version = version_column()
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow,
+                           onupdate=datetime.datetime.utcnow)
+    __table_args__ = (
+        db.Index("ix_video_date_id", date, id),
+        db.Index("ix_video_user_id_date", user_id, date),
+    )
 
     def update_from_args(self, args):
         """
-        Updates properties of entry using provided args.
+        Updates properties of entry using provided args, invalidating the cached lists it left or joined once committed.
         """
-        if "url" in args:
+        stale_tags = self.cache_tags()
+        if args.get("url") and args["url"] != self.url:
+            stale_tags.add("video_urls")
+
+        if args.get("url"):
             self.url = args["url"]
 
         if "date" in args:
@@ -27,14 +61,39 @@ class Video(db.Model):
         if "description" in args:
             self.description = args["description"]
 
-        db.session.commit()
+        if args.get("lat") is not None:
+            self.lat, self.lon = args["lat"], args["lon"]
+
+        if args.get("city") is not None:
+            self.city = City.get_by_name(args["city"])
+
+        db.session.flush()
+        index_entry(self)
+        finish_write()
+        after_commit(response_cache.invalidate, stale_tags | self.cache_tags())
 
     def save(self):
         """
-        Saves current video to database.
+        Saves current video to database along with its search index entry, invalidating the cached lists it appears in
+        once committed.
         """
         db.session.add(self)
-        db.session.commit()
+        db.session.flush()
+        index_entry(self)
+        finish_write()
+        after_commit(response_cache.invalidate, self.cache_tags())
+
+    def search_text(self):
+        """
+        Returns the text of this video that full-text search matches.
+        """
+        return self.description
+
+    def cache_tags(self):
+        """
+        Returns the response cache tags of this video and of the lists it appears in.
+        """
+        return self.list_cache_tags(self.date, self.user_id, self.city_id, self.geo_cell) | {f"video:{self.id}"}
 
     def to_dict(self):
         """
@@ -46,10 +105,93 @@ class Video(db.Model):
         video_dict["date"] = str(self.date) if self.date else ""
         video_dict["description"] = self.description if self.description else ""
         video_dict["id"] = self.id
-        video_dict["user"] = self.user.username
+        video_dict["status"] = self.status
+        video_dict["city"] = self.city.name if self.city else ""
+        video_dict["lat"] = self.lat
+        video_dict["lon"] = self.lon
+        video_dict["comment_count"] = self.comment_count
+        video_dict["last_comment_at"] = self.last_comment_at
 
         return video_dict
 
+    @classmethod
+    def list_cache_tags(cls, date, user_id, city_id, geo_cell):
+        """
+        Returns the response cache tags of the video lists that a video with the given date, user, city and grid cell appears in.
+        """
+        return {"videos", f"videos:date={date}", f"videos:user={user_id}", f"videos:city={city_id}",
+                f"videos:cell={geo_cell}"}
+
+    @classmethod
+    def prepare_cascade_delete(cls, condition):
+        """
+        Readies the videos matching condition, and their comments, for the database to delete by cascade without
+        loading them: removes them from the search index, bumps the collection versions and returns the cache tags to
+        invalidate. Those are the tags every video and comment list depends on, so that deleting any number of videos
+        takes a fixed number of statements and tags.
+        """
+        from .comments import Comment
+
+        if not db.session.execute(db.select(db.exists().where(condition))).scalar():
+            return set()
+
+        comments = Comment.video_id.in_(db.select(cls.id).where(condition))
+        stale_tags = Comment.prepare_cascade_delete(comments, count=False)
+        remove_entries(cls, condition)
+        bump_table_versions(db.session.connection(), {cls.__tablename__})
+
+        return stale_tags | {"videos:all", "video_urls"}
+
+    @classmethod
+    def count_comments(cls, deltas, excluded=None):
+        """
+        Adds the number of comments given for each video ID in deltas to that video's comment count and sets its
+        last comment time to that of its newest comment, not counting comments matching excluded, which are about to
+        be deleted. Runs in the caller's transaction as one executemany UPDATE, and bumps the versions the ETags of the
+        videos and their lists are built from. Returns the cache tags of the video and of the lists it appears in, or
+        for more than one video, the tag every video list depends on, so that no video has to be read.
+        """
+        from .comments import Comment
+
+        deltas = {video_id: delta for video_id, delta in deltas.items() if video_id is not None}
+        if not deltas:
+            return set()
+
+        # the newest comment is the one with the highest ID, read from the end of the (video_id, id) index
+        newest = db.select(Comment.created_at).where(Comment.video_id == cls.id).order_by(Comment.id.desc()).limit(1)
+        if excluded is not None:
+            newest = newest.where(db.not_(excluded))
+
+        connection = db.session.connection()
+        connection.execute(cls.__table__.update().where(cls.id == db.bindparam("video_id")).values(
+            comment_count=cls.comment_count + db.bindparam("delta"), last_comment_at=newest.scalar_subquery(),
+            version=cls.version + 1, updated_at=datetime.datetime.utcnow()),
+            [{"video_id": video_id, "delta": delta} for video_id, delta in deltas.items()])
+        bump_table_versions(connection, {cls.__tablename__})
+
+        if len(deltas) > 1:
+            return {"videos:all"}
+
+        [video_id] = deltas
+        date, user_id, city_id, geo_cell = db.session.execute(
+            db.select(cls.date, cls.user_id, cls.city_id, cls.geo_cell).where(cls.id == video_id)).one()
+
+        return cls.list_cache_tags(date, user_id, city_id, geo_cell) | {f"video:{video_id}"}
+
+    @classmethod
+    def serialized_relationships(cls):
+        """
+        Returns the many-to-one relationships whose data to_dict includes.
+        """
+        return (cls.user, cls.city)
+
+    @classmethod
+    def serialization_options(cls):
+        """
+        Returns the loader options that eagerly load the relationships used by to_dict.
+        """
+        return tuple(joinedload(relationship) for relationship in cls.serialized_relationships())
+
     @classmethod
     def get_by_id(cls, id):
         """
@@ -58,3 +200,29 @@ class Video(db.Model):
         video = db.get_or_404(cls, id)
 
         return video
+
+    @classmethod
+    def get_by_url(cls, url):
+        """
+        Returns the video linking to the same YouTube video as the given url, or the same page for any other url,
+        looked up by URL hash, or None if there is none.
+        """
+        return db.session.execute(db.select(cls).where(cls.url_hash == url_hash(url))).scalar()
+
+
+@event.listens_for(Video, "before_insert")
+@event.listens_for(Video, "before_update")
+def set_geo_cell(mapper, connection, video):
+    """
+    Keeps the grid cell of every video in step with its coordinates.
+    """
+    video.geo_cell = grid_cell(video.lat, video.lon)
+
+
+@event.listens_for(Video, "before_insert")
+@event.listens_for(Video, "before_update")
+def set_url_hash(mapper, connection, video):
+    """
+    Keeps the URL hash of every video in step with its url.
+    """
+    video.url_hash = url_hash(video.url)
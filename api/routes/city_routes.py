@@ -0,0 +1,81 @@
+from ..models.cities import City
+from .. import city_ns
+from flask_restx import Resource, fields, reqparse
+from .. import db, api
+from ..utils.APIKEY.require_key import require_api_key
+from ..utils.pagination import add_pagination_arguments, paginate, page_headers
+from ..utils.etags import conditional, entry_validators, collection_validators
+from ..utils.geo import latitude, longitude
+
+
+get_parser = reqparse.RequestParser()
+get_parser.add_argument("name", required=False)
+
+post_parser = get_parser.copy()
+post_parser.replace_argument("name", required=True)
+post_parser.add_argument("lat", required=True, type=latitude,
+                         help="latitude should be between -90 and 90")
+post_parser.add_argument("lon", required=True, type=longitude,
+                         help="longitude should be between -180 and 180")
+
+add_pagination_arguments(get_parser)
+
+city_model = api.model("City", {
+    "name": fields.String(description="Name of the city"),
+    "lat": fields.Float(description="Latitude of the city centre"),
+    "lon": fields.Float(description="Longitude of the city centre"),
+    "id": fields.Integer(description="ID of city.")
+})
+
+
+@city_ns.route("/")
+class CityList(Resource):
+    method_decorators = [require_api_key]
+
+    @conditional(collection_validators(City))
+    @city_ns.marshal_list_with(city_model)
+    @city_ns.expect(get_parser)
+    def get(self):
+        """
+        If name is provided, returns the city with that name as a JSON object in a list.
+        Otherwise, returns all cities' data as JSON objects in a list, paginated by id using the limit and after arguments.
+        """
+        args = get_parser.parse_args()
+
+        if args["name"]:
+            return [City.get_by_name(args["name"]).to_dict()]
+
+        cities, next_cursor = paginate(db.select(City), City, args)
+
+        return [city.to_dict() for city in cities], 200, page_headers(next_cursor)
+
+    @city_ns.marshal_with(city_model)
+    @city_ns.expect(post_parser)
+    def post(self):
+        """
+        Confirms that no city with that name already exists, and if so, creates a new city and returns its data as JSON.
+        """
+        args = post_parser.parse_args()
+        possible_city = db.session.execute(
+            db.select(City).filter_by(name=args["name"])).first()
+
+        if possible_city:
+            return {}, 400
+
+        new_city = City(name=args["name"], lat=args["lat"], lon=args["lon"])
+        new_city.save()
+
+        return new_city.to_dict()
+
+
+@city_ns.route("/<int:id>")
+class Cities(Resource):
+    @conditional(entry_validators(City))
+    @city_ns.marshal_with(city_model)
+    def get(self, id):
+        """
+        Returns JSON of data from city whose ID was specified.
+        """
+        city = City.get_by_id(id)
+
+        return city.to_dict()
@@ -5,6 +5,14 @@ from .. import comment_ns
 from flask_restx import Resource, reqparse, fields
 from .. import db, api
 from ..utils.APIKEY.require_key import require_api_key
+from ..utils.pagination import add_pagination_arguments, paginate, page_headers
+from ..utils.streaming import add_stream_argument, streamable
+from ..utils.etags import conditional, entry_validators, collection_validators
+from ..utils.response_cache import response_cache, cached
+from ..utils.search import remove_entry
+from ..utils.batch import add_ids_argument, batch_model, load_batch
+from ..utils.unit_of_work import after_commit
+from ..utils.idempotency import idempotent
 
 
 get_parser = reqparse.RequestParser()
@@ -18,6 +26,11 @@ post_parser = patch_parser.copy()
 post_parser.replace_argument("user_id", required=True, type=int)
 post_parser.replace_argument("video_id", required=True, type=int)
 
+add_pagination_arguments(get_parser)
+add_stream_argument(get_parser)
+
+batch_parser = add_ids_argument(reqparse.RequestParser())
+
 comment_model = api.model("Comment", {
     "body": fields.String,
     "user": fields.String,
@@ -25,9 +38,14 @@ comment_model = api.model("Comment", {
     "id": fields.Integer
 })
 
+comment_batch_model = batch_model("Comment", comment_model)
+
 
 @comment_ns.route("/")
 class CommentList(Resource):
+    @conditional(collection_validators(Comment, Video, User))
+    @streamable(get_parser, Comment, comment_model)
+    @cached(get_parser)
     @comment_ns.marshal_list_with(comment_model)
     @comment_ns.expect(get_parser)
     def get(self):
@@ -35,24 +53,46 @@ class CommentList(Resource):
         First checks parser for any video id, and if none exists, checks if any user id exists. 
         If either do exist, any comments that pertain to that id are returned as a list. 
         Otherwise, all comments for all videos are returned as a list.
+        Lists are paginated by id using the limit and after arguments, with the cursor of the next page in the X-Next-Cursor header.
+        With stream set or an Accept header of application/x-ndjson, every matching comment is streamed as NDJSON instead.
         """
         args = get_parser.parse_args()
+        comments, next_cursor = paginate(self.list_query(args), Comment, args)
+        comments_list = [comment.to_dict() for comment in comments]
+
+        return comments_list, 200, page_headers(next_cursor)
+
+    @staticmethod
+    def list_query(args):
+        """
+        Returns the select of comments on the video in args, or else by the user in args, raising a 404 error if either does not exist.
+        """
+        query = db.select(Comment).options(*Comment.serialization_options())
 
         if args["video_id"]:
             video = Video.get_by_id(int(args["video_id"]))
-            comments = video.comments
-            comments_list = [comment.to_dict() for comment in comments]
+            query = query.filter_by(video_id=video.id)
 
         elif args["user_id"]:
             user = User.get_by_id(int(args["user_id"]))
-            comments_list = [comment.to_dict() for comment in user.comments]
+            query = query.filter_by(user_id=user.id)
+
+        return query
+
+    @staticmethod
+    def cache_tags(args):
+        """
+        Returns the response cache tags that the list of comments matching args depends on.
+        """
+        if args["video_id"]:
+            return {"comments:all", f"comments:video={args['video_id']}", f"video:{args['video_id']}", "usernames"}
 
-        else:
-            comments = db.session.execute(db.select(Comment)).all()
-            comments_list = [comment[0].to_dict() for comment in comments]
+        if args["user_id"]:
+            return {"comments:all", f"comments:user={args['user_id']}", f"user:{args['user_id']}", "video_urls"}
 
-        return comments_list
+        return {"comments:all", "comments", "usernames", "video_urls"}
 
+    @idempotent
     @comment_ns.marshal_with(comment_model)
     @comment_ns.expect(post_parser)
     def post(self):
@@ -68,10 +108,27 @@ class CommentList(Resource):
         return new_comment.to_dict()
 
 
+@comment_ns.route("/batch")
+class CommentBatch(Resource):
+    @conditional(collection_validators(Comment, Video, User))
+    @comment_ns.marshal_with(comment_batch_model)
+    @comment_ns.expect(batch_parser)
+    def get(self):
+        """
+        Returns the data of the comments whose IDs are given in ids, in the order requested, along with the requested IDs
+        that have no comment, read with a single query.
+        """
+        args = batch_parser.parse_args()
+        comments, missing = load_batch(Comment, args["ids"], Comment.serialization_options())
+
+        return {"results": [comment.to_dict() for comment in comments], "missing": missing}
+
+
 @comment_ns.route("/<int:id>")
 class Comments(Resource):
     method_decorators = [require_api_key]
 
+    @conditional(entry_validators(Comment))
     @comment_ns.marshal_with(comment_model)
     def get(self, id):
         """
@@ -81,6 +138,7 @@ class Comments(Resource):
 
         return comment.to_dict()
 
+    @idempotent
     @comment_ns.marshal_with(comment_model)
     @comment_ns.expect(post_parser)
     def put(self, id):
@@ -93,6 +151,7 @@ class Comments(Resource):
 
         return comment.to_dict()
 
+    @idempotent
     @comment_ns.marshal_with(comment_model)
     @comment_ns.expect(patch_parser)
     def patch(self, id):
@@ -107,10 +166,14 @@ class Comments(Resource):
 
     def delete(self, id):
         """
-        Deletes comment with ID provided from database and returns JSON object with a message indicating it's been deleted and the ID of the comment.
+        Deletes comment with ID provided from database, taking it off its video's comment count, and returns JSON object with a message indicating it's been deleted and the ID of the comment.
         """
         comment = Comment.get_by_id(id)
+        stale_tags = comment.cache_tags()
+        remove_entry(comment)
         db.session.delete(comment)
-        db.session.commit()
+        db.session.flush()
+        stale_tags |= Video.count_comments({comment.video_id: -1})
+        after_commit(response_cache.invalidate, stale_tags)
 
         return {"contents": "comment delete", "id": id}
@@ -0,0 +1,90 @@
+from ..models.comments import Comment
+from ..models.videos import Video
+from ..models.users import User
+from ..models.cities import City
+from .. import search_ns
+from flask import current_app
+from flask_restx import Resource, reqparse, fields, inputs, abort
+from .. import db, api
+from ..utils.pagination import page_headers
+from ..utils.etags import conditional, collection_validators
+from ..utils.search import KINDS, get_search_backend, search_terms
+from .video_routes import video_model
+from .comment_routes import comment_model
+
+
+get_parser = reqparse.RequestParser()
+get_parser.add_argument("q", required=True,
+                        help="words that every result must contain")
+get_parser.add_argument("type", required=False, choices=KINDS,
+                        help="only return results of this type: " + ", ".join(KINDS))
+get_parser.add_argument("limit", required=False, type=inputs.positive,
+                        help="maximum number of results to return")
+get_parser.add_argument("after", required=False,
+                        help="only return results after this cursor, taken from the X-Next-Cursor header of the previous page")
+
+result_model = api.model("Search Result", {
+    "type": fields.String(description="Whether the result is a video or a comment"),
+    "id": fields.Integer(description="ID of the video or comment"),
+    "score": fields.Float(description="Relevance of the result, higher is better"),
+    "snippet": fields.String(description="Excerpt of the matching text with the matched words in brackets"),
+    "video": fields.Nested(video_model, allow_null=True, skip_none=True),
+    "comment": fields.Nested(comment_model, allow_null=True, skip_none=True)
+})
+
+MODELS = {Video.SEARCH_KIND: Video, Comment.SEARCH_KIND: Comment}
+
+
+@search_ns.route("/")
+class Search(Resource):
+    @conditional(collection_validators(Video, Comment, User, City))
+    @search_ns.marshal_list_with(result_model, skip_none=True)
+    @search_ns.expect(get_parser)
+    def get(self):
+        """
+        Returns the videos whose descriptions and comments whose bodies contain every word of q, most relevant first,
+        as JSON objects in a list with the matching snippet. Only one type of result is returned when type is given.
+        Results are paginated using the limit and after arguments, with the cursor of the next page in the X-Next-Cursor header.
+        Returns a 501 error on a database that has no full-text search backend.
+        """
+        args = get_parser.parse_args()
+        terms = search_terms(args["q"])
+
+        if not terms:
+            abort(400, "q should contain at least one word")
+
+        limit = min(args["limit"] or current_app.config["DEFAULT_PAGE_SIZE"],
+                    current_app.config["MAX_PAGE_SIZE"])
+        kinds = [args["type"]] if args["type"] else KINDS
+
+        search_backend = get_search_backend()
+        if search_backend is None:
+            abort(501, "Full-text search is not available on this database")
+
+        try:
+            hits, next_cursor = search_backend.search(
+                db.session.connection(), terms, kinds, limit, args["after"])
+        except ValueError:
+            abort(400, "after should be the X-Next-Cursor of the previous page of the same search")
+
+        entries = self.load_entries(hits)
+        results = [{"type": hit.kind, "id": hit.id, "score": hit.score, "snippet": hit.snippet,
+                    hit.kind: entries[hit.kind, hit.id].to_dict()}
+                   for hit in hits if (hit.kind, hit.id) in entries]
+
+        return results, 200, page_headers(next_cursor)
+
+    @staticmethod
+    def load_entries(hits):
+        """
+        Returns the videos and comments of the given hits by kind and ID, loaded with one query per kind.
+        """
+        entries = {}
+        for kind, model in MODELS.items():
+            ids = [hit.id for hit in hits if hit.kind == kind]
+            if ids:
+                for entry in db.session.execute(db.select(model).where(model.id.in_(ids))
+                                                .options(*model.serialization_options())).scalars():
+                    entries[kind, entry.id] = entry
+
+        return entries
@@ -4,6 +4,16 @@ from flask_restx import Resource, fields, reqparse
 from .. import db, api, limiter
 import uuid
 from ..utils.APIKEY.require_key import require_api_key
+from ..utils.APIKEY.key_cache import key_cache
+from ..utils.pagination import add_pagination_arguments, paginate, page_headers
+from ..utils.streaming import add_stream_argument, streamable
+from ..utils.etags import conditional, entry_validators, collection_validators
+from ..utils.response_cache import response_cache
+from ..utils.batch import add_ids_argument, batch_model, load_batch
+from ..utils.unit_of_work import after_commit
+from ..models.videos import Video
+from ..models.comments import Comment
+from .video_routes import video_model
 
 get_parser = reqparse.RequestParser()
 get_parser.add_argument("username", required=False)
@@ -15,6 +25,15 @@ post_parser.add_argument("api_key")
 delete_parser = post_parser.copy()
 delete_parser.remove_argument("username")
 
+add_pagination_arguments(get_parser)
+add_stream_argument(get_parser)
+get_parser.add_argument("expand", required=False, choices=("videos",),
+                        help="set to videos to embed each user's videos")
+
+batch_parser = add_ids_argument(reqparse.RequestParser())
+batch_parser.add_argument("expand", required=False, choices=("videos",),
+                          help="set to videos to embed each user's videos")
+
 user_model = api.model("User", {
     "username": fields.String,
     "id": fields.Integer
@@ -24,31 +43,62 @@ new_user_model = api.inherit('New User', user_model, {
     "key": fields.String
 })
 
+user_videos_model = api.inherit('User Videos', user_model, {
+    "videos": fields.List(fields.Nested(video_model))
+})
+
+user_batch_model = batch_model("User", user_videos_model, skip_none=True)
+
 
 @user_ns.route("/")
 class UserList(Resource):
-    @user_ns.marshal_list_with(user_model)
+    @conditional(collection_validators(User, Video))
+    @streamable(get_parser, User, user_videos_model, skip_none=True)
+    @user_ns.marshal_list_with(user_videos_model, skip_none=True)
     @user_ns.expect(get_parser)
     @limiter.exempt
     def get(self):
         """
         First checks parser for any username provided and returns that user's data (if it exists) as JSON in a list.
         Otherwise, returns all users' data in JSON objects within a list.
+        Each user's videos are only included when expand is set to videos.
+        Lists are paginated by id using the limit and after arguments, with the cursor of the next page in the X-Next-Cursor header.
+        With stream set or an Accept header of application/x-ndjson, every matching user is streamed as NDJSON instead.
         """
         args = get_parser.parse_args()
+
         if args["username"]:
-            user = db.session.execute(db.select(User).filter_by(
-                username=args["username"])).first()
+            user = db.session.execute(self.list_query(args)).first()
 
             if user:
-                return [user[0].to_dict()]
+                return [self.serialize(user[0], args)]
 
             return [], 404
 
-        user_list = db.session.execute(db.select(User)).all()
-        user_list_json = [user[0].to_dict() for user in user_list]
+        users, next_cursor = paginate(self.list_query(args), User, args)
+        user_list_json = [self.serialize(user, args) for user in users]
+
+        return user_list_json, 200, page_headers(next_cursor)
+
+    @staticmethod
+    def list_query(args):
+        """
+        Returns the select of users matching the username in args, batch loading their videos if they are expanded.
+        """
+        query = db.select(User).options(
+            *User.serialization_options(args["expand"] == "videos"))
+
+        if args["username"]:
+            query = query.filter_by(username=args["username"])
+
+        return query
 
-        return user_list_json
+    @staticmethod
+    def serialize(user, args):
+        """
+        Returns the dictionary of the given user, with their videos if they are expanded.
+        """
+        return user.to_dict(args["expand"] == "videos")
 
     @user_ns.marshal_with(new_user_model)
     @user_ns.expect(post_parser)
@@ -74,10 +124,29 @@ class UserList(Resource):
         return user_info
 
 
+@user_ns.route("/batch")
+class UserBatch(Resource):
+    @conditional(collection_validators(User, Video))
+    @user_ns.marshal_with(user_batch_model)
+    @user_ns.expect(batch_parser)
+    @limiter.exempt
+    def get(self):
+        """
+        Returns the data of the users whose IDs are given in ids, in the order requested, along with the requested IDs
+        that have no user, read with a single query. Each user's videos are only included when expand is set to videos.
+        """
+        args = batch_parser.parse_args()
+        expand = args["expand"] == "videos"
+        users, missing = load_batch(User, args["ids"], User.serialization_options(expand))
+
+        return {"results": [user.to_dict(expand) for user in users], "missing": missing}
+
+
 @user_ns.route("/<int:id>")
 class Users(Resource):
     method_decorators = [require_api_key]
 
+    @conditional(entry_validators(User))
     @user_ns.marshal_with(user_model)
     @limiter.exempt
     def get(self, id):
@@ -102,6 +171,7 @@ class Users(Resource):
             return {}, 400
 
         user.update_from_args(args)
+        after_commit(key_cache.invalidate_user, user.id)
 
         return user.to_dict()
 
@@ -119,16 +189,20 @@ class Users(Resource):
             return {}, 400
 
         user.update_from_args(args)
+        after_commit(key_cache.invalidate_user, user.id)
 
         return user.to_dict()
 
     @user_ns.expect(delete_parser)
     def delete(self, id):
         """
-        Deletes user with ID provided from database and returns JSON object with a message indicating it's been deleted and the ID of the user.
+        Deletes user with ID provided from database, along with their videos and comments, and returns JSON object with a message indicating it's been deleted and the ID of the user.
         """
         user = User.get_by_id(id)
+        stale_tags = user.cache_tags() | {"usernames"} | Video.prepare_cascade_delete(Video.user_id == id) | \
+            Comment.prepare_cascade_delete(Comment.user_id == id)
         db.session.delete(user)
-        db.session.commit()
+        after_commit(key_cache.invalidate_user, id)
+        after_commit(response_cache.invalidate, stale_tags)
 
         return {"contents": "user delete", "id": id}
@@ -1,26 +1,70 @@
+import contextlib
 from ..models.videos import Video
 from ..models.users import User
 from ..models.cities import City
+from ..models.comments import Comment
 from .. import video_ns
-from flask_restx import Resource, fields, reqparse, inputs
+from flask import request
+from flask_restx import Resource, fields, reqparse, inputs, abort
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
 from .. import db, api
-from ..utils.url import verify_youtube_url
+from ..utils.url import verify_youtube_url, verify_youtube_urls
+from ..utils.verification import verification_is_async, queue_verification
 from ..utils.APIKEY.require_key import require_api_key
+from ..utils.pagination import add_pagination_arguments, add_sort_argument, paginate, page_headers, sort_order, \
+    cursor_value
+from ..utils.bulk import read_bulk_items, parse_bulk_item
+from ..utils.batch import add_ids_argument, batch_model, load_batch
+from ..utils.unit_of_work import after_commit
+from ..utils.idempotency import idempotent
+from ..utils.youtube import URL_DOMAINS, url_hash
+from ..utils.streaming import add_stream_argument, streamable
+from ..utils.etags import conditional, entry_validators, collection_validators, bump_table_versions
+from ..utils.response_cache import response_cache, cached
+from ..utils.search import index_new_entries, remove_entry
+from .comment_routes import comment_model
+from ..utils.geo import (latitude, longitude, coordinates, radius, bounding_box, grid_cell, grid_cells, radius_box,
+                         within_box, within_radius)
 
 
 get_parser = reqparse.RequestParser()
 get_parser.add_argument("url", required=False,
-                        type=inputs.URL(schemes=["http", "https"], domains=["youtube.com", "www.youtube.com"]))
+                        type=inputs.URL(schemes=["http", "https"], domains=URL_DOMAINS))
 get_parser.add_argument("date", required=False,
                         type=inputs.date_from_iso8601, help="date should be iso8601")
+get_parser.add_argument("city", required=False, help="name of the city")
 
 patch_parser = get_parser.copy()
 patch_parser.add_argument("description", required=False)
+patch_parser.add_argument("lat", required=False, type=latitude,
+                          help="latitude should be between -90 and 90")
+patch_parser.add_argument("lon", required=False, type=longitude,
+                          help="longitude should be between -180 and 180")
 
 post_parser = patch_parser.copy()
 post_parser.add_argument("user_id", required=True, type=int)
 post_parser.replace_argument("url", required=True,
-                             type=inputs.URL(schemes=["http", "https"], domains=["youtube.com", "www.youtube.com"]))
+                             type=inputs.URL(schemes=["http", "https"], domains=URL_DOMAINS))
+
+comments_parser = add_pagination_arguments(reqparse.RequestParser())
+batch_parser = add_ids_argument(reqparse.RequestParser())
+
+add_pagination_arguments(get_parser)
+add_sort_argument(get_parser, "date")
+add_stream_argument(get_parser)
+get_parser.add_argument("user_id", required=False, type=int,
+                        help="ID of the uploader")
+get_parser.add_argument("date_from", required=False, type=inputs.date_from_iso8601,
+                        help="date_from should be iso8601")
+get_parser.add_argument("date_to", required=False, type=inputs.date_from_iso8601,
+                        help="date_to should be iso8601")
+get_parser.add_argument("near", required=False, type=coordinates,
+                        help="near should be lat,lon")
+get_parser.add_argument("radius_km", required=False, type=radius,
+                        help="radius_km should be a positive number of kilometres")
+get_parser.add_argument("bbox", required=False, type=bounding_box,
+                        help="bbox should be west,south,east,north")
 
 video_model = api.model("Video", {
     "url": fields.String(description="The url of the video"),
@@ -28,72 +72,334 @@ video_model = api.model("Video", {
     "description": fields.String(description="Optional description of the video"),
     "city": fields.String(description="Optional city where video was taken"),
     "user": fields.String(description="The username of the uploader"),
-    "date": fields.String(description="Date when video occurred in iso8601 format")
+    "date": fields.String(description="Date when video occurred in iso8601 format"),
+    "status": fields.String(description="Whether the url is verified, pending verification or invalid"),
+    "lat": fields.Float(description="Optional latitude where video was taken"),
+    "lon": fields.Float(description="Optional longitude where video was taken"),
+    "comment_count": fields.Integer(description="Number of comments on the video"),
+    "last_comment_at": fields.DateTime(description="When the newest comment on the video was posted, if any")
+})
+
+video_batch_model = batch_model("Video", video_model)
+
+bulk_video_model = api.model("Bulk Video", {
+    "url": fields.String(required=True, description="The url of the video"),
+    "user_id": fields.Integer(required=True, description="ID of the uploader"),
+    "date": fields.String(description="Date when video occurred in iso8601 format"),
+    "description": fields.String(description="Optional description of the video"),
+    "city": fields.String(description="Optional name of the city where video was taken"),
+    "lat": fields.Float(description="Optional latitude where video was taken"),
+    "lon": fields.Float(description="Optional longitude where video was taken")
+})
 
+bulk_result_model = api.model("Bulk Video Result", {
+    "index": fields.Integer(description="Position of the item in the request"),
+    "status": fields.Integer(description="HTTP status of this item: 201, 202, 400, 404 or 409"),
+    "id": fields.Integer(description="ID of the created video"),
+    "url": fields.String(description="The url of the video"),
+    "message": fields.String(description="Why the item was rejected")
+})
+
+bulk_response_model = api.model("Bulk Video Response", {
+    "created": fields.Integer(description="Number of videos created"),
+    "results": fields.List(fields.Nested(bulk_result_model))
 })
 
 
+def check_coordinates(args):
+    """
+    Raises a 400 error unless lat and lon in args are either both provided or both left out.
+    """
+    if (args["lat"] is None) != (args["lon"] is None):
+        abort(400, "lat and lon must be given together")
+
+
+def check_url_is_free(url, video=None):
+    """
+    Raises a 409 error if a video other than the given one already links to the same YouTube video as url.
+    """
+    existing = Video.get_by_url(url)
+    if existing is not None and existing is not video:
+        abort(409, "A video with this url already exists")
+
+
+@contextlib.contextmanager
+def url_conflicts():
+    """
+    Turns the unique index violation of a video write that raced another request storing the same YouTube video,
+    after both passed check_url_is_free, into the same 409 error. Writes in the block have to be flushed in it.
+    """
+    try:
+        yield
+    except IntegrityError as error:
+        if "url_hash" not in str(error.orig):
+            raise
+
+        abort(409, "A video with this url already exists")
+
+
 @video_ns.route("/")
 class VideoList(Resource):
+    @conditional(collection_validators(Video, User, City))
+    @streamable(get_parser, Video, video_model)
+    @cached(get_parser)
     @video_ns.marshal_list_with(video_model)
     @video_ns.expect(get_parser)
     def get(self):
         """
-        If url is provided, searches for video with that url and returns it as a JSON object in a list.
-        Otherwise, if a date is provided, searches for all videos with provided date as a property and returns their data as JSON objects in a list.
-        Otherwise, returns all videos' data as JSON objects in a list.
+        If url is provided, searches for video with that url, or any other link to the same YouTube video, and returns it as a JSON object in a list.
+        Otherwise, returns the data of every video matching all of the filters provided as JSON objects in a list:
+        an exact date or a range from date_from to date_to (inclusive), the uploader's user_id, the city name,
+        a distance with near=lat,lon and radius_km, and a bbox of west,south,east,north.
+        Lists are sorted by id, or by date and then id, with sort (prefixed with a minus for descending order),
+        and paginated using the limit and after arguments, with the cursor of the next page in the X-Next-Cursor header.
+        With stream set or an Accept header of application/x-ndjson, every matching video is streamed as NDJSON instead.
         """
         args = get_parser.parse_args()
 
         if args["url"]:
-            video = db.session.execute(
-                db.select(Video).filter_by(url=args["url"])).first()
+            video = db.session.execute(self.list_query(args)).first()
 
             if video:
                 return [video[0].to_dict()]
 
             return [], 404
 
+        dated = any(args[name] for name in ("date", "date_from", "date_to"))
+        videos, next_cursor = paginate(
+            self.list_query(args), Video, args, nullable=not dated)
+        video_list_json = [video.to_dict() for video in videos]
+
+        return video_list_json, 200, page_headers(next_cursor)
+
+    @staticmethod
+    def list_query(args):
+        """
+        Returns the select of videos matching every url, date, user, city and location filter in args,
+        raising a 404 error if the user or city does not exist.
+        Date ranges are served by the (date, id) index, and user filters by the (user_id, date) index.
+        Location filters only scan the grid cells around the area through the grid cell index.
+        """
+        query = db.select(Video).options(*Video.serialization_options())
+
+        if args["url"]:
+            query = query.where(Video.url_hash == url_hash(args["url"]))
+
         if args["date"]:
-            videos = db.session.execute(
-                db.select(Video).filter_by(date=args["date"])).all()
+            query = query.filter_by(date=args["date"])
+
+        date_from, date_to = VideoList.date_range(args)
+        if date_from:
+            query = query.where(Video.date >= date_from)
+
+        if date_to:
+            query = query.where(Video.date <= date_to)
+
+        if args["user_id"] is not None:
+            query = query.filter_by(
+                user_id=User.get_by_id(args["user_id"]).id)
+
+        if args["city"]:
+            query = query.filter_by(city_id=City.get_by_name(args["city"]).id)
+
+        if args["near"]:
+            if args["radius_km"] is None:
+                abort(400, "radius_km is required with near")
+
+            query = query.where(
+                *within_radius(Video, *args["near"], args["radius_km"]))
 
-            if not videos:
-                return {}, 404
+        if args["bbox"]:
+            query = query.where(*within_box(Video, *args["bbox"]))
 
-            video_list_json = [video[0].to_dict() for video in videos]
+        return query
 
-            return video_list_json
+    @staticmethod
+    def date_range(args):
+        """
+        Returns the date_from and date_to in args, with the one a page by date starts from narrowed to its cursor.
+        SQLite ranges over an index with the first bound it is given on a column, so the page's own bound has to
+        replace the wider one for a deep page to start at the cursor instead of at date_from or date_to.
+        """
+        date_from, date_to = args["date_from"], args["date_to"]
+        column, cursor_date = cursor_value(Video, args)
+        if cursor_date is None:
+            return date_from, date_to
+
+        if sort_order(Video, args)[1]:
+            return date_from, date_to and min(date_to, cursor_date)
 
-        video_list = db.session.execute(db.select(Video)).all()
-        video_list_json = [video[0].to_dict() for video in video_list]
+        return date_from and max(date_from, cursor_date), date_to
+
+    @staticmethod
+    def cache_tags(args):
+        """
+        Returns the response cache tags that the list of videos matching args depends on.
+        """
+        if args["url"]:
+            return {"videos:all", "videos", "usernames"}
+
+        if args["date"]:
+            return {"videos:all", f"videos:date={args['date']}", "usernames"}
 
-        return video_list_json
+        if args["user_id"] is not None:
+            return {"videos:all", f"videos:user={args['user_id']}", f"user:{args['user_id']}"}
 
+        if args["city"]:
+            return {"videos:all", f"videos:city={City.get_by_name(args['city']).id}", "usernames"}
+
+        box = None
+        if args["near"] and args["radius_km"]:
+            box = radius_box(*args["near"], args["radius_km"])
+        elif args["bbox"]:
+            box = args["bbox"]
+
+        cells = grid_cells(*box) if box else None
+        if cells is not None:
+            return {f"videos:cell={cell}" for cell in cells} | {"videos:all", "usernames"}
+
+        return {"videos:all", "videos", "usernames"}
+
+    @idempotent
     @video_ns.marshal_with(video_model)
     @video_ns.expect(post_parser)
     def post(self):
         """
         Verifies that url provided is valid, and if so, creates a new video in database associated with the user whose ID was provided.
+        Returns a 409 error if another video already links to the same YouTube video. In async verification mode, the video is instead created as pending, verified in the background and returned with a 202 status.
         Returns a JSON object containing the data of the entry created in database.
         """
         args = post_parser.parse_args()
+        check_coordinates(args)
+        check_url_is_free(args["url"])
+        pending = verification_is_async()
 
-        if not verify_youtube_url(args['url']):
+        if not pending and not verify_youtube_url(args['url']):
             return {}, 400
 
         user = User.get_by_id(args["user_id"])
+        city = City.get_by_name(args["city"]) if args["city"] else None
         new_video = Video(
-            url=args["url"], user=user, date=args["date"], description=args["description"])
-        new_video.save()
+            url=args["url"], user=user, date=args["date"], description=args["description"],
+            city=city, lat=args["lat"], lon=args["lon"],
+            status=Video.PENDING if pending else Video.VERIFIED)
+        with url_conflicts():
+            new_video.save()
+
+        if pending:
+            queue_verification(new_video.id, new_video.url)
+            return new_video.to_dict(), 202
 
         return new_video.to_dict()
 
 
+@video_ns.route("/batch")
+class VideoBatch(Resource):
+    @conditional(collection_validators(Video, User, City))
+    @video_ns.marshal_with(video_batch_model)
+    @video_ns.expect(batch_parser)
+    def get(self):
+        """
+        Returns the data of the videos whose IDs are given in ids, in the order requested, along with the requested IDs
+        that have no video, read with a single query.
+        """
+        args = batch_parser.parse_args()
+        videos, missing = load_batch(Video, args["ids"], Video.serialization_options())
+
+        return {"results": [video.to_dict() for video in videos], "missing": missing}
+
+
+@video_ns.route("/bulk")
+class VideoBulk(Resource):
+    @idempotent
+    @video_ns.marshal_with(bulk_response_model)
+    @video_ns.expect([bulk_video_model])
+    def post(self):
+        """
+        Creates many videos at once from a JSON array or NDJSON body, validating each item with the same rules as a single video post.
+        URLs are verified concurrently and all valid items are inserted in a single transaction.
+        Returns the number of videos created and a result for every item, in request order.
+        """
+        items = read_bulk_items(request)
+        results = [{"index": index} for index in range(len(items))]
+        parsed = {}
+
+        for index, item in enumerate(items):
+            args, message = parse_bulk_item(post_parser, item)
+            if args is None:
+                results[index].update(status=400, message=message)
+            elif (args["lat"] is None) != (args["lon"] is None):
+                results[index].update(
+                    status=400, message="lat and lon must be given together")
+            else:
+                parsed[index] = args
+
+        user_ids = list({args["user_id"] for args in parsed.values()})
+        hashes = [url_hash(args["url"]) for args in parsed.values()]
+        known_user_ids = set(db.session.execute(
+            db.select(User.id).where(User.id.in_(user_ids))).scalars())
+        taken_hashes = set(db.session.execute(
+            db.select(Video.url_hash).where(Video.url_hash.in_(hashes))).scalars())
+        city_names = list({args["city"]
+                          for args in parsed.values() if args["city"]})
+        city_ids = dict(db.session.execute(
+            db.select(City.name, City.id).where(City.name.in_(city_names))).all())
+
+        for index, args in list(parsed.items()):
+            results[index]["url"] = args["url"]
+            if args["user_id"] not in known_user_ids:
+                results[index].update(status=404, message="User not found")
+                del parsed[index]
+            elif args["city"] and args["city"] not in city_ids:
+                results[index].update(status=404, message="City not found")
+                del parsed[index]
+            elif url_hash(args["url"]) in taken_hashes:
+                results[index].update(
+                    status=409, message="A video with this url already exists")
+                del parsed[index]
+            else:
+                taken_hashes.add(url_hash(args["url"]))
+
+        pending = verification_is_async()
+        if not pending:
+            verified = verify_youtube_urls(
+                [args["url"] for args in parsed.values()])
+            for index, args in list(parsed.items()):
+                if not verified[args["url"]]:
+                    results[index].update(
+                        status=400, message="Video url could not be verified")
+                    del parsed[index]
+
+        status = Video.PENDING if pending else Video.VERIFIED
+        rows = [{"url": args["url"], "url_hash": url_hash(args["url"]), "user_id": args["user_id"],
+                 "date": args["date"], "description": args["description"], "status": status,
+                 "city_id": city_ids.get(args["city"]), "lat": args["lat"], "lon": args["lon"],
+                 "geo_cell": grid_cell(args["lat"], args["lon"])} for args in parsed.values()]
+
+        if rows:
+            with url_conflicts():
+                db.session.execute(insert(Video), rows)
+            bump_table_versions(db.session.connection(), {Video.__tablename__})
+            new_ids = dict(db.session.execute(db.select(Video.url, Video.id).where(
+                Video.url_hash.in_([row["url_hash"] for row in rows]))).all())
+            index_new_entries(Video, [(new_ids[row["url"]], row["description"]) for row in rows])
+            after_commit(response_cache.invalidate, set().union(
+                *(Video.list_cache_tags(row["date"], row["user_id"], row["city_id"], row["geo_cell"]) for row in rows)))
+
+            for index, args in parsed.items():
+                results[index].update(
+                    status=202 if pending else 201, id=new_ids[args["url"]])
+                if pending:
+                    queue_verification(new_ids[args["url"]], args["url"])
+
+        return {"created": len(rows), "results": results}
+
+
 @video_ns.route("/<int:id>")
 class Videos(Resource):
     method_decorators = [require_api_key]
 
+    @conditional(entry_validators(Video))
     @video_ns.marshal_with(video_model)
     def get(self, id):
         """
@@ -103,6 +409,7 @@ class Videos(Resource):
 
         return video.to_dict()
 
+    @idempotent
     @video_ns.marshal_with(video_model)
     @video_ns.expect(post_parser)
     def put(self, id):
@@ -112,35 +419,76 @@ class Videos(Resource):
         video = Video.get_by_id(id)
         args = post_parser.parse_args()
 
-        if not verify_youtube_url(args['url']):
-            return {}, 400
-
-        video.update_from_args(args)
-
-        return video.to_dict()
+        return self.update_video(video, args)
 
+    @idempotent
     @video_ns.marshal_with(video_model)
     @video_ns.expect(patch_parser)
     def patch(self, id):
         """
         Updates any video fields using provided data and returns comment data as JSON.
+        The url is only verified when a new one is provided.
         """
         args = patch_parser.parse_args()
+        video = Video.get_by_id(id)
 
-        if not verify_youtube_url(args['url']):
+        return self.update_video(video, args)
+
+    @staticmethod
+    def update_video(video, args):
+        """
+        Verifies any new url provided (or marks the video pending in async verification mode) and then updates the video from args.
+        A url linking to the YouTube video already linked to is not new, while one linking to another video's is rejected with a 409 error.
+        """
+        check_coordinates(args)
+        new_url = args["url"] and url_hash(args["url"]) != video.url_hash
+        if new_url:
+            check_url_is_free(args["url"], video)
+
+        pending = new_url and verification_is_async()
+
+        if new_url and not pending and not verify_youtube_url(args['url']):
             return {}, 400
 
-        video = Video.get_by_id(id)
-        video.update_from_args(args)
+        if pending:
+            video.status = Video.PENDING
+
+        with url_conflicts():
+            video.update_from_args(args)
+
+        if pending:
+            queue_verification(video.id, video.url)
+            return video.to_dict(), 202
 
         return video.to_dict()
 
     def delete(self, id):
         """
-        Deletes video with ID provided from database and returns JSON object with a message indicating it's been deleted and the ID of the video.
+        Deletes video with ID provided from database, along with its comments, and returns JSON object with a message indicating it's been deleted and the ID of the video.
         """
         video = Video.get_by_id(id)
+        stale_tags = video.cache_tags() | {"video_urls"} | Comment.prepare_cascade_delete(Comment.video_id == id, count=False)
+        remove_entry(video)
         db.session.delete(video)
-        db.session.commit()
+        after_commit(response_cache.invalidate, stale_tags)
 
         return {"contents": "video delete", "id": id}
+
+
+@video_ns.route("/<int:id>/comments")
+class VideoComments(Resource):
+    @conditional(collection_validators(Comment, Video, User))
+    @video_ns.marshal_list_with(comment_model)
+    @video_ns.expect(comments_parser)
+    def get(self, id):
+        """
+        Returns the comments on the video whose ID was specified as JSON objects in a list, newest first.
+        Lists are paginated using the limit and after arguments, with the cursor of the next page in the X-Next-Cursor header,
+        and each page is read backwards along the (video_id, id) index.
+        """
+        args = comments_parser.parse_args()
+        video = Video.get_by_id(id)
+        query = db.select(Comment).options(*Comment.serialization_options()).filter_by(video_id=video.id)
+        comments, next_cursor = paginate(query, Comment, {**args, "sort": "-id"})
+
+        return [comment.to_dict() for comment in comments], 200, page_headers(next_cursor)
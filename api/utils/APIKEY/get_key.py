@@ -1,13 +1,54 @@
-from flask import request
+from flask import g, request
+from flask_limiter.util import get_remote_address
 
 
-def get_api_key():
-    api_key = None
-    content_length = request.content_length
-    if not content_length:
+API_KEY_HEADER = "X-API-Key"
+
+
+def extract_api_key():
+    """
+    Returns the API key sent in the X-API-Key header, the api_key query argument or the api_key field of a JSON body,
+    checked in that order, or None if the request has none.
+    """
+    api_key = request.headers.get(API_KEY_HEADER) or request.args.get("api_key")
+    if api_key:
         return api_key
-    if request.args:
-        api_key = request.args.get("api_key")
-    elif request.json:
-        api_key = request.json.get("api_key")
-    return api_key
+
+    if request.content_length:
+        body = request.get_json(silent=True)
+        if isinstance(body, dict) and isinstance(body.get("api_key"), str):
+            return body["api_key"]
+
+    return None
+
+
+def get_api_key():
+    """
+    Returns the API key of the current request, extracting it only once per request and caching it on flask.g.
+    """
+    if "api_key" not in g:
+        g.api_key = extract_api_key()
+
+    return g.api_key
+
+
+def load_api_key():
+    """
+    Pre-request stage that extracts the API key before the limiter and route handlers ask for it.
+    """
+    get_api_key()
+
+
+def get_rate_limit_key():
+    """
+    Returns the limiter bucket of the current request: the user owning its API key, or the client address for
+    anonymous requests and requests with an invalid key, so that sending made-up keys does not escape the limit.
+    The key is resolved once per request, and the result is shared with require_api_key.
+    """
+    from .require_key import get_api_user_id
+
+    user_id = get_api_user_id()
+    if user_id is None:
+        return get_remote_address()
+
+    return f"user:{user_id}"
@@ -0,0 +1,22 @@
+from ..lru_cache import LRUCache
+from ... import app
+
+
+class KeyCache(LRUCache):
+    """
+    LRU cache mapping verified API keys to the IDs of the users they belong to.
+    """
+
+    def invalidate_user(self, user_id):
+        """
+        Removes every cached key belonging to the given user.
+        """
+        with self._lock:
+            stale_keys = [key for key, (cached_id, _) in self._entries.items()
+                          if cached_id == user_id]
+            for key in stale_keys:
+                del self._entries[key]
+
+
+key_cache = KeyCache(max_size=app.config["API_KEY_CACHE_SIZE"],
+                     ttl=app.config["API_KEY_CACHE_TTL"])
@@ -1,7 +1,30 @@
 from ...models.users import User
 import functools
-from flask import request
-from ... import db
+from flask import g, request
+from .get_key import get_api_key
+from .key_cache import key_cache
+
+
+def get_api_user_id():
+    """
+    Returns the ID of the user owning the current request's API key, or None if there is no key or it is invalid.
+    The key is resolved through key_cache, falling back to the indexed key lookup, and the result is cached on flask.g.
+    """
+    if "api_user_id" in g:
+        return g.api_user_id
+
+    api_key = get_api_key()
+    user_id = key_cache.get(api_key) if api_key else None
+
+    if api_key and user_id is None:
+        user = User.get_from_key(api_key)
+        if user:
+            user_id = user.id
+            key_cache.set(api_key, user_id)
+
+    g.api_user_id = user_id
+
+    return user_id
 
 
 def require_api_key(func):
@@ -9,18 +32,13 @@ def require_api_key(func):
     def inner(*args, **kwargs):
         if request.method == "GET":
             return func(*args, **kwargs)
-        elif request.method != "GET" and request.json:
-            possible_key = request.json.get("api_key")
-            if not possible_key:
-                return {"message": "No API key provided"}, 400
-            users = db.session.query(User)
-            for user in users:
-                if user.key == possible_key:
-                    return func(*args, **kwargs)
 
+        if not get_api_key():
+            return {"message": "No API key provided"}, 400
+
+        if get_api_user_id() is None:
             return {"message": "Invalid API key provided"}, 403
 
-        else:
-            return {"message": "No API key provided"}, 400
+        return func(*args, **kwargs)
 
     return inner
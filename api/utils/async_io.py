@@ -0,0 +1,63 @@
+import asyncio
+import contextvars
+import functools
+from sqlalchemy.util import await_only, greenlet_spawn
+
+
+serving_loop = None
+background_tasks = set()
+
+
+def start_serving(loop):
+    """
+    Marks the given event loop as the one the ASGI app serves requests on.
+    """
+    global serving_loop
+    serving_loop = loop
+
+
+async def stop_serving():
+    """
+    Waits for the background tasks still running on the serving event loop, then forgets the loop.
+    """
+    global serving_loop
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    serving_loop = None
+
+
+def serving_async():
+    """
+    Returns True if the caller runs on the ASGI app's event loop, where I/O has to be awaited with await_only.
+    """
+    try:
+        return serving_loop is not None and asyncio.get_running_loop() is serving_loop
+    except RuntimeError:
+        return False
+
+
+def spawn(func, *args):
+    """
+    Runs func with args in a greenlet of its own on the serving event loop, outside of the current request's context,
+    and returns the task running it.
+    """
+    task = serving_loop.create_task(greenlet_spawn(func, *args), context=contextvars.Context())
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+    return task
+
+
+def off_loop(func):
+    """
+    Decorates a function making blocking calls, such as to an SQLite file that another process may hold locked,
+    so that on the serving event loop it runs in a worker thread awaited with await_only, leaving the loop free to
+    serve other requests while it waits. Anywhere else it is called directly.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if serving_async():
+            return await_only(asyncio.to_thread(func, *args, **kwargs))
+
+        return func(*args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,50 @@
+from flask import current_app
+from flask_restx import abort, fields
+from .. import db, api
+
+
+def id_list(value):
+    """
+    Parses an "id,id,..." request argument into the list of its IDs, in the order given.
+    """
+    return [int(id) for id in value.split(",") if id.strip()]
+
+
+def add_ids_argument(parser):
+    """
+    Adds the required ids argument, a comma-separated list of the IDs of the entries to return, to the given request parser.
+    """
+    parser.add_argument("ids", required=True, type=id_list,
+                        help="ids should be a comma-separated list of IDs")
+
+    return parser
+
+
+def batch_model(name, entry_model, **kwargs):
+    """
+    Returns the model of a batch response holding the found entries of the given model and the missing IDs.
+    """
+    return api.model(f"{name} Batch", {
+        "results": fields.List(fields.Nested(entry_model, **kwargs),
+                               description="Entries found, in the order their IDs were requested"),
+        "missing": fields.List(fields.Integer, description="Requested IDs that have no entry")
+    })
+
+
+def load_batch(model, ids, options=()):
+    """
+    Returns the entries of the given model with the given IDs, in the order the IDs are given and without repeats,
+    along with the IDs that have no entry. All entries are read in one IN query with the given loader options.
+    Raises a 400 error if there are more than BATCH_MAX_IDS distinct IDs.
+    """
+    ids = list(dict.fromkeys(ids))
+    max_ids = current_app.config["BATCH_MAX_IDS"]
+    if len(ids) > max_ids:
+        abort(400, f"ids should hold at most {max_ids} IDs")
+
+    entries = {}
+    if ids:
+        entries = {entry.id: entry for entry in db.session.execute(
+            db.select(model).where(model.id.in_(ids)).options(*options)).unique().scalars()}
+
+    return [entries[id] for id in ids if id in entries], [id for id in ids if id not in entries]
@@ -0,0 +1,61 @@
+import json
+from flask import current_app
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import BadRequest, HTTPException
+
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+
+class BulkItemRequest:
+    """
+    Stands in for the request when running a request parser over one item of a bulk payload.
+    """
+
+    def __init__(self, item):
+        self.item = item
+        self.values = MultiDict()
+
+    def get_json(self, silent=False):
+        return self.item
+
+
+def read_bulk_items(request):
+    """
+    Returns the list of items in the request body, which is either a JSON array or NDJSON (one JSON object per line).
+    Raises a 400 error if the body is malformed or holds more than BULK_MAX_ITEMS items.
+    """
+    if request.mimetype == NDJSON_MIMETYPE:
+        try:
+            items = [json.loads(line)
+                     for line in request.get_data(as_text=True).splitlines() if line.strip()]
+        except ValueError:
+            raise BadRequest("Body is not valid NDJSON")
+    else:
+        items = request.get_json(silent=True)
+        if not isinstance(items, list):
+            raise BadRequest("Body must be a JSON array of videos")
+
+    if len(items) > current_app.config["BULK_MAX_ITEMS"]:
+        raise BadRequest(
+            f"At most {current_app.config['BULK_MAX_ITEMS']} items may be sent at once")
+
+    return items
+
+
+def parse_bulk_item(parser, item):
+    """
+    Runs the given parser over one bulk item and returns its args, or None and an error message if it is invalid.
+    """
+    if not isinstance(item, dict):
+        return None, "Item must be a JSON object"
+
+    try:
+        return parser.parse_args(req=BulkItemRequest(item)), None
+
+    except HTTPException as error:
+        errors = getattr(error, "data", {}).get("errors")
+        if errors:
+            return None, "; ".join(f"{name}: {message}" for name, message in errors.items())
+
+        return None, error.description
@@ -1,11 +1,25 @@
 from .. import app, db
+from .APIKEY.key_cache import key_cache
+from .migrations import upgrade
+from .response_cache import response_cache
+from .search import get_search_backend
 
 
 def db_cleanup():
     """
-    Clears all contents from database.
+    Clears all contents from database and rebuilds it at the latest schema version.
+    Only allowed when TESTING is set, since it destroys every row.
     """
+    if not app.config["TESTING"]:
+        raise RuntimeError("db_cleanup is only allowed when TESTING is set")
+
     with app.app_context():
         db.drop_all()
-        db.create_all()
-        db.session.commit()
+        search_backend = get_search_backend()
+        if search_backend is not None:
+            with db.engine.begin() as connection:
+                search_backend.drop(connection)
+
+    upgrade()
+    key_cache.clear()
+    response_cache.clear()
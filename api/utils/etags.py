@@ -0,0 +1,161 @@
+import datetime
+import functools
+import hashlib
+from flask import Response, abort, request
+from flask_restx.utils import unpack
+from sqlalchemy import event
+from werkzeug.http import http_date, quote_etag
+from .. import db
+
+
+table_versions = db.Table(
+    "table_version",
+    db.Column("name", db.String(50), primary_key=True),
+    db.Column("version", db.Integer, nullable=False, default=0),
+    db.Column("updated_at", db.DateTime, nullable=False),
+)
+
+
+def bump_table_versions(connection, table_names):
+    """
+    Increments the collection version of every named table, within the caller's transaction.
+    """
+    if not table_names:
+        return
+
+    connection.execute(table_versions.update().where(table_versions.c.name.in_(sorted(table_names))).values(
+        version=table_versions.c.version + 1, updated_at=datetime.datetime.utcnow()))
+
+
+def version_column():
+    """
+    Returns a new version column for a model's entry ETags, which starts at 1 and is incremented in SQL by every UPDATE
+    of the row. Concurrent updates both count, and the last one wins, as they did before entries had versions.
+    """
+    return db.Column(db.Integer, nullable=False, server_default="1", onupdate=db.literal_column("version") + 1)
+
+
+@event.listens_for(db.session, "after_flush")
+def collect_flushed_tables(session, flush_context):
+    """
+    Records every table that had rows inserted, updated or deleted by the flush, to bump its collection version
+    once at commit.
+    """
+    changed = [*session.new, *session.deleted,
+               *(entry for entry in session.dirty if session.is_modified(entry))]
+    session.info.setdefault("changed_tables", set()).update(
+        entry.__table__.name for entry in changed if getattr(entry, "__table__", None) is not None)
+
+
+@event.listens_for(db.session, "before_commit")
+def bump_changed_table_versions(session):
+    """
+    Bumps the collection version of every table the transaction changed through the session, in one statement made
+    just before the commit, so that the shared version rows stay locked as briefly as possible.
+    """
+    session.flush()
+    bump_table_versions(session.connection(), session.info.pop("changed_tables", set()))
+
+
+@event.listens_for(db.session, "after_rollback")
+def discard_changed_tables(session):
+    session.info.pop("changed_tables", None)
+
+
+def entry_validators(model):
+    """
+    Returns a function that takes an entry ID and returns the strong ETag and last modification time of that entry's
+    dictionary, built from the versions of the entry and of every relationship its to_dict includes, in one select.
+    Raises a 404 error if the entry does not exist.
+    """
+    relationships = model.serialized_relationships()
+    targets = [relationship.property.mapper.class_ for relationship in relationships]
+
+    def validators(id):
+        query = db.select(model.version, *[target.version for target in targets],
+                          model.updated_at, *[target.updated_at for target in targets]).where(model.id == id)
+        for relationship in relationships:
+            query = query.outerjoin(relationship)
+
+        row = db.session.execute(query).first()
+        if row is None:
+            abort(404)
+
+        versions = row[:len(targets) + 1]
+        etag = f"{model.__tablename__}-{id}-" + \
+            ".".join(str(version or 0) for version in versions)
+
+        return etag, max(time for time in row[len(targets) + 1:] if time)
+
+    return validators
+
+
+def collection_validators(*models):
+    """
+    Returns a function that returns the strong ETag and last modification time of a list of entries of the first model,
+    built from the collection versions of every given model's table and the request's path, query string and Accept
+    header, since any of them can change the entries or their representation. The handler's URL arguments are part
+    of its path, so the function ignores them.
+    """
+    table_names = [model.__tablename__ for model in models]
+
+    def validators(**url_args):
+        rows = db.session.execute(db.select(table_versions).where(
+            table_versions.c.name.in_(table_names))).all()
+        versions = {row.name: row for row in rows}
+        query_hash = hashlib.blake2b(b"\n".join([request.path.encode(), request.query_string,
+                                                 request.headers.get("Accept", "").encode()]),
+                                     digest_size=8).hexdigest()
+        etag = f"{table_names[0]}-list-{query_hash}-" + ".".join(
+            str(versions[name].version if name in versions else 0) for name in table_names)
+
+        return etag, max((row.updated_at for row in rows), default=None)
+
+    return validators
+
+
+def conditional(get_validators):
+    """
+    Decorates a marshalled GET handler with ETag and Last-Modified headers from get_validators, which is called with the
+    handler's URL arguments. Answers 304 without calling the handler when If-None-Match or If-Modified-Since shows the
+    client already has the current version.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(resource, *args, **kwargs):
+            etag, last_modified = get_validators(*args, **kwargs)
+            headers = {"ETag": quote_etag(etag)}
+            if last_modified:
+                headers["Last-Modified"] = http_date(last_modified)
+
+            if not_modified(etag, last_modified):
+                return Response(status=304, headers=headers)
+
+            result = func(resource, *args, **kwargs)
+
+            if isinstance(result, Response):
+                result.headers.extend(headers)
+                return result
+
+            data, code, result_headers = unpack(result)
+            if code != 200:
+                return data, code, result_headers
+
+            return data, code, {**(result_headers or {}), **headers}
+
+        return wrapper
+
+    return decorator
+
+
+def not_modified(etag, last_modified):
+    """
+    Returns True if the request's conditional headers match the given validators.
+    """
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+
+    if request.if_modified_since and last_modified:
+        return last_modified.replace(microsecond=0, tzinfo=datetime.timezone.utc) <= request.if_modified_since
+
+    return False
@@ -0,0 +1,16 @@
+from sqlalchemy import event
+
+
+def enforce_foreign_keys(engine):
+    """
+    Turns on foreign key enforcement, and with it ON DELETE CASCADE, for every new connection of the given engine
+    if it is SQLite, since SQLite leaves it off unless asked on each connection.
+    """
+    if engine.dialect.name == "sqlite":
+        event.listen(engine, "connect", enable_foreign_keys)
+
+
+def enable_foreign_keys(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
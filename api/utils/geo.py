@@ -0,0 +1,121 @@
+import math
+
+
+KM_PER_DEGREE = 111.32
+GRID_SIZE = 0.02
+GRID_COLUMNS = round(360 / GRID_SIZE)
+GRID_ROWS = round(180 / GRID_SIZE)
+MAX_GRID_CELLS = 1024
+
+
+def latitude(value):
+    value = float(value)
+    if not -90 <= value <= 90:
+        raise ValueError("latitude must be between -90 and 90")
+
+    return value
+
+
+def longitude(value):
+    value = float(value)
+    if not -180 <= value <= 180:
+        raise ValueError("longitude must be between -180 and 180")
+
+    return value
+
+
+def radius(value):
+    value = float(value)
+    if value <= 0:
+        raise ValueError("radius must be positive")
+
+    return value
+
+
+def coordinates(value):
+    """
+    Parses a "lat,lon" request argument.
+    """
+    lat, lon = value.split(",")
+
+    return latitude(lat), longitude(lon)
+
+
+def bounding_box(value):
+    """
+    Parses a "west,south,east,north" request argument, in GeoJSON order.
+    """
+    west, south, east, north = value.split(",")
+    west, east = longitude(west), longitude(east)
+    south, north = latitude(south), latitude(north)
+    if south > north or west > east:
+        raise ValueError(
+            "bbox should be west,south,east,north with west <= east and south <= north")
+
+    return west, south, east, north
+
+
+def grid_cell(lat, lon):
+    """
+    Returns the ID of the grid cell of roughly 2 km square containing the given point, or None without a point.
+    """
+    if lat is None or lon is None:
+        return None
+
+    row = min(int((lat + 90) / GRID_SIZE), GRID_ROWS - 1)
+    column = min(int((lon + 180) / GRID_SIZE), GRID_COLUMNS - 1)
+
+    return row * GRID_COLUMNS + column
+
+
+def grid_cells(west, south, east, north):
+    """
+    Returns the IDs of every grid cell overlapping the given box, or None if there are more than MAX_GRID_CELLS.
+    """
+    first_row, first_column = divmod(grid_cell(south, west), GRID_COLUMNS)
+    last_row, last_column = divmod(grid_cell(north, east), GRID_COLUMNS)
+    if (last_row - first_row + 1) * (last_column - first_column + 1) > MAX_GRID_CELLS:
+        return None
+
+    return [row * GRID_COLUMNS + column
+            for row in range(first_row, last_row + 1)
+            for column in range(first_column, last_column + 1)]
+
+
+def radius_box(lat, lon, radius_km):
+    """
+    Returns the west, south, east and north edges of the box enclosing the circle of the given radius around a point.
+    The box is clipped to the map rather than wrapped around the antimeridian.
+    """
+    lat_delta = radius_km / KM_PER_DEGREE
+    lon_delta = radius_km / \
+        (KM_PER_DEGREE * max(math.cos(math.radians(lat)), 1e-6))
+
+    return (max(lon - lon_delta, -180), max(lat - lat_delta, -90),
+            min(lon + lon_delta, 180), min(lat + lat_delta, 90))
+
+
+def within_box(model, west, south, east, north):
+    """
+    Returns the filters selecting the entries of the given model inside the box, narrowed to its grid cells through the
+    grid cell index whenever the box is small enough.
+    """
+    filters = [model.lat.between(south, north), model.lon.between(west, east)]
+    cells = grid_cells(west, south, east, north)
+    if cells is not None:
+        filters.append(model.geo_cell.in_(cells))
+
+    return filters
+
+
+def within_radius(model, lat, lon, radius_km):
+    """
+    Returns the filters selecting the entries of the given model within radius_km of the point.
+    Distances use the equirectangular approximation, which is plain arithmetic in SQL and accurate to well under a
+    percent at incident scale.
+    """
+    lat_km = (model.lat - lat) * KM_PER_DEGREE
+    lon_km = (model.lon - lon) * (KM_PER_DEGREE * math.cos(math.radians(lat)))
+    distance = lat_km * lat_km + lon_km * lon_km
+
+    return [*within_box(model, *radius_box(lat, lon, radius_km)), distance <= radius_km ** 2]
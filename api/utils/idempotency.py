@@ -0,0 +1,214 @@
+import functools
+import hashlib
+import json
+import threading
+import time
+from flask import g, request
+from flask_limiter.util import get_remote_address
+from flask_restx import abort
+from flask_restx.utils import unpack
+from .lru_cache import LRUCache
+from .async_io import off_loop
+from .sqlite_file import SQLiteFile, store_for_uri
+from .unit_of_work import after_commit
+from .APIKEY.require_key import get_api_user_id
+from .. import app
+
+
+IDEMPOTENCY_KEY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+
+
+class MemoryStore:
+    """
+    Idempotency store local to this process, holding entries in a size-bounded LRU cache.
+    """
+
+    def __init__(self, max_size, ttl, lock_ttl):
+        self.ttl = ttl
+        self.lock_ttl = lock_ttl
+        self._entries = LRUCache(max_size=max_size, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def reserve(self, key, fingerprint):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._entries.set(key, (fingerprint, None), ttl=self.lock_ttl)
+
+            return entry
+
+    def complete(self, key, fingerprint, response):
+        self._entries.set(key, (fingerprint, response))
+
+    def release(self, key):
+        self._entries.delete(key)
+
+    def clear(self):
+        self._entries.clear()
+
+
+class SQLiteStore(SQLiteFile):
+    """
+    Idempotency store in a single SQLite file, shared by every process on the host that opens the same file,
+    so a retry is recognised whichever worker it reaches. Entries past max_size are evicted oldest first.
+    """
+
+    def __init__(self, path, max_size, ttl, lock_ttl, timeout=5.0):
+        self.open_file(path, timeout)
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock_ttl = lock_ttl
+        connection = self.connection
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS idempotency_keys (key TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, "
+            "response TEXT, expires_at REAL NOT NULL) WITHOUT ROWID")
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS ix_idempotency_keys_expires_at ON idempotency_keys (expires_at)")
+
+    @off_loop
+    def reserve(self, key, fingerprint):
+        now = time.time()
+        connection = self.connection
+        connection.execute("DELETE FROM idempotency_keys WHERE key = ? AND expires_at <= ?", (key, now))
+        inserted = connection.execute(
+            "INSERT OR IGNORE INTO idempotency_keys (key, fingerprint, response, expires_at) VALUES (?, ?, NULL, ?)",
+            (key, fingerprint, now + self.lock_ttl)).rowcount
+        if inserted:
+            self.evict()
+            return None
+
+        row = connection.execute(
+            "SELECT fingerprint, response FROM idempotency_keys WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+
+        fingerprint, response = row
+        return fingerprint, json.loads(response) if response is not None else None
+
+    @off_loop
+    def complete(self, key, fingerprint, response):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO idempotency_keys (key, fingerprint, response, expires_at) VALUES (?, ?, ?, ?)",
+            (key, fingerprint, json.dumps(response), time.time() + self.ttl))
+        self.evict()
+
+    @off_loop
+    def evict(self):
+        """
+        Deletes the entries closest to expiring past the first max_size.
+        """
+        self.connection.execute(
+            "DELETE FROM idempotency_keys WHERE key IN (SELECT key FROM idempotency_keys "
+            "ORDER BY expires_at DESC LIMIT -1 OFFSET ?)", (self.max_size,))
+
+    @off_loop
+    def release(self, key):
+        self.connection.execute("DELETE FROM idempotency_keys WHERE key = ?", (key,))
+
+    @off_loop
+    def clear(self):
+        self.connection.execute("DELETE FROM idempotency_keys")
+
+
+def get_store(uri, max_size, ttl, lock_ttl):
+    """
+    Returns the idempotency store for the given URI: memory:// for one per process, or sqlite:///path/to/file.db
+    for one shared by every process on the host.
+    """
+    return store_for_uri(uri, "idempotency store", MemoryStore, SQLiteStore, max_size, ttl, lock_ttl)
+
+
+def store_key(idempotency_key):
+    """
+    Returns the fixed-size key the given Idempotency-Key is stored under, scoped to the user owning the request's
+    API key, or else to the client address, so that clients never see each other's responses however simple
+    their keys are.
+    """
+    user_id = get_api_user_id()
+    scope = f"user:{user_id}" if user_id is not None else f"address:{get_remote_address()}"
+
+    return hashlib.blake2b(f"{scope}\n{idempotency_key}".encode(), digest_size=16).hexdigest()
+
+
+def request_fingerprint():
+    """
+    Returns the fingerprint of the current request's method, path, query string and body.
+    """
+    parts = [request.method.encode(), request.path.encode(), request.query_string, request.get_data()]
+
+    return hashlib.blake2b(b"\n".join(parts), digest_size=16).hexdigest()
+
+
+def record_response(key, fingerprint, response):
+    """
+    Stores the response of the request holding the given reservation, to be replayed to its retries.
+    """
+    idempotency_store.complete(key, fingerprint, response)
+    g.pop("idempotency_reservation", None)
+
+
+def idempotent(func):
+    """
+    Decorates a marshalled write handler so that requests with an Idempotency-Key header run once: a retry with the
+    same key and the same method, path and body is answered with the stored response, without running the handler.
+    Successful responses are stored once the request's unit of work has been committed, and client errors straight
+    away. Server errors are not stored, so the request can be retried.
+    Reusing a key for a different request is rejected with a 422 error, and a retry of a request that is still being
+    served with a 409 error.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        idempotency_key = request.headers.get(IDEMPOTENCY_KEY_HEADER)
+        if idempotency_key is None:
+            return func(*args, **kwargs)
+
+        if not idempotency_key or len(idempotency_key) > MAX_KEY_LENGTH:
+            abort(400, f"{IDEMPOTENCY_KEY_HEADER} should hold 1 to {MAX_KEY_LENGTH} characters")
+
+        key, fingerprint = store_key(idempotency_key), request_fingerprint()
+        entry = idempotency_store.reserve(key, fingerprint)
+        if entry is not None:
+            stored_fingerprint, response = entry
+            if stored_fingerprint != fingerprint:
+                abort(422, f"{IDEMPOTENCY_KEY_HEADER} was already used for a different request")
+
+            if response is None:
+                abort(409, f"A request with this {IDEMPOTENCY_KEY_HEADER} is still being served")
+
+            data, code, headers = response
+            return data, code, {**headers, REPLAYED_HEADER: "true"}
+
+        g.idempotency_reservation = key
+        data, code, headers = unpack(func(*args, **kwargs))
+        response = (data, code, dict(headers or {}))
+        if code < 400:
+            after_commit(record_response, key, fingerprint, response)
+        elif code < 500:
+            record_response(key, fingerprint, response)
+
+        return data, code, headers
+
+    doc = getattr(wrapper, "__apidoc__", {})
+    wrapper.__apidoc__ = {**doc, "params": {**doc.get("params", {}), IDEMPOTENCY_KEY_HEADER: {
+        "in": "header", "type": "string",
+        "description": "Optional key, unique to this request, under which retries of it are answered with its response"}}}
+
+    return wrapper
+
+
+def release_reservation(exception):
+    """
+    Frees the Idempotency-Key of a request that ended without storing its response, so that a retry runs again.
+    """
+    key = g.pop("idempotency_reservation", None)
+    if key is not None:
+        idempotency_store.release(key)
+
+
+idempotency_store = get_store(app.config["IDEMPOTENCY_STORE_URI"],
+                              max_size=app.config["IDEMPOTENCY_STORE_SIZE"],
+                              ttl=app.config["IDEMPOTENCY_KEY_TTL"],
+                              lock_ttl=app.config["IDEMPOTENCY_LOCK_TTL"])
+app.teardown_request(release_reservation)
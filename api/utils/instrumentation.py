@@ -0,0 +1,294 @@
+import cProfile
+import functools
+import heapq
+import itertools
+import os
+import random
+import re
+import threading
+import time
+from flask import Response, abort, g, has_request_context, request
+from flask_restx.representations import output_json
+from sqlalchemy import event
+from .. import app, db, api, limiter
+from .pool_metrics import pool_metrics, WAIT_BUCKETS
+
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+PHASES = ("db", "http", "serialize")
+
+
+class RequestTimings:
+    """
+    Time spent by one request in each phase, and its number of SQL statements.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.statements = 0
+        self.seconds = dict.fromkeys(PHASES, 0.0)
+
+    def server_timing(self, total):
+        """
+        Returns the Server-Timing header value for these timings, given the request's total time in seconds.
+        """
+        descriptions = {"db": f"{self.statements} queries"}
+        metrics = [f'{phase};dur={self.seconds[phase] * 1000:.2f}' +
+                   (f';desc="{descriptions[phase]}"' if phase in descriptions else "") for phase in PHASES]
+
+        return ", ".join([*metrics, f"total;dur={total * 1000:.2f}"])
+
+
+class RequestMetrics:
+    """
+    Thread-safe per-route histograms of request durations and totals of the time spent in each phase.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Zeroes every counter.
+        """
+        with self._lock:
+            self.routes = {}
+            self.statuses = {}
+
+    def record(self, method, route, status, total, timings):
+        """
+        Records one request to the given route that took total seconds with the given phase timings.
+        """
+        with self._lock:
+            metrics = self.routes.setdefault((method, route), {
+                "count": 0, "sum": 0.0, "buckets": [0] * len(DURATION_BUCKETS),
+                "statements": 0, "phases": dict.fromkeys(PHASES, 0.0)})
+            metrics["count"] += 1
+            metrics["sum"] += total
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if total <= bound:
+                    metrics["buckets"][index] += 1
+
+            metrics["statements"] += timings.statements
+            for phase in PHASES:
+                metrics["phases"][phase] += timings.seconds[phase]
+
+            key = (method, route, status)
+            self.statuses[key] = self.statuses.get(key, 0) + 1
+
+    def exposition(self):
+        """
+        Returns every metric, along with the connection pool's, in the Prometheus text exposition format.
+        """
+        with self._lock:
+            routes = {key: {**metrics, "buckets": list(metrics["buckets"]), "phases": dict(metrics["phases"])}
+                      for key, metrics in self.routes.items()}
+            statuses = dict(self.statuses)
+
+        lines = ["# HELP http_requests_total Requests served, by route and status.",
+                 "# TYPE http_requests_total counter"]
+        lines += [f'http_requests_total{labels(method=method, route=route, status=status)} {count}'
+                  for (method, route, status), count in sorted(statuses.items())]
+
+        lines += ["# HELP http_request_duration_seconds Time from the start of a request to its response.",
+                  "# TYPE http_request_duration_seconds histogram"]
+        for (method, route), metrics in sorted(routes.items()):
+            lines += histogram("http_request_duration_seconds", DURATION_BUCKETS, metrics["buckets"],
+                               metrics["count"], metrics["sum"], method=method, route=route)
+
+        lines += ["# HELP db_statements_total SQL statements executed while serving requests.",
+                  "# TYPE db_statements_total counter"]
+        lines += [f'db_statements_total{labels(method=method, route=route)} {metrics["statements"]}'
+                  for (method, route), metrics in sorted(routes.items())]
+
+        lines += ["# HELP request_phase_seconds_total Time requests spent in SQL, outgoing HTTP and response encoding.",
+                  "# TYPE request_phase_seconds_total counter"]
+        lines += [f'request_phase_seconds_total{labels(method=method, route=route, phase=phase)} {seconds}'
+                  for (method, route), metrics in sorted(routes.items())
+                  for phase, seconds in metrics["phases"].items()]
+
+        pool = pool_metrics.snapshot()
+        lines += ["# HELP db_pool_checkout_timeouts_total Connection checkouts that timed out.",
+                  "# TYPE db_pool_checkout_timeouts_total counter",
+                  f"db_pool_checkout_timeouts_total {pool['timeouts']}",
+                  "# HELP db_pool_checkout_wait_seconds Time connection checkouts waited on the pool.",
+                  "# TYPE db_pool_checkout_wait_seconds histogram"]
+        lines += histogram("db_pool_checkout_wait_seconds", WAIT_BUCKETS, list(pool["buckets"].values()),
+                           pool["checkouts"], pool["total_wait"])
+
+        return "\n".join(lines) + "\n"
+
+
+def labels(**values):
+    """
+    Returns the Prometheus label set for the given label values.
+    """
+    escaped = {name: str(value).replace("\\", "\\\\").replace('"', '\\"') for name, value in values.items()}
+
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped.items()) + "}"
+
+
+def histogram(name, bounds, counts, count, total, **label_values):
+    """
+    Returns the exposition lines of a histogram whose cumulative counts are given for each bucket bound.
+    """
+    lines = [f"{name}_bucket{labels(**label_values, le=bound)} {bucket_count}"
+             for bound, bucket_count in zip(bounds, counts)]
+
+    return lines + [f"{name}_bucket{labels(**label_values, le='+Inf')} {count}",
+                    f"{name}_sum{labels(**label_values)} {total}",
+                    f"{name}_count{labels(**label_values)} {count}"]
+
+
+request_metrics = RequestMetrics()
+
+
+class SlowestProfiles:
+    """
+    Keeps the cProfile dumps of the slowest sampled requests in a directory, deleting the fastest when full.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sequence = itertools.count()
+        self.kept = []
+
+    def offer(self, profiler, duration, method, route):
+        """
+        Dumps the given profile of a request that took duration seconds if it is among the slowest kept,
+        and returns the path it was dumped to, or None.
+        """
+        directory, keep = app.config["PROFILE_DIR"], app.config["PROFILE_KEEP"]
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", route).strip("_") or "root"
+        with self._lock:
+            if len(self.kept) >= keep and (not self.kept or duration <= self.kept[0][0]):
+                return None
+
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"{duration * 1000:09.1f}ms-{method}-{slug}-{next(self._sequence)}.prof")
+            profiler.dump_stats(path)
+            heapq.heappush(self.kept, (duration, path))
+            while len(self.kept) > keep:
+                _, evicted = heapq.heappop(self.kept)
+                if os.path.exists(evicted):
+                    os.remove(evicted)
+
+        return path
+
+
+slowest_profiles = SlowestProfiles()
+
+
+def instrumenting():
+    """
+    Returns True if the current request is being instrumented.
+    """
+    return has_request_context() and "timings" in g
+
+
+def timed(phase):
+    """
+    Decorates a function so the time it takes is added to the given phase of the current request, if instrumented.
+    Calls from other threads, such as background verification, are not part of any request and are not counted.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not instrumenting():
+                return func(*args, **kwargs)
+
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                g.timings.seconds[phase] += time.perf_counter() - started
+
+        return wrapper
+
+    return decorator
+
+
+def start_request():
+    if not app.config["INSTRUMENTATION"]:
+        return
+
+    g.timings = RequestTimings()
+    if random.random() < app.config["PROFILE_SAMPLE_RATE"]:
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+
+def finish_request(response):
+    if not instrumenting():
+        return response
+
+    total = time.perf_counter() - g.timings.started
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        profiler.disable()
+
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    response.headers["Server-Timing"] = g.timings.server_timing(total)
+    request_metrics.record(request.method, route, response.status_code, total, g.timings)
+    if profiler is not None:
+        slowest_profiles.offer(profiler, total, request.method, route)
+
+    return response
+
+
+def stop_profiler(exception):
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        profiler.disable()
+
+
+def instrument_engine(engine):
+    """
+    Counts and times the SQL statements of instrumented requests run on the given engine.
+    """
+    event.listen(engine, "before_cursor_execute", before_statement)
+    event.listen(engine, "after_cursor_execute", after_statement)
+
+
+def before_statement(connection, cursor, statement, parameters, context, executemany):
+    if instrumenting():
+        context.instrumentation_started = time.perf_counter()
+
+
+def after_statement(connection, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "instrumentation_started", None)
+    if started is not None and instrumenting():
+        g.timings.statements += 1
+        g.timings.seconds["db"] += time.perf_counter() - started
+
+
+@timed("serialize")
+def output_timed_json(data, code, headers=None):
+    """
+    Encodes a JSON response like Flask-RESTX does, counting the time it takes as serialization.
+    """
+    return output_json(data, code, headers)
+
+
+@limiter.exempt
+def metrics():
+    """
+    Returns the request, SQL and connection pool metrics in the Prometheus text exposition format.
+    """
+    if not app.config["INSTRUMENTATION"]:
+        abort(404)
+
+    return Response(request_metrics.exposition(), mimetype="text/plain; version=0.0.4")
+
+
+# runs ahead of the other before_request hooks, so that API key lookups and rate limiting are timed too
+app.before_request_funcs.setdefault(None, []).insert(0, start_request)
+# runs after the other after_request hooks, which Flask calls last registered first, so that the request's commit
+# is timed too
+app.after_request_funcs.setdefault(None, []).insert(0, finish_request)
+app.teardown_request(stop_profiler)
+with app.app_context():
+    instrument_engine(db.engine)
+api.representations["application/json"] = output_timed_json
+app.add_url_rule("/metrics", "metrics", metrics)
@@ -0,0 +1,142 @@
+import sqlite3
+import time
+from contextlib import contextmanager
+from limits.storage import Storage
+from limits.storage.base import SlidingWindowCounterSupport, TimestampedSlidingWindow
+from .async_io import off_loop
+from .sqlite_file import SQLiteFile, sqlite_path
+
+
+class SQLiteStorage(SQLiteFile, Storage, SlidingWindowCounterSupport, TimestampedSlidingWindow):
+    """
+    Rate limit storage in a single SQLite file, shared by every process on the host that opens the same file.
+    Each counter is one row that expires with its window, and expired rows are purged periodically, so the file stays
+    proportional to the number of active keys. Registered for sqlite:///path/to/file.db storage URIs.
+    """
+
+    STORAGE_SCHEME = ["sqlite"]
+    PURGE_INTERVAL = 1000
+
+    def __init__(self, uri, wrap_exceptions=False, timeout=5.0, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        self.open_file(sqlite_path(uri), timeout)
+        self._writes = 0
+        with self._transaction() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS rate_limit_counters "
+                "(key TEXT PRIMARY KEY, count INTEGER NOT NULL, expires_at REAL NOT NULL) WITHOUT ROWID")
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    @contextmanager
+    def _transaction(self):
+        """
+        Holds SQLite's write lock for the duration of the with block, so read-modify-write sequences are atomic across processes.
+        """
+        connection = self.connection
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+        connection.execute("COMMIT")
+
+    def _count(self, connection, key, now):
+        row = connection.execute(
+            "SELECT count, expires_at FROM rate_limit_counters WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] <= now:
+            return 0, None
+
+        return row
+
+    def _incr(self, connection, key, expiry, amount, now):
+        connection.execute(
+            "INSERT INTO rate_limit_counters (key, count, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET "
+            "count = CASE WHEN expires_at <= ? THEN excluded.count ELSE count + excluded.count END, "
+            "expires_at = CASE WHEN expires_at <= ? THEN excluded.expires_at ELSE expires_at END",
+            (key, amount, now + expiry, now, now))
+        self._writes += 1
+        if self._writes % self.PURGE_INTERVAL == 0:
+            connection.execute(
+                "DELETE FROM rate_limit_counters WHERE expires_at <= ?", (now,))
+
+        return self._count(connection, key, now)[0]
+
+    @off_loop
+    def incr(self, key, expiry, amount=1):
+        with self._transaction() as connection:
+            return self._incr(connection, key, expiry, amount, time.time())
+
+    @off_loop
+    def get(self, key):
+        return self._count(self.connection, key, time.time())[0]
+
+    @off_loop
+    def get_expiry(self, key):
+        now = time.time()
+        expires_at = self._count(self.connection, key, now)[1]
+
+        return expires_at if expires_at is not None else now
+
+    @off_loop
+    def check(self):
+        try:
+            self.connection.execute("SELECT 1")
+            return True
+
+        except sqlite3.Error:
+            return False
+
+    @off_loop
+    def reset(self):
+        with self._transaction() as connection:
+            return connection.execute("DELETE FROM rate_limit_counters").rowcount
+
+    @off_loop
+    def clear(self, key):
+        with self._transaction() as connection:
+            connection.execute(
+                "DELETE FROM rate_limit_counters WHERE key = ?", (key,))
+
+    def _sliding_window(self, connection, key, expiry, now):
+        previous_key, current_key = self.sliding_window_keys(key, expiry, now)
+        previous_count = self._count(connection, previous_key, now)[0]
+        current_count = self._count(connection, current_key, now)[0]
+        previous_ttl = 0.0 if previous_count == 0 else (
+            1 - (((now - expiry) / expiry) % 1)) * expiry
+        current_ttl = (1 - ((now / expiry) % 1)) * expiry + expiry
+
+        return previous_count, previous_ttl, current_count, current_ttl
+
+    @off_loop
+    def acquire_sliding_window_entry(self, key, limit, expiry, amount=1):
+        if amount > limit:
+            return False
+
+        now = time.time()
+        with self._transaction() as connection:
+            previous_count, previous_ttl, current_count, _ = self._sliding_window(
+                connection, key, expiry, now)
+            weighted_count = previous_count * previous_ttl / expiry + current_count
+            if int(weighted_count) + amount > limit:
+                return False
+
+            current_key = self.sliding_window_keys(key, expiry, now)[1]
+            self._incr(connection, current_key, 2 * expiry, amount, now)
+
+            return True
+
+    @off_loop
+    def get_sliding_window(self, key, expiry):
+        return self._sliding_window(self.connection, key, expiry, time.time())
+
+    def clear_sliding_window(self, key, expiry):
+        for window_key in self.sliding_window_keys(key, expiry, time.time()):
+            self.clear(window_key)
+
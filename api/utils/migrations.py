@@ -0,0 +1,359 @@
+import datetime
+from sqlalchemy import inspect
+from sqlalchemy.schema import AddConstraint, CreateColumn, CreateTable
+from .. import app, db
+from ..models.users import User
+from ..models.videos import Video
+from ..models.comments import Comment
+from ..models.cities import City
+from .etags import table_versions, bump_table_versions
+from .search import get_search_backend
+from .youtube import url_hash
+
+
+schema_version = db.Table(
+    "schema_version",
+    db.Column("version", db.Integer, primary_key=True),
+    db.Column("description", db.String(200), nullable=False),
+    db.Column("applied_at", db.DateTime, nullable=False),
+)
+
+
+class SchemaOutOfDate(RuntimeError):
+    pass
+
+
+def add_column_if_missing(connection, column, not_null=True):
+    """
+    Adds the given model column to its table unless the table already has it.
+    With not_null False, a NOT NULL column is added without the constraint, for the migration to fill it in on the
+    rows already there before enforcing it.
+    """
+    existing = {info["name"]
+                for info in inspect(connection).get_columns(column.table.name)}
+    if column.name in existing:
+        return
+
+    if not_null:
+        ddl = CreateColumn(column).compile(dialect=connection.dialect)
+    else:
+        ddl = f"{connection.dialect.identifier_preparer.quote(column.name)} {column.type.compile(connection.dialect)}"
+    connection.exec_driver_sql(f"ALTER TABLE {column.table.name} ADD COLUMN {ddl}")
+
+
+def create_index_if_missing(connection, index):
+    """
+    Creates the given model index unless its table already has an index with that name.
+    """
+    existing = {info["name"]
+                for info in inspect(connection).get_indexes(index.table.name)}
+    if index.name not in existing:
+        index.create(connection)
+
+
+def model_index(column):
+    """
+    Returns the index the model declares on the given column.
+    """
+    return next(index for index in column.table.indexes if column.name in index.columns)
+
+
+def named_index(table, name):
+    """
+    Returns the index the model declares on the given table under the given name.
+    """
+    return next(index for index in table.indexes if index.name == name)
+
+
+def cascade_foreign_keys(connection, table):
+    """
+    Gives the foreign keys of the given model table the ON DELETE actions the model declares, if they lack them.
+    SQLite cannot alter a constraint, so there the table is rebuilt from the model instead.
+    """
+    existing = {foreign_key["constrained_columns"][0]: foreign_key
+                for foreign_key in inspect(connection).get_foreign_keys(table.name)}
+    stale = [foreign_key for foreign_key in table.foreign_keys
+             if existing[foreign_key.parent.name]["options"].get("ondelete") != foreign_key.ondelete]
+    if not stale:
+        return
+
+    if connection.dialect.name == "sqlite":
+        rebuild_table(connection, table)
+        return
+
+    for foreign_key in stale:
+        connection.exec_driver_sql(f"ALTER TABLE {table.name} DROP CONSTRAINT "
+                                   f"{existing[foreign_key.parent.name]['name']}")
+        connection.execute(AddConstraint(foreign_key.constraint))
+
+
+def rebuild_table(connection, table):
+    """
+    Recreates the given model table in SQLite from its current definition, copying its rows and indexes over.
+    Foreign key enforcement has to be off beforehand, so that dropping the old table leaves the rows referencing it be.
+    Columns that later migrations add are left out, along with their indexes, for those migrations to add and fill in.
+    """
+    preparer = connection.dialect.identifier_preparer
+    name, rebuilt = preparer.format_table(table), f"{table.name}_rebuilt"
+    existing = {info["name"] for info in inspect(connection).get_columns(table.name)}
+    columns = ", ".join(preparer.quote(column.name) for column in table.columns if column.name in existing)
+
+    create = CreateTable(table, include_foreign_key_constraints=[
+        foreign_key.constraint for foreign_key in table.foreign_keys if foreign_key.parent.name in existing])
+    create.columns = [column for column in create.columns if column.element.name in existing]
+    ddl = str(create.compile(dialect=connection.dialect))
+    connection.exec_driver_sql(ddl.replace(name, rebuilt, 1))
+    connection.exec_driver_sql(f"INSERT INTO {rebuilt} ({columns}) SELECT {columns} FROM {name}")
+    connection.exec_driver_sql(f"DROP TABLE {name}")
+    connection.exec_driver_sql(f"ALTER TABLE {rebuilt} RENAME TO {name}")
+    for index in table.indexes:
+        if all(column.name in existing for column in index.columns):
+            index.create(connection)
+
+
+def create_initial_schema(connection):
+    db.metadata.create_all(connection)
+
+
+def add_video_status_and_user_key_index(connection):
+    add_column_if_missing(connection, Video.__table__.c.status)
+    create_index_if_missing(connection, model_index(User.__table__.c.key))
+
+
+def add_versions(connection):
+    for model in (User, Video, Comment):
+        add_column_if_missing(connection, model.__table__.c.version)
+        add_column_if_missing(connection, model.__table__.c.updated_at)
+        connection.execute(model.__table__.update().where(
+            model.updated_at.is_(None)).values(updated_at=datetime.datetime.utcnow()))
+
+    table_versions.create(connection, checkfirst=True)
+    seed_table_versions(connection, (User, Video, Comment))
+
+
+def seed_table_versions(connection, models):
+    """
+    Adds a collection version row for every given model's table that does not have one yet.
+    """
+    existing = set(connection.execute(
+        db.select(table_versions.c.name)).scalars())
+    for model in models:
+        if model.__tablename__ not in existing:
+            connection.execute(table_versions.insert().values(
+                name=model.__tablename__, version=0, updated_at=datetime.datetime.utcnow()))
+
+
+def add_cities_and_video_locations(connection):
+    """
+    Gives cities their names and coordinates, and videos their coordinates and the grid cell index.
+    Until now the city table only ever held IDs, so one without names is rebuilt as long as it is empty.
+    """
+    city_columns = {info["name"] for info in inspect(
+        connection).get_columns(City.__tablename__)}
+    if "name" not in city_columns:
+        if connection.execute(db.select(db.func.count()).select_from(City.__table__)).scalar():
+            raise SchemaOutOfDate(
+                "The city table has rows without names; name them before migrating")
+
+        City.__table__.drop(connection)
+        City.__table__.create(connection)
+
+    for column in (Video.__table__.c.lat, Video.__table__.c.lon, Video.__table__.c.geo_cell):
+        add_column_if_missing(connection, column)
+
+    create_index_if_missing(connection, model_index(Video.__table__.c.geo_cell))
+    create_index_if_missing(connection, model_index(Video.__table__.c.city_id))
+    seed_table_versions(connection, (City,))
+
+
+def add_video_search_indexes(connection):
+    create_index_if_missing(connection, named_index(
+        Video.__table__, "ix_video_date_id"))
+    create_index_if_missing(connection, named_index(
+        Video.__table__, "ix_video_user_id_date"))
+
+
+def add_search_index(connection):
+    """
+    Creates the full-text search index and fills it with every existing video description and comment body.
+    Does nothing on a database that has no search backend.
+    """
+    search_backend = get_search_backend()
+    if search_backend is None:
+        return
+
+    search_backend.drop(connection)
+    search_backend.create(connection)
+    for model, text in ((Video, Video.description), (Comment, Comment.body)):
+        search_backend.index_many(connection, model.SEARCH_KIND,
+                                  connection.execute(db.select(model.id, text).where(text.isnot(None))).all())
+
+
+def add_cascading_deletes(connection):
+    """
+    Makes the database delete the videos and comments of a deleted user or video, which used to be left behind
+    with NULL foreign keys. Refuses to run while rows left behind that way remain, since the new foreign keys
+    cannot hold them and deleting them is up to the operator.
+    """
+    orphaned_videos = db.or_(Video.user_id.is_(None), Video.user_id.not_in(db.select(User.id)))
+    orphaned_comments = db.or_(Comment.video_id.is_(None), Comment.user_id.is_(None),
+                               Comment.video_id.not_in(db.select(Video.id).where(db.not_(orphaned_videos))),
+                               Comment.user_id.not_in(db.select(User.id)))
+    videos, comments = (connection.execute(db.select(db.func.count()).select_from(model.__table__).where(orphaned))
+                        .scalar() for model, orphaned in ((Video, orphaned_videos), (Comment, orphaned_comments)))
+    if videos or comments:
+        raise SchemaOutOfDate(f"{videos} videos and {comments} comments belong to a deleted or missing user or video; "
+                              "delete or reassign them before migrating")
+
+    if connection.dialect.name == "sqlite":
+        # only takes effect outside a transaction, so it must come before any write
+        connection.exec_driver_sql("PRAGMA foreign_keys=OFF")
+
+    for model in (Video, Comment):
+        cascade_foreign_keys(connection, model.__table__)
+
+
+def add_comment_counts(connection):
+    """
+    Gives comments their creation time and videos their comment count and last comment time, counted from the
+    comments already there, along with the (video_id, id) index that newest-first comment threads are read from.
+    Comments created before now are taken to have been created when they were last updated.
+    """
+    add_column_if_missing(connection, Comment.__table__.c.created_at)
+    connection.execute(Comment.__table__.update().where(
+        Comment.created_at.is_(None)).values(created_at=Comment.updated_at))
+    create_index_if_missing(connection, named_index(Comment.__table__, "ix_comment_video_id_id"))
+
+    for column in (Video.__table__.c.comment_count, Video.__table__.c.last_comment_at):
+        add_column_if_missing(connection, column)
+
+    comments = db.select(db.func.count(Comment.id)).where(Comment.video_id == Video.id)
+    newest = db.select(Comment.created_at).where(Comment.video_id == Video.id).order_by(Comment.id.desc()).limit(1)
+    # every video's representation gains the counts, so its row version changes with it
+    connection.execute(Video.__table__.update().values(
+        comment_count=comments.scalar_subquery(), last_comment_at=newest.scalar_subquery(),
+        version=Video.version + 1))
+    bump_table_versions(connection, {Video.__tablename__})
+
+
+def add_video_url_hashes(connection):
+    """
+    Moves the uniqueness of video urls onto a fixed-size hash of their canonical form, so that lookups and duplicate
+    checks match a short key and every link to the same YouTube video counts as one. Videos already stored under two
+    links to the same YouTube video have to be told apart by hand first.
+    The column is added without NOT NULL, which it gets once every video has its hash, and the old unique constraint
+    on the url is dropped. SQLite can only do either by rebuilding the table.
+    """
+    sqlite = connection.dialect.name == "sqlite"
+    if sqlite:
+        # only takes effect outside a transaction, so it must come before any write
+        connection.exec_driver_sql("PRAGMA foreign_keys=OFF")
+
+    add_column_if_missing(connection, Video.__table__.c.url_hash, not_null=False)
+
+    hashes = {}
+    for id, url in connection.execute(db.select(Video.id, Video.url).order_by(Video.id)):
+        hash = url_hash(url)
+        if hash in hashes:
+            raise SchemaOutOfDate(f"Videos {hashes[hash]} and {id} link to the same YouTube video; "
+                                  "delete or change one of them before migrating")
+        hashes[hash] = id
+
+    if hashes:
+        connection.execute(Video.__table__.update().where(Video.id == db.bindparam("video_id"))
+                           .values(url_hash=db.bindparam("hash")),
+                           [{"video_id": id, "hash": hash} for hash, id in hashes.items()])
+
+    inspector = inspect(connection)
+    nullable = any(column["name"] == "url_hash" and column["nullable"]
+                   for column in inspector.get_columns(Video.__tablename__))
+    constraints = [constraint["name"] for constraint in inspector.get_unique_constraints(Video.__tablename__)
+                   if constraint["column_names"] == ["url"]]
+    indexes = [index["name"] for index in inspector.get_indexes(Video.__tablename__)
+               if index["unique"] and index["column_names"] == ["url"] and index["name"] not in constraints]
+    if sqlite and (nullable or constraints or indexes):
+        rebuild_table(connection, Video.__table__)
+        return
+
+    if nullable:
+        connection.exec_driver_sql(f"ALTER TABLE {Video.__tablename__} ALTER COLUMN url_hash SET NOT NULL")
+
+    for name in constraints:
+        connection.exec_driver_sql(f"ALTER TABLE {Video.__tablename__} DROP CONSTRAINT {name}")
+
+    for name in indexes:
+        connection.exec_driver_sql(f"DROP INDEX {name}")
+
+    create_index_if_missing(connection, model_index(Video.__table__.c.url_hash))
+
+
+MIGRATIONS = [
+    (1, "Create initial schema", create_initial_schema),
+    (2, "Add video status and unique index on user key",
+     add_video_status_and_user_key_index),
+    (3, "Add row versions and collection versions for ETags", add_versions),
+    (4, "Add city coordinates and video locations with a grid cell index",
+     add_cities_and_video_locations),
+    (5, "Add composite indexes for video date and user searches",
+     add_video_search_indexes),
+    (6, "Add the full-text search index", add_search_index),
+    (7, "Cascade deletes of users and videos to their videos and comments", add_cascading_deletes),
+    (8, "Add comment counts and last comment times to videos", add_comment_counts),
+    (9, "Match videos by the hash of their canonical url instead of the url", add_video_url_hashes),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(connection):
+    """
+    Returns the version of the schema the database is at, or 0 if it has never been migrated.
+    """
+    if not inspect(connection).has_table(schema_version.name):
+        return 0
+
+    return connection.execute(db.select(db.func.max(schema_version.c.version))).scalar() or 0
+
+
+def upgrade():
+    """
+    Applies every migration newer than the database's schema version in order, each in its own transaction.
+    Every migration is idempotent, so re-running one that was interrupted is safe.
+    Pooled connections are replaced afterwards, so that none keeps a setting a migration changed for itself,
+    such as SQLite's foreign key enforcement.
+    Returns the list of versions applied.
+    """
+    applied = []
+    with app.app_context():
+        for version, description, migrate in MIGRATIONS:
+            with db.engine.begin() as connection:
+                if version <= current_version(connection):
+                    continue
+
+                migrate(connection)
+                connection.execute(schema_version.insert().values(
+                    version=version, description=description, applied_at=datetime.datetime.utcnow()))
+                applied.append(version)
+
+        if applied:
+            db.engine.dispose()
+
+    return applied
+
+
+def check_schema():
+    """
+    Confirms the database is at the latest schema version, running the migrations first if AUTO_MIGRATE is set.
+    Raises SchemaOutOfDate otherwise, so that a worker never serves requests against an old schema.
+    """
+    if app.config["AUTO_MIGRATE"]:
+        upgrade()
+        return
+
+    with app.app_context():
+        with db.engine.connect() as connection:
+            version = current_version(connection)
+
+    if version != LATEST_VERSION:
+        raise SchemaOutOfDate(
+            f"Database schema is at version {version} but the app needs {LATEST_VERSION}; run python migrate.py")
@@ -0,0 +1,161 @@
+from flask import current_app
+from flask_restx import inputs, abort
+from sqlalchemy import tuple_
+from .. import db
+
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def add_pagination_arguments(parser):
+    """
+    Adds the limit and after cursor arguments to the given request parser.
+    """
+    parser.add_argument("limit", required=False, type=inputs.positive,
+                        help="maximum number of entries to return")
+    parser.add_argument("after", required=False,
+                        help="only return entries after this cursor, taken from the X-Next-Cursor header of the previous page")
+
+    return parser
+
+
+def add_sort_argument(parser, *columns):
+    """
+    Adds the sort argument, which orders a list by id or by one of the given columns and then id,
+    descending when prefixed with a minus, to the given request parser.
+    """
+    choices = [prefix + column for column in ("id", *columns)
+               for prefix in ("", "-")]
+    parser.add_argument("sort", required=False, default="id", choices=choices,
+                        help="order of the list: " + ", ".join(choices))
+
+    return parser
+
+
+def sort_order(model, args):
+    """
+    Returns the column the sort in args orders by before id (None when sorting by id alone) and whether it is descending.
+    """
+    sort = args.get("sort") or "id"
+    name = sort.lstrip("-")
+
+    return (None if name == "id" else getattr(model, name)), sort.startswith("-")
+
+
+def encode_cursor(entry, column):
+    """
+    Returns the cursor of the page following the given entry: its id, preceded by its sort value when sorting by a column.
+    """
+    if column is None:
+        return str(entry.id)
+
+    value = getattr(entry, column.key)
+    if value is None:
+        value = ""
+    elif hasattr(value, "isoformat"):
+        value = value.isoformat()
+
+    return f"{value}:{entry.id}"
+
+
+def decode_cursor(cursor, column):
+    """
+    Returns the sort value and id in the given cursor, raising a 400 error if it is not a cursor of this sort.
+    """
+    try:
+        if column is None:
+            return None, int(cursor)
+
+        value, _, id = cursor.rpartition(":")
+        if value == "":
+            return None, int(id)
+
+        python_type = column.type.python_type
+        if hasattr(python_type, "fromisoformat"):
+            return python_type.fromisoformat(value), int(id)
+
+        return python_type(value), int(id)
+
+    except ValueError:
+        abort(400, "after should be the X-Next-Cursor of the previous page with the same sort")
+
+
+def cursor_value(model, args):
+    """
+    Returns the sort column and the value of it in the cursor of args, or None for either if the list is sorted by
+    id alone or has no cursor.
+    """
+    column, _ = sort_order(model, args)
+    if column is None or args.get("after") is None:
+        return column, None
+
+    return column, decode_cursor(args["after"], column)[0]
+
+
+def keyset(query, model, args, nullable=True):
+    """
+    Returns the selects that together list the entries of the given select in the sort order of args, starting after
+    the cursor in args, to be read one after another.
+    Entries without a sort value come first in ascending order and last in descending order. They are read by their
+    own select, so that every select is a single range of the index on the sort column and id. That select is left
+    out when nullable is False because the select's filters already exclude them.
+    """
+    column, descending = sort_order(model, args)
+    after = args.get("after")
+    value, id = decode_cursor(after, column) if after is not None else (None, None)
+
+    if column is None:
+        if after is not None:
+            query = query.where(model.id < id if descending else model.id > id)
+
+        return [query.order_by(model.id.desc() if descending else model.id)]
+
+    values = query.where(column.isnot(None))
+    nulls = query.where(column.is_(None))
+    read_values, read_nulls = True, nullable
+
+    if after is not None and value is None:
+        nulls = nulls.where(model.id < id if descending else model.id > id)
+        read_values = not descending
+    elif after is not None:
+        values = values.where(column <= value, tuple_(column, model.id) < (value, id)) if descending \
+            else values.where(column >= value, tuple_(column, model.id) > (value, id))
+        read_nulls = nullable and descending
+
+    if descending:
+        segments = [(values.order_by(column.desc(), model.id.desc()), read_values),
+                    (nulls.order_by(model.id.desc()), read_nulls)]
+    else:
+        segments = [(nulls.order_by(model.id), read_nulls),
+                    (values.order_by(column, model.id), read_values)]
+
+    return [segment for segment, read in segments if read]
+
+
+def paginate(query, model, args, nullable=True):
+    """
+    Returns one page of entries from the given select, in the sort order of args and starting after the cursor in args,
+    along with the cursor of the following page (None on the last page).
+    Set nullable to False when the select's filters exclude entries without a sort value.
+    """
+    limit = min(args.get("limit") or current_app.config["DEFAULT_PAGE_SIZE"],
+                current_app.config["MAX_PAGE_SIZE"])
+
+    entries = []
+    for segment in keyset(query, model, args, nullable):
+        entries += db.session.execute(
+            segment.limit(limit + 1 - len(entries))).scalars().all()
+        if len(entries) > limit:
+            return entries[:limit], encode_cursor(entries[limit - 1], sort_order(model, args)[0])
+
+    return entries, None
+
+
+def page_headers(next_cursor):
+    """
+    Returns the response headers advertising the cursor of the following page, if there is one.
+    """
+    if next_cursor is None:
+        return {}
+
+    return {NEXT_CURSOR_HEADER: str(next_cursor)}
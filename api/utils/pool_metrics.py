@@ -0,0 +1,90 @@
+import logging
+import threading
+import time
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+
+logger = logging.getLogger(__name__)
+
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+
+
+class PoolMetrics:
+    """
+    Thread-safe counters and a histogram of how long connection checkouts waited on the pool.
+    """
+
+    def __init__(self, slow_checkout=0.1):
+        self.slow_checkout = slow_checkout
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Zeroes every counter.
+        """
+        with self._lock:
+            self.checkouts = 0
+            self.timeouts = 0
+            self.total_wait = 0.0
+            self.max_wait = 0.0
+            self.bucket_counts = [0] * len(WAIT_BUCKETS)
+
+    def record(self, wait, timed_out=False):
+        """
+        Records one checkout that waited the given number of seconds, logging it if it was slow.
+        """
+        with self._lock:
+            self.checkouts += 1
+            self.timeouts += 1 if timed_out else 0
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            for index, bound in enumerate(WAIT_BUCKETS):
+                if wait <= bound:
+                    self.bucket_counts[index] += 1
+
+        if timed_out or wait > self.slow_checkout:
+            logger.warning("Connection checkout waited %.3fs%s", wait,
+                           " and timed out" if timed_out else "")
+
+    def snapshot(self):
+        """
+        Returns a dictionary of the current counters and cumulative wait histogram.
+        """
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "total_wait": self.total_wait,
+                "max_wait": self.max_wait,
+                "buckets": dict(zip(WAIT_BUCKETS, self.bucket_counts)),
+            }
+
+
+pool_metrics = PoolMetrics()
+
+
+class MeteredQueuePool(QueuePool):
+    """
+    QueuePool that records how long every checkout waited for a free connection in pool_metrics.
+    """
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+
+        except TimeoutError:
+            pool_metrics.record(time.perf_counter() - start, timed_out=True)
+            raise
+
+        pool_metrics.record(time.perf_counter() - start)
+
+        return connection
+
+
+class MeteredAsyncQueuePool(MeteredQueuePool, AsyncAdaptedQueuePool):
+    """
+    MeteredQueuePool for engines on an asyncio driver, whose pool has to wait on an asyncio-aware queue.
+    """
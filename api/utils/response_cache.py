@@ -0,0 +1,211 @@
+import functools
+import json
+import threading
+import time
+from flask import request
+from flask_restx.utils import unpack
+from .lru_cache import LRUCache
+from .async_io import off_loop
+from .sqlite_file import SQLiteFile, store_for_uri
+from .. import app
+
+
+class MemoryBackend:
+    """
+    Response cache backend local to this process, holding entries in a size-bounded LRU cache.
+    Tag generations are kept apart from the entries and never evicted, so an evicted generation can never make an
+    entry cached before an invalidation current again.
+    """
+
+    def __init__(self, max_size, ttl):
+        self._entries = LRUCache(max_size=max_size, ttl=ttl)
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        return self._entries.get(key)
+
+    def set(self, key, entry):
+        self._entries.set(key, entry)
+
+    def generations(self, tags):
+        with self._lock:
+            return {tag: self._generations.get(tag, 0) for tag in tags}
+
+    def bump(self, tags):
+        with self._lock:
+            for tag in tags:
+                self._generations[tag] = self._generations.get(tag, 0) + 1
+
+    def clear(self):
+        self._entries.clear()
+        with self._lock:
+            self._generations.clear()
+
+
+class SQLiteBackend(SQLiteFile):
+    """
+    Response cache backend in a single SQLite file, shared by every process on the host that opens the same file,
+    so an invalidation by one worker is seen by all of them. Entries past max_size are evicted least recently used first.
+    """
+
+    def __init__(self, path, max_size, ttl, timeout=5.0):
+        self.open_file(path, timeout)
+        self.max_size = max_size
+        self.ttl = ttl
+        connection = self.connection
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS response_cache_entries (key TEXT PRIMARY KEY, entry TEXT NOT NULL, "
+            "expires_at REAL NOT NULL, accessed_at REAL NOT NULL) WITHOUT ROWID")
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS ix_response_cache_entries_accessed_at ON response_cache_entries (accessed_at)")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS response_cache_tags "
+            "(tag TEXT PRIMARY KEY, generation INTEGER NOT NULL) WITHOUT ROWID")
+
+    @off_loop
+    def get(self, key):
+        now = time.time()
+        row = self.connection.execute(
+            "UPDATE response_cache_entries SET accessed_at = ? WHERE key = ? AND expires_at > ? RETURNING entry",
+            (now, key, now)).fetchone()
+        if row is None:
+            return None
+
+        generations, value = json.loads(row[0])
+        return generations, value
+
+    @off_loop
+    def set(self, key, entry):
+        now = time.time()
+        connection = self.connection
+        connection.execute(
+            "INSERT OR REPLACE INTO response_cache_entries (key, entry, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+            (key, json.dumps(entry), now + self.ttl, now))
+        connection.execute(
+            "DELETE FROM response_cache_entries WHERE key IN (SELECT key FROM response_cache_entries "
+            "ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)", (self.max_size,))
+
+    @off_loop
+    def generations(self, tags):
+        tags = list(tags)
+        rows = self.connection.execute(
+            f"SELECT tag, generation FROM response_cache_tags WHERE tag IN ({', '.join('?' * len(tags))})",
+            tags).fetchall()
+        generations = dict.fromkeys(tags, 0)
+        generations.update(rows)
+        return generations
+
+    @off_loop
+    def bump(self, tags):
+        self.connection.executemany(
+            "INSERT INTO response_cache_tags (tag, generation) VALUES (?, 1) "
+            "ON CONFLICT (tag) DO UPDATE SET generation = generation + 1", [(tag,) for tag in tags])
+
+    @off_loop
+    def clear(self):
+        self.connection.execute("DELETE FROM response_cache_entries")
+        self.connection.execute("DELETE FROM response_cache_tags")
+
+
+def get_backend(uri, max_size, ttl):
+    """
+    Returns the response cache backend for the given URI: memory:// for one per process, or sqlite:///path/to/file.db
+    for one shared by every process on the host.
+    """
+    return store_for_uri(uri, "response cache", MemoryBackend, SQLiteBackend, max_size, ttl)
+
+
+class ResponseCache:
+    """
+    Cache of marshalled list responses, keyed by route and normalized arguments.
+    Every entry records the generations of the tags it depends on when its query started, and is only served while
+    none of those tags has been invalidated since, so a write committed during a read can never be cached as current.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def get(self, key, tags):
+        """
+        Returns the response cached for the given key if it is still current for the given tags, otherwise None.
+        """
+        entry = self.backend.get(key)
+        if entry is None:
+            return None
+
+        generations, value = entry
+        if generations != self.backend.generations(tags):
+            return None
+
+        return value
+
+    def generations(self, tags):
+        """
+        Returns the current generation of every given tag, to be stored with a response computed from now on.
+        """
+        return self.backend.generations(tags)
+
+    def set(self, key, generations, value):
+        """
+        Caches the response for the given key as current for the given tag generations.
+        """
+        self.backend.set(key, (generations, value))
+
+    def invalidate(self, tags):
+        """
+        Invalidates every cached response that depends on any of the given tags.
+        Call after the write that changes them has been committed.
+        """
+        if tags:
+            self.backend.bump(set(tags))
+
+    def clear(self):
+        """
+        Removes all cached responses.
+        """
+        self.backend.clear()
+
+
+def cache_key(args):
+    """
+    Returns the cache key of the current request's route and parsed arguments, ignoring unset ones.
+    """
+    normalized = sorted((name, value)
+                        for name, value in args.items() if value is not None)
+
+    return request.path + "?" + json.dumps(normalized, default=str, separators=(",", ":"))
+
+
+def cached(parser):
+    """
+    Decorates a marshalled list handler so successful responses are served from the response cache.
+    The resource's cache_tags(args) returns the tags its response depends on for the arguments parsed by parser.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(resource, *args, **kwargs):
+            request_args = parser.parse_args()
+            key = cache_key(request_args)
+            tags = resource.cache_tags(request_args)
+
+            response = response_cache.get(key, tags)
+            if response is not None:
+                data, code, headers = response
+                return data, code, headers
+
+            generations = response_cache.generations(tags)
+            data, code, headers = unpack(func(resource, *args, **kwargs))
+            if code == 200:
+                response_cache.set(key, generations, (data, code, dict(headers or {})))
+
+            return data, code, headers
+
+        return wrapper
+
+    return decorator
+
+
+response_cache = ResponseCache(get_backend(app.config["RESPONSE_CACHE_URI"],
+                                           max_size=app.config["RESPONSE_CACHE_SIZE"],
+                                           ttl=app.config["RESPONSE_CACHE_TTL"]))
@@ -0,0 +1,269 @@
+import functools
+import re
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from sqlalchemy import column, table, select
+from sqlalchemy.engine import make_url
+from .. import app, db
+
+
+KINDS = ("video", "comment")
+SNIPPET_WORDS = 12
+
+SearchHit = namedtuple("SearchHit", ["kind", "id", "score", "snippet"])
+
+
+def search_terms(text):
+    """
+    Returns the words in the given free text, which every result has to contain.
+    """
+    return re.findall(r"\w+", text)
+
+
+def document_id(kind, id):
+    """
+    Returns the ID of the search document for the entry of the given kind and ID, so one lookup finds or removes it.
+    """
+    return id * len(KINDS) + KINDS.index(kind)
+
+
+def entry_of(document):
+    """
+    Returns the kind and ID of the entry the given search document belongs to.
+    """
+    id, kind = divmod(document, len(KINDS))
+
+    return KINDS[kind], id
+
+
+def encode_cursor(score, document):
+    return f"{score!r}:{document}"
+
+
+def decode_cursor(cursor):
+    """
+    Returns the score and document ID in the given cursor, or raises ValueError if it is not a search cursor.
+    """
+    score, _, document = cursor.partition(":")
+
+    return float(score), int(document)
+
+
+class SearchBackend(ABC):
+    """
+    Full-text index of video descriptions and comment bodies, stored next to them in the app's database.
+    Every method takes the connection of the caller's transaction, so the index commits or rolls back with the entries.
+    """
+    key = "id"
+
+    @abstractmethod
+    def create(self, connection):
+        pass
+
+    @abstractmethod
+    def drop(self, connection):
+        pass
+
+    @abstractmethod
+    def index(self, connection, kind, id, text):
+        pass
+
+    @abstractmethod
+    def index_many(self, connection, kind, rows):
+        """
+        Adds the entries of the given kind in rows, pairs of a new entry's ID and its text, in one statement.
+        The entries must not be in the index yet, so unlike index, nothing is removed first.
+        """
+
+    @abstractmethod
+    def remove(self, connection, kind, id):
+        pass
+
+    def remove_selected(self, connection, kind, ids):
+        """
+        Removes the entries of the given kind whose IDs the given select returns, in one statement.
+        """
+        index = table("search_index", column(self.key))
+        selected = ids.subquery()
+        connection.execute(index.delete().where(index.c[self.key].in_(
+            select(selected.c.id * len(KINDS) + KINDS.index(kind)))))
+
+    @abstractmethod
+    def search(self, connection, terms, kinds, limit, after=None):
+        """
+        Returns up to limit hits containing every term, best first and starting after the given cursor,
+        along with the cursor of the following page (None on the last page).
+        """
+
+
+class SQLiteSearchBackend(SearchBackend):
+    """
+    Search backend on an SQLite FTS5 table, ranked by BM25 with porter-stemmed terms.
+    Looking a term up walks its posting list, so queries cost time in the number of matches rather than the corpus.
+    """
+    key = "rowid"
+
+    def create(self, connection):
+        connection.exec_driver_sql(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(body, tokenize = 'porter unicode61')")
+
+    def drop(self, connection):
+        connection.exec_driver_sql("DROP TABLE IF EXISTS search_index")
+
+    def index(self, connection, kind, id, text):
+        self.remove(connection, kind, id)
+        if text:
+            connection.exec_driver_sql("INSERT INTO search_index (rowid, body) VALUES (?, ?)",
+                                       (document_id(kind, id), text))
+
+    def index_many(self, connection, kind, rows):
+        documents = [(document_id(kind, id), text) for id, text in rows if text]
+        if documents:
+            connection.exec_driver_sql("INSERT INTO search_index (rowid, body) VALUES (?, ?)", documents)
+
+    def remove(self, connection, kind, id):
+        connection.exec_driver_sql(
+            "DELETE FROM search_index WHERE rowid = ?", (document_id(kind, id),))
+
+    def search(self, connection, terms, kinds, limit, after=None):
+        # FTS5 ranks are negated BM25 scores, lower is better
+        match = " ".join('"' + term.replace('"', '""') + '"' for term in terms)
+        kind_filter = " OR ".join(
+            f"rowid % {len(KINDS)} = {KINDS.index(kind)}" for kind in kinds)
+        sql = (f"SELECT rowid, rank, snippet(search_index, 0, '[', ']', '...', {SNIPPET_WORDS}) FROM search_index "
+               f"WHERE search_index MATCH ? AND ({kind_filter})")
+        parameters = [match]
+        if after is not None:
+            score, document = decode_cursor(after)
+            sql += " AND (rank > ? OR (rank = ? AND rowid > ?))"
+            parameters += [-score, -score, document]
+
+        rows = connection.exec_driver_sql(
+            sql + " ORDER BY rank, rowid LIMIT ?", (*parameters, limit + 1)).all()
+        hits = [SearchHit(*entry_of(document), -rank, snippet)
+                for document, rank, snippet in rows]
+
+        return page_of(hits, limit)
+
+
+class PostgresSearchBackend(SearchBackend):
+    """
+    Search backend on a PostgreSQL tsvector column with a GIN index, ranked by ts_rank with English stemming.
+    """
+
+    def create(self, connection):
+        connection.exec_driver_sql(
+            "CREATE TABLE IF NOT EXISTS search_index (id BIGINT PRIMARY KEY, body TEXT NOT NULL, "
+            "document TSVECTOR GENERATED ALWAYS AS (to_tsvector('english', body)) STORED)")
+        connection.exec_driver_sql(
+            "CREATE INDEX IF NOT EXISTS ix_search_index_document ON search_index USING GIN (document)")
+
+    def drop(self, connection):
+        connection.exec_driver_sql("DROP TABLE IF EXISTS search_index")
+
+    def index(self, connection, kind, id, text):
+        self.remove(connection, kind, id)
+        if text:
+            connection.exec_driver_sql("INSERT INTO search_index (id, body) VALUES (%(id)s, %(body)s)",
+                                       {"id": document_id(kind, id), "body": text})
+
+    def index_many(self, connection, kind, rows):
+        documents = [{"id": document_id(kind, id), "body": text} for id, text in rows if text]
+        if documents:
+            connection.exec_driver_sql("INSERT INTO search_index (id, body) VALUES (%(id)s, %(body)s)", documents)
+
+    def remove(self, connection, kind, id):
+        connection.exec_driver_sql("DELETE FROM search_index WHERE id = %(id)s",
+                                   {"id": document_id(kind, id)})
+
+    def search(self, connection, terms, kinds, limit, after=None):
+        parameters = {"query": " ".join(terms), "kinds": [KINDS.index(kind) for kind in kinds],
+                      "count": len(KINDS), "limit": limit + 1}
+        sql = ("SELECT id, score, ts_headline('english', body, query, "
+               f"'StartSel=[, StopSel=], MaxWords={SNIPPET_WORDS}, MinWords=1') FROM ("
+               "SELECT id, body, query, ts_rank(document, query) AS score "
+               "FROM search_index, plainto_tsquery('english', %(query)s) AS query "
+               "WHERE document @@ query AND id %% %(count)s = ANY(%(kinds)s)) AS hits")
+        if after is not None:
+            parameters["score"], parameters["document"] = decode_cursor(after)
+            sql += " WHERE score < %(score)s OR (score = %(score)s AND id > %(document)s)"
+
+        rows = connection.exec_driver_sql(
+            sql + " ORDER BY score DESC, id LIMIT %(limit)s", parameters).all()
+        hits = [SearchHit(*entry_of(document), score, snippet)
+                for document, score, snippet in rows]
+
+        return page_of(hits, limit)
+
+
+def page_of(hits, limit):
+    """
+    Returns the first limit of the given hits and the cursor of the following page, if there are more.
+    """
+    if len(hits) > limit:
+        last = hits[limit - 1]
+        return hits[:limit], encode_cursor(last.score, document_id(last.kind, last.id))
+
+    return hits, None
+
+
+backends = {
+    "sqlite": SQLiteSearchBackend,
+    "postgresql": PostgresSearchBackend,
+}
+
+
+@functools.cache
+def get_search_backend():
+    """
+    Returns the search backend named by SEARCH_BACKEND, or else the one for the app's database, resolved on first use.
+    Returns None if there is none for the app's database: entries are then left unindexed and only searching fails.
+    Raises a ValueError if SEARCH_BACKEND names no backend, since that is a configuration mistake.
+    """
+    name = app.config["SEARCH_BACKEND"]
+    if name and name not in backends:
+        raise ValueError(f"No full-text search backend named {name}")
+
+    name = name or make_url(app.config["SQLALCHEMY_DATABASE_URI"]).get_backend_name()
+    if name not in backends:
+        return None
+
+    return backends[name]()
+
+
+def index_entry(entry):
+    """
+    Adds the given video or comment to the search index, or refreshes it, within the current transaction.
+    """
+    backend = get_search_backend()
+    if backend is not None:
+        backend.index(db.session.connection(), entry.SEARCH_KIND, entry.id, entry.search_text())
+
+
+def index_new_entries(model, rows):
+    """
+    Adds the videos or comments in rows, pairs of a new entry's ID and its text, to the search index in one statement
+    within the current transaction.
+    """
+    backend = get_search_backend()
+    if backend is not None:
+        backend.index_many(db.session.connection(), model.SEARCH_KIND, rows)
+
+
+def remove_entry(entry):
+    """
+    Removes the given video or comment from the search index within the current transaction.
+    """
+    backend = get_search_backend()
+    if backend is not None:
+        backend.remove(db.session.connection(), entry.SEARCH_KIND, entry.id)
+
+
+def remove_entries(model, condition):
+    """
+    Removes every video or comment matching condition from the search index within the current transaction,
+    without loading them.
+    """
+    backend = get_search_backend()
+    if backend is not None:
+        backend.remove_selected(db.session.connection(), model.SEARCH_KIND, db.select(model.id).where(condition))
@@ -0,0 +1,57 @@
+import sqlite3
+import threading
+
+
+SQLITE_URI_PREFIX = "sqlite:///"
+
+
+def sqlite_path(uri):
+    """
+    Returns the file path of the given sqlite:///path/to/file.db URI, or :memory: if it names no file.
+    """
+    return uri[len(SQLITE_URI_PREFIX):] or ":memory:"
+
+
+def store_for_uri(uri, name, memory_store, sqlite_store, *args, **kwargs):
+    """
+    Returns the store for the given URI, built with args and kwargs: memory_store for memory://, one per process,
+    or sqlite_store with the file path first for sqlite:///path/to/file.db, one shared by every process on the host.
+    Raises a ValueError naming the store for any other URI.
+    """
+    if uri == "memory://":
+        return memory_store(*args, **kwargs)
+
+    if uri.startswith(SQLITE_URI_PREFIX):
+        return sqlite_store(sqlite_path(uri), *args, **kwargs)
+
+    raise ValueError(f"Unsupported {name} URI: {uri}")
+
+
+class SQLiteFile:
+    """
+    Base of the stores kept in a single SQLite file, shared by every process on the host that opens the same file.
+    Each thread gets a connection of its own in autocommit and WAL mode, so that readers never wait on the writer.
+    """
+
+    def open_file(self, path, timeout):
+        """
+        Sets the file the store is kept in and how long to wait on another connection's lock before failing.
+        """
+        self.path = path or ":memory:"
+        self.timeout = float(timeout)
+        self._local = threading.local()
+
+    @property
+    def connection(self):
+        """
+        Returns this thread's connection to the store file, opening it on first use.
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(
+                self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+
+        return connection
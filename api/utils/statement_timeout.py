@@ -0,0 +1,20 @@
+import functools
+from sqlalchemy import event
+
+
+def limit_statement_time(engine, timeout_ms):
+    """
+    Makes the server cancel any statement running longer than timeout_ms on every new connection of the given engine
+    if it is PostgreSQL. Other backends have no such setting and are left as they are, as is every backend when
+    timeout_ms is not set.
+    """
+    if timeout_ms and engine.dialect.name == "postgresql":
+        event.listen(engine, "connect", functools.partial(set_statement_timeout, timeout_ms))
+
+
+def set_statement_timeout(timeout_ms, dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"SET statement_timeout = {int(timeout_ms)}")
+    cursor.close()
+    # SET is transactional, so commit it before the pool's reset on return rolls it back
+    dbapi_connection.commit()
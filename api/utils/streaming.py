@@ -0,0 +1,67 @@
+import functools
+import json
+from flask import Response, current_app, request, stream_with_context
+from flask_restx import inputs, marshal
+from .bulk import NDJSON_MIMETYPE
+from .pagination import keyset
+from .. import db
+
+
+def add_stream_argument(parser):
+    """
+    Adds the stream argument, which asks a list endpoint for an NDJSON stream of every matching entry, to the given request parser.
+    """
+    parser.add_argument("stream", required=False, type=inputs.boolean,
+                        help="set to 1 to stream every matching entry as NDJSON")
+
+    return parser
+
+
+def wants_stream(args):
+    """
+    Returns True if the client asked for an NDJSON stream through the stream argument or the Accept header.
+    """
+    if args.get("stream"):
+        return True
+
+    return request.accept_mimetypes.best_match(["application/json", NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+
+def stream_entries(query, model, fields, serialize, args, skip_none=False):
+    """
+    Returns a response that writes each entry of the given select, in the sort order and from the cursor in args,
+    as one line of NDJSON as soon as it is serialized.
+    Rows are read through a server-side cursor in batches of STREAM_BATCH_SIZE, so memory use does not grow with the result.
+    """
+    segments = [segment.execution_options(stream_results=True, yield_per=current_app.config["STREAM_BATCH_SIZE"])
+                for segment in keyset(query, model, args)]
+
+    def generate():
+        for segment in segments:
+            for entry in db.session.execute(segment).scalars():
+                yield json.dumps(marshal(serialize(entry), fields, skip_none=skip_none)) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+
+
+def streamable(parser, model, fields, skip_none=False):
+    """
+    Decorates a marshalled list handler so that it returns an NDJSON stream instead when the client asks for one.
+    The resource must provide list_query(args), and may provide serialize(entry, args) to override to_dict.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(resource, *args, **kwargs):
+            parsed_args = parser.parse_args()
+            if not wants_stream(parsed_args):
+                return func(resource, *args, **kwargs)
+
+            serialize = getattr(resource, "serialize",
+                                lambda entry, _: entry.to_dict())
+
+            return stream_entries(resource.list_query(parsed_args), model, fields,
+                                  lambda entry: serialize(entry, parsed_args), parsed_args, skip_none)
+
+        return wrapper
+
+    return decorator
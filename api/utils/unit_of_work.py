@@ -0,0 +1,88 @@
+import contextlib
+from flask import has_request_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from .. import app, db
+
+
+def in_unit_of_work():
+    """
+    Returns True if the session's writes are committed as a whole by a unit of work: the current request,
+    or a batch opened by the caller.
+    """
+    return has_request_context() or db.session.info.get("batch", False)
+
+
+def finish_write():
+    """
+    Ends a model method's write: commits it straight away, unless it is staged in a unit of work that commits it later.
+    """
+    if not in_unit_of_work():
+        db.session.commit()
+
+
+def after_commit(func, *args):
+    """
+    Calls func with args once the unit of work in progress has been committed, or never if it is rolled back.
+    Used for side effects that must not happen before the writes they follow are visible, such as invalidating
+    cached responses and queueing background verification. Outside a unit of work, writes are committed as they are
+    made, so func is called straight away.
+    """
+    if not in_unit_of_work():
+        func(*args)
+        return
+
+    db.session.info.setdefault("after_commit", []).append((func, args))
+
+
+@event.listens_for(Session, "after_commit")
+def run_after_commit(session):
+    for func, args in session.info.pop("after_commit", []):
+        func(*args)
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_after_commit(session):
+    session.info.pop("after_commit", None)
+
+
+@contextlib.contextmanager
+def batch():
+    """
+    Runs the block as one unit of work, so that every model method called in it only stages its writes, which are
+    committed together when the block exits and rolled back if it raises. Lets bulk imports and scripts write many
+    rows per commit; batches cannot be nested.
+    """
+    if in_unit_of_work():
+        raise RuntimeError("Already in a unit of work")
+
+    db.session.info["batch"] = True
+    try:
+        yield db.session
+        db.session.commit()
+    except BaseException:
+        db.session.rollback()
+        raise
+    finally:
+        db.session.info.pop("batch", None)
+
+
+def commit_request(response):
+    """
+    Commits everything the request staged, once, if it succeeded, and rolls it back otherwise.
+    """
+    if response.status_code < 400:
+        db.session.commit()
+    else:
+        db.session.rollback()
+
+    return response
+
+
+def rollback_request(exception):
+    if exception is not None:
+        db.session.rollback()
+
+
+app.after_request(commit_request)
+app.teardown_request(rollback_request)
@@ -1,13 +1,124 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, urlunsplit
 import requests
+from requests.adapters import HTTPAdapter
+from sqlalchemy.util import await_only
+from .lru_cache import LRUCache
+from .instrumentation import timed
+from .async_io import serving_async
+from .. import app
 
 
+session = requests.Session()
+adapter = HTTPAdapter(pool_connections=app.config["YOUTUBE_VERIFY_POOL_SIZE"],
+                      pool_maxsize=app.config["YOUTUBE_VERIFY_POOL_SIZE"],
+                      max_retries=0)
+session.mount("http://", adapter)
+session.mount("https://", adapter)
+
+executor = ThreadPoolExecutor(max_workers=app.config["YOUTUBE_VERIFY_POOL_SIZE"],
+                              thread_name_prefix="url-fetch")
+
+async_session = None
+
+verified_urls = LRUCache(max_size=app.config["YOUTUBE_VERIFY_CACHE_SIZE"],
+                         ttl=app.config["YOUTUBE_VERIFY_CACHE_TTL"])
+
+
+def verification_target(url):
+    """
+    Returns the URL that is actually fetched to verify the given URL, rewritten onto YOUTUBE_VERIFY_ORIGIN if one is configured.
+    """
+    origin = app.config["YOUTUBE_VERIFY_ORIGIN"]
+    if not origin:
+        return url
+
+    parts = urlsplit(url)
+    origin_parts = urlsplit(origin)
+
+    return urlunsplit((origin_parts.scheme, origin_parts.netloc, parts.path, parts.query, parts.fragment))
+
+
+@timed("http")
 def verify_youtube_url(url):
     """
     Returns True if youtube video get is successful from given URL, otherwise False.
+    Definitive answers are cached for YOUTUBE_VERIFY_CACHE_TTL seconds, while timeouts and connection errors are not cached.
+    On the ASGI app's event loop the request is awaited on the async HTTP client instead.
+    """
+    if serving_async():
+        return await_only(verify_youtube_url_async(url))
+
+    cached = verified_urls.get(url)
+    if cached is not None:
+        return cached
+
+    try:
+        response = session.get(verification_target(url), stream=True,
+                               timeout=(app.config["YOUTUBE_VERIFY_CONNECT_TIMEOUT"],
+                                        app.config["YOUTUBE_VERIFY_READ_TIMEOUT"]))
+        response.close()
+
+    except requests.RequestException:
+        return False
+
+    verified = response.status_code >= 200 and response.status_code <= 299
+    verified_urls.set(url, verified)
+
+    return verified
+
+
+@timed("http")
+def verify_youtube_urls(urls):
+    """
+    Verifies the given URLs concurrently over the shared session and returns a dictionary mapping each URL to its result.
+    """
+    unique_urls = list(dict.fromkeys(urls))
+    if serving_async():
+        return dict(zip(unique_urls, await_only(asyncio.gather(*map(verify_youtube_url_async, unique_urls)))))
+
+    return dict(zip(unique_urls, executor.map(verify_youtube_url, unique_urls)))
+
+
+def open_async_session():
+    """
+    Creates the pooled HTTP client that verifies URLs on the ASGI app's event loop, with the same limits as the session.
     """
+    global async_session
+    import httpx
+
+    async_session = httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=app.config["YOUTUBE_VERIFY_POOL_SIZE"]),
+        timeout=httpx.Timeout(app.config["YOUTUBE_VERIFY_READ_TIMEOUT"],
+                              connect=app.config["YOUTUBE_VERIFY_CONNECT_TIMEOUT"]))
+
+
+async def close_async_session():
+    global async_session
+    await async_session.aclose()
+    async_session = None
+
+
+async def verify_youtube_url_async(url):
+    """
+    Returns True if youtube video get is successful from given URL, otherwise False, awaiting the request on the
+    async HTTP client. Shares the cache of verify_youtube_url.
+    """
+    import httpx
+
+    cached = verified_urls.get(url)
+    if cached is not None:
+        return cached
+
     try:
-        response = requests.get(url)
-        return response.status_code >= 200 and response.status_code <= 299
+        async with async_session.stream("GET", verification_target(url)) as response:
+            status_code = response.status_code
 
-    except requests.ConnectionError:
+    except httpx.HTTPError:
         return False
+
+    verified = status_code >= 200 and status_code <= 299
+    verified_urls.set(url, verified)
+
+    return verified
@@ -0,0 +1,55 @@
+from concurrent.futures import ThreadPoolExecutor
+from .url import verify_youtube_url
+from .async_io import serving_async, spawn
+from .response_cache import response_cache
+from .unit_of_work import after_commit, finish_write
+from .. import app, db
+
+
+executor = ThreadPoolExecutor(max_workers=app.config["YOUTUBE_VERIFY_WORKERS"],
+                              thread_name_prefix="url-verification")
+
+
+def verification_is_async():
+    """
+    Returns True if new video URLs are accepted as pending and verified in the background.
+    """
+    return app.config["YOUTUBE_VERIFY_MODE"] == "async"
+
+
+def verify_video(video_id, url):
+    """
+    Verifies the URL of the given video and records the outcome as its status,
+    unless the video has been deleted or given another URL in the meantime.
+    """
+    from ..models.videos import Video
+
+    verified = verify_youtube_url(url)
+
+    with app.app_context():
+        video = db.session.get(Video, video_id)
+        if video is None or video.url != url:
+            return
+
+        video.status = Video.VERIFIED if verified else Video.INVALID
+        finish_write()
+        after_commit(response_cache.invalidate, video.cache_tags())
+
+
+def queue_verification(video_id, url):
+    """
+    Schedules background verification of the given pending video once the unit of work creating or changing it
+    has been committed, so that the verification never looks for it before it is visible.
+    """
+    after_commit(start_verification, video_id, url)
+
+
+def start_verification(video_id, url):
+    """
+    Starts background verification of the given video and returns its future.
+    When serving over ASGI it runs as a task on the event loop instead of taking a worker thread.
+    """
+    if serving_async():
+        return spawn(verify_video, video_id, url)
+
+    return executor.submit(verify_video, video_id, url)
@@ -0,0 +1,46 @@
+import hashlib
+import re
+from urllib.parse import parse_qs, urlsplit
+
+
+WATCH_HOSTS = {"youtube.com", "www.youtube.com", "m.youtube.com"}
+SHORT_HOSTS = {"youtu.be", "www.youtu.be"}
+URL_DOMAINS = sorted(WATCH_HOSTS | SHORT_HOSTS)
+VIDEO_ID = re.compile(r"[A-Za-z0-9_-]+")
+URL_HASH_SIZE = 16
+
+
+def youtube_video_id(url):
+    """
+    Returns the ID of the YouTube video that the given watch page or youtu.be link points to, or None for any other URL.
+    """
+    parts = urlsplit(url)
+    host = (parts.hostname or "").lower()
+
+    if host in WATCH_HOSTS and parts.path.rstrip("/") == "/watch":
+        video_id = parse_qs(parts.query).get("v", [""])[0]
+    elif host in SHORT_HOSTS:
+        video_id = parts.path.strip("/")
+    else:
+        return None
+
+    return video_id if VIDEO_ID.fullmatch(video_id) else None
+
+
+def canonical_url(url):
+    """
+    Returns the one URL standing for every link to the same YouTube video, whatever its scheme, host or extra
+    arguments. Any other URL is left exactly as given, since it does not name a video.
+    """
+    video_id = youtube_video_id(url)
+    if video_id is None:
+        return url
+
+    return f"https://www.youtube.com/watch?v={video_id}"
+
+
+def url_hash(url):
+    """
+    Returns the fixed-size hash of the canonical form of the given URL, which video lookups and duplicate checks match on.
+    """
+    return hashlib.blake2b(canonical_url(url).encode(), digest_size=URL_HASH_SIZE).digest()
@@ -0,0 +1,4 @@
+from api.asgi import create_asgi_app
+
+# serve with any ASGI server, for example: uvicorn asgi:app
+app = create_asgi_app()
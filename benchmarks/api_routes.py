@@ -0,0 +1,396 @@
+"""
+Seeds a synthetic dataset into its own SQLite database and measures the latency percentiles and throughput of every
+route of the Videos, Comments and Users namespaces, through the Flask test client or a local WSGI server.
+Results are written as JSON, and compared against an earlier run's JSON when a baseline is given, failing with
+exit status 1 if any route got slower by more than the threshold.
+
+    python -m benchmarks.api_routes --rows 1000000 --output results.json
+    python -m benchmarks.api_routes --rows 1000000 --client wsgi --concurrency 8 --baseline results.json
+"""
+import argparse
+import datetime
+import itertools
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os import path
+from .seeding import seed, seeded_counts, video_url
+
+basedir = path.abspath(path.dirname(path.dirname(__file__)))
+
+API_KEY = "bench_key_0"
+
+
+class Route:
+    """
+    One benchmarked route, with a function that returns the method, path and keyword arguments of a request to it.
+    The function gets the run's state and a random generator, and may take created IDs from the state's queues,
+    while created names the queue the IDs of entries that the route creates are put on.
+    """
+
+    def __init__(self, name, build, created=None):
+        self.name = name
+        self.build = build
+        self.created = created
+
+
+def random_date(rng):
+    return datetime.date(2015, 1, 1) + datetime.timedelta(days=rng.randrange(3650))
+
+
+def new_video(state, rng):
+    return {"url": f"https://youtube.com/watch?v=run{next(state.sequence)}", "user_id": state.user(rng),
+            "description": "benchmark video"}
+
+
+def random_ids(rng, total, count=20):
+    """
+    Returns the ids argument of a batch request for count random IDs between 1 and total.
+    """
+    return ",".join(str(rng.randint(1, total)) for _ in range(count))
+
+
+def put_video(state, rng):
+    index = rng.randrange(state.videos)
+    return "PUT", f"/Videos/{index + 1}", {"json": {"url": video_url(index), "user_id": state.user(rng)}}
+
+
+def put_user(state, rng):
+    index = rng.randrange(state.users)
+    return "PUT", f"/Users/{index + 1}", {"json": {"username": f"bench_{index}"}}
+
+
+ROUTES = [
+    Route("GET /Videos/", lambda state, rng: ("GET", "/Videos/", {})),
+    Route("GET /Videos/?after", lambda state, rng: (
+        "GET", "/Videos/", {"query_string": {"after": state.video(rng)}})),
+    Route("GET /Videos/?url", lambda state, rng: (
+        "GET", "/Videos/", {"query_string": {"url": video_url(state.video(rng) - 1)}})),
+    Route("GET /Videos/?user_id", lambda state, rng: (
+        "GET", "/Videos/", {"query_string": {"user_id": state.user(rng), "sort": "-date"}})),
+    Route("GET /Videos/?date_from&date_to", lambda state, rng: (
+        "GET", "/Videos/", {"query_string": {"date_from": random_date(rng).isoformat(), "sort": "date",
+                                             "date_to": (random_date(rng) + datetime.timedelta(days=30)).isoformat()}})),
+    Route("GET /Videos/<id>", lambda state, rng: ("GET", f"/Videos/{state.video(rng)}", {})),
+    Route("GET /Videos/<id>/comments", lambda state, rng: ("GET", f"/Videos/{state.video(rng)}/comments", {})),
+    Route("GET /Videos/batch", lambda state, rng: (
+        "GET", "/Videos/batch", {"query_string": {"ids": random_ids(rng, state.videos)}})),
+    Route("POST /Videos/", lambda state, rng: ("POST", "/Videos/", {"json": new_video(state, rng)}),
+          created="videos"),
+    Route("POST /Videos/bulk", lambda state, rng: (
+        "POST", "/Videos/bulk", {"json": [new_video(state, rng) for _ in range(10)]}), created="videos"),
+    Route("PATCH /Videos/<id>", lambda state, rng: (
+        "PATCH", f"/Videos/{state.video(rng)}", {"json": {"description": f"patched {rng.random()}"}})),
+    Route("PUT /Videos/<id>", put_video),
+    Route("DELETE /Videos/<id>", lambda state, rng: ("DELETE", f"/Videos/{state.take('videos')}", {})),
+    Route("GET /Comments/", lambda state, rng: ("GET", "/Comments/", {})),
+    Route("GET /Comments/?video_id", lambda state, rng: (
+        "GET", "/Comments/", {"query_string": {"video_id": state.video(rng)}})),
+    Route("GET /Comments/?user_id", lambda state, rng: (
+        "GET", "/Comments/", {"query_string": {"user_id": state.user(rng)}})),
+    Route("GET /Comments/<id>", lambda state, rng: ("GET", f"/Comments/{state.comment(rng)}", {})),
+    Route("GET /Comments/batch", lambda state, rng: (
+        "GET", "/Comments/batch", {"query_string": {"ids": random_ids(rng, state.comments)}})),
+    Route("POST /Comments/", lambda state, rng: (
+        "POST", "/Comments/", {"json": {"video_id": state.video(rng), "user_id": state.user(rng),
+                                        "body": "benchmark comment"}}), created="comments"),
+    Route("PATCH /Comments/<id>", lambda state, rng: (
+        "PATCH", f"/Comments/{state.comment(rng)}", {"json": {"body": f"patched {rng.random()}"}})),
+    Route("PUT /Comments/<id>", lambda state, rng: (
+        "PUT", f"/Comments/{state.comment(rng)}", {"json": {"body": f"put {rng.random()}", "user_id": state.user(rng),
+                                                          "video_id": state.video(rng)}})),
+    Route("DELETE /Comments/<id>", lambda state, rng: ("DELETE", f"/Comments/{state.take('comments')}", {})),
+    Route("GET /Users/", lambda state, rng: ("GET", "/Users/", {})),
+    Route("GET /Users/?username", lambda state, rng: (
+        "GET", "/Users/", {"query_string": {"username": f"bench_{rng.randrange(state.users)}"}})),
+    Route("GET /Users/?expand=videos", lambda state, rng: (
+        "GET", "/Users/", {"query_string": {"expand": "videos", "limit": 20, "after": state.user(rng)}})),
+    Route("GET /Users/<id>", lambda state, rng: ("GET", f"/Users/{state.user(rng)}", {})),
+    Route("GET /Users/batch", lambda state, rng: (
+        "GET", "/Users/batch", {"query_string": {"ids": random_ids(rng, state.users)}})),
+    Route("GET /Users/batch?expand=videos", lambda state, rng: (
+        "GET", "/Users/batch", {"query_string": {"ids": random_ids(rng, state.users), "expand": "videos"}})),
+    Route("POST /Users/", lambda state, rng: (
+        "POST", "/Users/", {"json": {"username": f"run_{next(state.sequence)}"}}), created="users"),
+    Route("PATCH /Users/<id>", lambda state, rng: ("PATCH", *put_user(state, rng)[1:])),
+    Route("PUT /Users/<id>", put_user),
+    Route("DELETE /Users/<id>", lambda state, rng: ("DELETE", f"/Users/{state.take('users')}", {})),
+]
+
+
+class RunState:
+    """
+    What requests need to know about the dataset: how many of each entry were seeded, and the IDs of the entries
+    created by the run so far, which the delete routes consume.
+    """
+
+    def __init__(self, users, videos, comments):
+        self.users, self.videos, self.comments = users, videos, comments
+        self.sequence = itertools.count()
+        self.queues = {"videos": [], "comments": [], "users": []}
+        self.lock = threading.Lock()
+
+    def user(self, rng):
+        return rng.randint(1, self.users)
+
+    def video(self, rng):
+        return rng.randint(1, self.videos)
+
+    def comment(self, rng):
+        return rng.randint(1, self.comments)
+
+    def add(self, queue, ids):
+        with self.lock:
+            self.queues[queue] += ids
+
+    def take(self, queue):
+        with self.lock:
+            return self.queues[queue].pop() if self.queues[queue] else 0
+
+
+def created_ids(body):
+    """
+    Returns the IDs of the entries a create route returned, from a single entry or a bulk result.
+    """
+    if "results" in body:
+        return [result["id"] for result in body["results"] if result.get("id")]
+
+    return [body["id"]] if body.get("id") else []
+
+
+class StubYoutubeHandler(BaseHTTPRequestHandler):
+    """
+    Answers every URL verification with 200, so writes are measured without YouTube's latency.
+    """
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10_000,
+                        help="total rows to seed, as 1%% users, 33%% videos and 66%% comments")
+    parser.add_argument("--requests", type=int, default=200,
+                        help="number of timed requests to every route")
+    parser.add_argument("--warmup", type=int, default=20,
+                        help="number of untimed requests to every route before timing it")
+    parser.add_argument("--client", choices=("test", "wsgi"), default="test",
+                        help="send requests through the Flask test client or over HTTP to a local WSGI server")
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="number of threads sending requests at once")
+    parser.add_argument("--routes", default="",
+                        help="only benchmark the routes whose names contain this text")
+    parser.add_argument("--database", default=path.join(basedir, "benchmark_routes.db"),
+                        help="SQLite file to seed, reused while it holds the requested number of rows")
+    parser.add_argument("--output", help="file to write the JSON results to, instead of standard output")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="largest allowed slowdown of p50 or p99 relative to the baseline, as a fraction")
+
+    return parser.parse_args()
+
+
+def percentile(sorted_values, fraction):
+    """
+    Returns the nearest-rank percentile of the given sorted values.
+    """
+    return sorted_values[max(0, min(len(sorted_values) - 1, round(fraction * len(sorted_values)) - 1))]
+
+
+def test_client_sender(app):
+    client = app.test_client()
+
+    def send(method, url, kwargs):
+        response = client.open(url, method=method, headers={"X-API-Key": API_KEY}, **kwargs)
+        return response.status_code, response.get_json(silent=True)
+
+    return send
+
+
+def wsgi_sender(base_url):
+    import requests
+
+    session = requests.Session()
+    session.headers["X-API-Key"] = API_KEY
+
+    def send(method, url, kwargs):
+        response = session.request(method, base_url + url, params=kwargs.get("query_string"),
+                                   json=kwargs.get("json"))
+        try:
+            return response.status_code, response.json()
+        except ValueError:
+            return response.status_code, None
+
+    return send
+
+
+def run_route(route, state, senders, requests, warmup):
+    """
+    Sends warmup and then requests requests to the route, spread over the senders' threads, and returns its results.
+    """
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def work(send, count, timed, seed_value):
+        rng = random.Random(seed_value)
+        for _ in range(count):
+            method, url, kwargs = route.build(state, rng)
+            started = time.perf_counter()
+            status, body = send(method, url, kwargs)
+            elapsed = time.perf_counter() - started
+            if route.created and isinstance(body, dict):
+                state.add(route.created, created_ids(body))
+
+            with lock:
+                if status >= 400:
+                    errors.append(status)
+                if timed:
+                    latencies.append(elapsed)
+
+    def run(total, timed):
+        shares = [total // len(senders) + (index < total % len(senders)) for index in range(len(senders))]
+        threads = [threading.Thread(target=work, args=(send, share, timed, f"{route.name}:{index}:{timed}"))
+                   for index, (send, share) in enumerate(zip(senders, shares))]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return time.perf_counter() - started
+
+    run(warmup, False)
+    errors.clear()
+    elapsed = run(requests, True)
+    latencies.sort()
+
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "mean_ms": sum(latencies) / len(latencies) * 1000,
+        "throughput_rps": len(latencies) / elapsed,
+    }
+
+
+def compare(results, baseline, threshold):
+    """
+    Prints how every route's p50 and p99 changed against the baseline and returns the names of the routes that got
+    slower by more than the threshold.
+    """
+    regressions = []
+    differences = [key for key in ("rows", "client", "concurrency")
+                   if results["meta"][key] != baseline["meta"].get(key)]
+    if differences:
+        print("baseline was run with a different " + ", ".join(differences), file=sys.stderr)
+
+    print(f"{'route':<36} {'p50 ms':>9} {'base':>9} {'p99 ms':>9} {'base':>9}", file=sys.stderr)
+    for name, result in results["routes"].items():
+        before = baseline["routes"].get(name)
+        if before is None:
+            continue
+
+        slower = [metric for metric in ("p50_ms", "p99_ms") if result[metric] > before[metric] * (1 + threshold)]
+        if slower:
+            regressions.append(name)
+
+        print(f"{name:<36} {result['p50_ms']:>9.2f} {before['p50_ms']:>9.2f} {result['p99_ms']:>9.2f} "
+              f"{before['p99_ms']:>9.2f}{'  REGRESSION' if slower else ''}", file=sys.stderr)
+
+    return regressions
+
+
+def main():
+    options = parse_arguments()
+    stub = ThreadingHTTPServer(("127.0.0.1", 0), StubYoutubeHandler)
+    threading.Thread(target=stub.serve_forever, daemon=True).start()
+    os.environ["APP_CONFIG"] = "development"
+    os.environ["DEV_DATABASE_URI"] = f"sqlite:///{options.database}"
+    os.environ["YOUTUBE_VERIFY_ORIGIN"] = f"http://127.0.0.1:{stub.server_port}"
+
+    from api import create_app, db, limiter
+
+    app = create_app()
+    limiter.enabled = False
+    counts = (max(options.rows // 100, 1), max(options.rows * 33 // 100, 1), max(options.rows * 66 // 100, 1))
+
+    with app.app_context():
+        if seeded_counts(db) != counts:
+            seed(db, *counts)
+
+    server = None
+    if options.client == "wsgi":
+        from werkzeug.serving import make_server, WSGIRequestHandler
+
+        class QuietHandler(WSGIRequestHandler):
+            def log_request(self, *args, **kwargs):
+                pass
+
+        server = make_server("127.0.0.1", 0, app, threaded=True, request_handler=QuietHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        senders = [wsgi_sender(f"http://127.0.0.1:{server.server_port}") for _ in range(options.concurrency)]
+    else:
+        senders = [test_client_sender(app) for _ in range(options.concurrency)]
+
+    state = RunState(*counts)
+    results = {
+        "meta": {
+            "rows": options.rows, "users": counts[0], "videos": counts[1], "comments": counts[2],
+            "client": options.client, "concurrency": options.concurrency, "requests": options.requests,
+            "python": platform.python_version(), "sqlite": sqlite3.sqlite_version,
+            "started_at": datetime.datetime.utcnow().isoformat(),
+        },
+        "routes": {},
+    }
+    try:
+        for route in ROUTES:
+            if options.routes in route.name:
+                results["routes"][route.name] = run_route(route, state, senders, options.requests, options.warmup)
+                result = results["routes"][route.name]
+                print(f"{route.name:<36} p50 {result['p50_ms']:>8.2f} ms  p99 {result['p99_ms']:>8.2f} ms  "
+                      f"{result['throughput_rps']:>8.1f} req/s  {result['errors']} errors", file=sys.stderr)
+    finally:
+        if server is not None:
+            server.shutdown()
+        stub.shutdown()
+        from api.models.users import User
+        from api.models.videos import Video
+        from api.models.comments import Comment
+
+        with app.app_context():
+            for model, count in ((Comment, counts[2]), (Video, counts[1]), (User, counts[0])):
+                db.session.execute(db.delete(model).where(model.id > count))
+            db.session.commit()
+
+    output = json.dumps(results, indent=2)
+    if options.output:
+        with open(options.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+    if options.baseline:
+        with open(options.baseline) as file:
+            regressions = compare(results, json.load(file), options.threshold)
+        if regressions:
+            print(f"{len(regressions)} routes regressed by more than {options.threshold:.0%}: "
+                  + ", ".join(regressions), file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Synthetic datasets for the benchmarks, written straight into the database with bulk inserts.
+"""
+import datetime
+import random
+import sys
+
+
+def seed(db, users, videos, comments=0, batch_size=50_000):
+    """
+    Rebuilds the schema and inserts the given number of users, videos and comments. Videos are dated over ten years,
+    with one in twenty undated, and spread over the users at random, as are comments over the videos and users,
+    after which the comment counts of the videos are filled in.
+    User n (counting from 0) is named bench_n with the API key bench_key_n, and video n has the url of video_url(n),
+    so that benchmarks can address seeded rows without looking them up.
+    """
+    from api.models.users import User
+    from api.models.videos import Video
+    from api.models.comments import Comment
+    from api.utils.migrations import upgrade
+    from api.utils.youtube import url_hash
+
+    random.seed(0)
+    first_day = datetime.date(2015, 1, 1).toordinal()
+    db.drop_all()
+    upgrade()
+
+    for start in range(0, users, batch_size):
+        db.session.execute(db.insert(User), [{"username": f"bench_{index}", "key": f"bench_key_{index}"}
+                                             for index in range(start, min(start + batch_size, users))])
+        db.session.commit()
+
+    for start in range(0, videos, batch_size):
+        db.session.execute(db.insert(Video), [{
+            "url": video_url(index),
+            "url_hash": url_hash(video_url(index)),
+            "user_id": random.randint(1, users),
+            "date": None if random.random() < 0.05 else datetime.date.fromordinal(first_day + random.randrange(3650)),
+            "status": Video.VERIFIED,
+        } for index in range(start, min(start + batch_size, videos))])
+        db.session.commit()
+        print(f"seeded {min(start + batch_size, videos)} videos", file=sys.stderr)
+
+    for start in range(0, comments, batch_size):
+        db.session.execute(db.insert(Comment), [{
+            "video_id": random.randint(1, videos),
+            "user_id": random.randint(1, users),
+            "body": f"benchmark comment {index}",
+        } for index in range(start, min(start + batch_size, comments))])
+        db.session.commit()
+        print(f"seeded {min(start + batch_size, comments)} comments", file=sys.stderr)
+
+    if comments:
+        counts = db.select(db.func.count(Comment.id)).where(Comment.video_id == Video.id)
+        newest = db.select(Comment.created_at).where(Comment.video_id == Video.id).order_by(Comment.id.desc()).limit(1)
+        db.session.execute(db.update(Video).values(comment_count=counts.scalar_subquery(),
+                                                   last_comment_at=newest.scalar_subquery()))
+        db.session.commit()
+
+    db.session.execute(db.text("ANALYZE"))
+    db.session.commit()
+
+
+def video_url(index):
+    """
+    Returns the url of the seeded video with the given index, counting from 0.
+    """
+    return f"https://youtube.com/watch?v=bench{index}"
+
+
+def seeded_counts(db):
+    """
+    Returns the number of users, videos and comments in the database.
+    """
+    from api.models.users import User
+    from api.models.videos import Video
+    from api.models.comments import Comment
+
+    return tuple(db.session.execute(db.select(db.func.count(model.id))).scalar()
+                 for model in (User, Video, Comment))
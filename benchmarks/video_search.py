@@ -0,0 +1,91 @@
+"""
+Seeds a synthetic dataset of videos into its own SQLite database and times the video searches against it,
+printing the query plan of each search so it is clear which index serves it.
+
+    python -m benchmarks.video_search --videos 1000000
+"""
+import argparse
+import os
+import statistics
+import time
+from os import path
+from .seeding import seed, seeded_counts
+
+basedir = path.abspath(path.dirname(path.dirname(__file__)))
+
+SEARCHES = {
+    "latest": {"sort": "-date"},
+    "latest, deep page": {"sort": "-date", "after": "2018-06-15:500000"},
+    "date range": {"date_from": "2020-03-01", "date_to": "2020-03-31", "sort": "date"},
+    "date range, latest first": {"date_from": "2020-03-01", "date_to": "2020-03-31", "sort": "-date"},
+    "date range, deep page": {"date_from": "2020-01-01", "sort": "date", "after": "2022-06-15:500000"},
+    "user": {"user_id": 42},
+    "user, latest first": {"user_id": 42, "sort": "-date"},
+    "user and date range": {"user_id": 42, "date_from": "2019-01-01", "date_to": "2021-12-31", "sort": "date"},
+}
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--videos", type=int, default=1_000_000,
+                        help="number of videos to seed")
+    parser.add_argument("--users", type=int, default=10_000,
+                        help="number of users to spread the videos over")
+    parser.add_argument("--repeat", type=int, default=20,
+                        help="number of timed runs of every search")
+    parser.add_argument("--database", default=path.join(basedir, "benchmark.db"),
+                        help="SQLite file to seed, reused while it holds the requested number of videos")
+
+    return parser.parse_args()
+
+
+def query_plan(db, query):
+    """
+    Returns SQLite's plan for the given select on one line.
+    """
+    compiled = query.compile(db.engine, compile_kwargs={"literal_binds": True})
+
+    return "; ".join(row[-1] for row in db.session.execute(db.text(f"EXPLAIN QUERY PLAN {compiled}"))
+                     if "PRIMARY KEY" not in row[-1])
+
+
+def main():
+    options = parse_arguments()
+    os.environ["APP_CONFIG"] = "development"
+    os.environ["DEV_DATABASE_URI"] = f"sqlite:///{options.database}"
+
+    from api import create_app, db
+
+    app = create_app()
+
+    from api.models.videos import Video
+    from api.routes.video_routes import VideoList, get_parser
+    from api.utils.pagination import keyset, paginate
+
+    with app.app_context():
+        if seeded_counts(db) != (options.users, options.videos, 0):
+            seed(db, options.users, options.videos)
+
+        print(f"{'search':<28} {'median ms':>10} {'rows':>6}  plan")
+        for name, query_string in SEARCHES.items():
+            with app.test_request_context("/Videos/", query_string=query_string):
+                args = get_parser.parse_args()
+                query = VideoList.list_query(args)
+                nullable = not any(args[name] for name in ("date", "date_from", "date_to"))
+                timings = []
+                for _ in range(options.repeat):
+                    started = time.perf_counter()
+                    videos, _ = paginate(query, Video, args, nullable)
+                    [video.to_dict() for video in videos]
+                    timings.append((time.perf_counter() - started) * 1000)
+                    db.session.expunge_all()
+
+                plan = " | ".join(query_plan(db, segment.limit(101))
+                                  for segment in keyset(query, Video, args, nullable))
+
+            print(f"{name:<28} {statistics.median(timings):>10.2f} {len(videos):>6}  {plan}")
+
+
+if __name__ == "__main__":
+    main()
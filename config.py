@@ -8,6 +8,42 @@ load_dotenv(path.join(basedir, ".env"))
 class Config:
     """Set Flask config variables."""
     RESTX_MASK_SWAGGER = False
+    DB_POOL_METRICS = False
+    DB_POOL_SLOW_CHECKOUT = float(environ.get("DB_POOL_SLOW_CHECKOUT", 0.1))
+    DB_STATEMENT_TIMEOUT_MS = None
+    API_KEY_CACHE_SIZE = int(environ.get("API_KEY_CACHE_SIZE", 10000))
+    API_KEY_CACHE_TTL = int(environ.get("API_KEY_CACHE_TTL", 300))
+    DEFAULT_PAGE_SIZE = int(environ.get("DEFAULT_PAGE_SIZE", 100))
+    MAX_PAGE_SIZE = int(environ.get("MAX_PAGE_SIZE", 1000))
+    YOUTUBE_VERIFY_MODE = environ.get("YOUTUBE_VERIFY_MODE", "sync")
+    YOUTUBE_VERIFY_ORIGIN = environ.get("YOUTUBE_VERIFY_ORIGIN")
+    YOUTUBE_VERIFY_CONNECT_TIMEOUT = float(
+        environ.get("YOUTUBE_VERIFY_CONNECT_TIMEOUT", 3.05))
+    YOUTUBE_VERIFY_READ_TIMEOUT = float(
+        environ.get("YOUTUBE_VERIFY_READ_TIMEOUT", 5))
+    YOUTUBE_VERIFY_POOL_SIZE = int(environ.get("YOUTUBE_VERIFY_POOL_SIZE", 10))
+    YOUTUBE_VERIFY_CACHE_SIZE = int(
+        environ.get("YOUTUBE_VERIFY_CACHE_SIZE", 10000))
+    YOUTUBE_VERIFY_CACHE_TTL = int(environ.get("YOUTUBE_VERIFY_CACHE_TTL", 3600))
+    YOUTUBE_VERIFY_WORKERS = int(environ.get("YOUTUBE_VERIFY_WORKERS", 4))
+    BULK_MAX_ITEMS = int(environ.get("BULK_MAX_ITEMS", 1000))
+    BATCH_MAX_IDS = int(environ.get("BATCH_MAX_IDS", 200))
+    STREAM_BATCH_SIZE = int(environ.get("STREAM_BATCH_SIZE", 1000))
+    RATELIMIT_STORAGE_URI = environ.get("RATELIMIT_STORAGE_URI", "memory://")
+    RATELIMIT_STRATEGY = environ.get(
+        "RATELIMIT_STRATEGY", "sliding-window-counter")
+    RESPONSE_CACHE_URI = environ.get("RESPONSE_CACHE_URI", "memory://")
+    RESPONSE_CACHE_SIZE = int(environ.get("RESPONSE_CACHE_SIZE", 1000))
+    RESPONSE_CACHE_TTL = int(environ.get("RESPONSE_CACHE_TTL", 300))
+    IDEMPOTENCY_STORE_URI = environ.get("IDEMPOTENCY_STORE_URI", "memory://")
+    IDEMPOTENCY_STORE_SIZE = int(environ.get("IDEMPOTENCY_STORE_SIZE", 10000))
+    IDEMPOTENCY_KEY_TTL = int(environ.get("IDEMPOTENCY_KEY_TTL", 86400))
+    IDEMPOTENCY_LOCK_TTL = int(environ.get("IDEMPOTENCY_LOCK_TTL", 60))
+    SEARCH_BACKEND = environ.get("SEARCH_BACKEND")
+    INSTRUMENTATION = environ.get("INSTRUMENTATION", "0") == "1"
+    PROFILE_SAMPLE_RATE = float(environ.get("PROFILE_SAMPLE_RATE", 0))
+    PROFILE_DIR = environ.get("PROFILE_DIR", path.join(basedir, "profiles"))
+    PROFILE_KEEP = int(environ.get("PROFILE_KEEP", 20))
 
 
 class ProdConfig(Config):
@@ -15,6 +51,22 @@ class ProdConfig(Config):
     DEBUG = False
     TESTING = False
     SQLALCHEMY_DATABASE_URI = environ.get("PROD_DATABASE_URI")
+    AUTO_MIGRATE = False
+    RATELIMIT_STORAGE_URI = environ.get(
+        "RATELIMIT_STORAGE_URI", f"sqlite:///{path.join(basedir, 'ratelimit.db')}")
+    RESPONSE_CACHE_URI = environ.get(
+        "RESPONSE_CACHE_URI", f"sqlite:///{path.join(basedir, 'responsecache.db')}")
+    IDEMPOTENCY_STORE_URI = environ.get(
+        "IDEMPOTENCY_STORE_URI", f"sqlite:///{path.join(basedir, 'idempotency.db')}")
+    DB_POOL_METRICS = True
+    DB_STATEMENT_TIMEOUT_MS = int(environ.get("DB_STATEMENT_TIMEOUT_MS", 5000))
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        "pool_size": int(environ.get("DB_POOL_SIZE", 10)),
+        "max_overflow": int(environ.get("DB_MAX_OVERFLOW", 5)),
+        "pool_timeout": float(environ.get("DB_POOL_TIMEOUT", 10)),
+        "pool_pre_ping": True,
+        "pool_recycle": int(environ.get("DB_POOL_RECYCLE", 1800)),
+    }
 
 
 class DevConfig(Config):
@@ -22,3 +74,22 @@ class DevConfig(Config):
     DEBUG = True
     TESTING = True
     SQLALCHEMY_DATABASE_URI = environ.get("DEV_DATABASE_URI")
+    AUTO_MIGRATE = environ.get("AUTO_MIGRATE", "1") == "1"
+
+
+configs = {
+    "production": ProdConfig,
+    "development": DevConfig,
+}
+
+
+def get_config():
+    """
+    Returns the config class named by the APP_CONFIG environment variable, defaulting to development.
+    Raises a ValueError naming the known configs if APP_CONFIG names none of them.
+    """
+    name = environ.get("APP_CONFIG", "development")
+    if name not in configs:
+        raise ValueError(f"Unknown APP_CONFIG {name!r}, expected one of: {', '.join(configs)}")
+
+    return configs[name]
@@ -0,0 +1,5 @@
+from api.utils.migrations import upgrade
+
+if __name__ == "__main__":
+    applied_versions = upgrade()
+    print(f"Applied migrations {applied_versions}" if applied_versions else "Schema is up to date")
@@ -1,7 +1,42 @@
 import pytest
-from api import create_app
+from api import create_app, db, limiter
 import json
+import asyncio
+import datetime
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from sqlalchemy import event
 from api.utils.db_management import db_cleanup
+from api.utils.APIKEY.key_cache import KeyCache
+from api.models.users import User
+from api.models.videos import Video
+from api.models.comments import Comment
+from api.utils.geo import within_radius
+from api.utils.pagination import keyset
+from api.utils.url import verify_youtube_url, verified_urls
+from api.utils.pool_metrics import MeteredQueuePool, pool_metrics
+from api.utils.instrumentation import request_metrics, slowest_profiles
+from api.utils.unit_of_work import batch, after_commit
+from api.utils.idempotency import idempotency_store, SQLiteStore, get_store
+from api.utils.youtube import canonical_url, url_hash
+from config import get_config, ProdConfig, DevConfig
+from api.utils.migrations import upgrade, check_schema, schema_version, SchemaOutOfDate, LATEST_VERSION
+from sqlalchemy import inspect
+from api.utils.limiter_storage import SQLiteStorage
+from api.utils.response_cache import SQLiteBackend, MemoryBackend, ResponseCache, get_backend
+from limits import parse
+from limits.storage import storage_from_string
+from limits.strategies import SlidingWindowCounterRateLimiter
+import sqlite3
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError, IntegrityError
+from sqlalchemy import create_engine, text
+from types import SimpleNamespace
+from api.utils.statement_timeout import limit_statement_time
+from api.utils.async_io import start_serving, stop_serving
+from sqlalchemy.util import greenlet_spawn
+from api.utils.search import PostgresSearchBackend, SearchBackend, SearchHit, get_search_backend
+from sqlalchemy.dialects import postgresql
 
 
 TEST_USERNAME = "test_username"
@@ -33,13 +68,91 @@ def set_second_current_api_key(response):
     second_current_api_key = data.get("key", "")
 
 
+def seed_videos_with_comments(app, count):
+    with app.app_context():
+        for index in range(count):
+            user = User(username=f"user_{index}", key=f"seed_key_{index}")
+            user.save()
+            video = Video(
+                url=f"https://youtube.com/watch?v={index}", user=user)
+            video.save()
+            Comment(user=user, video=video, body=TEST_COMMENT).save()
+
+
+def query_plan(app, query):
+    with app.app_context():
+        compiled = query.compile(
+            db.engine, compile_kwargs={"literal_binds": True})
+        plan = db.session.execute(
+            db.text(f"EXPLAIN QUERY PLAN {compiled}")).all()
+
+    return " ".join(row[-1] for row in plan)
+
+
+def count_statements(app, client, path, method="get", **kwargs):
+    statements = []
+
+    def record_statement(*args):
+        statements.append(args[2])
+
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", record_statement)
+        try:
+            response = getattr(client, method)(path, **kwargs)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", record_statement)
+
+    assert response.status_code == 200
+    return len(statements)
+
+
+class StubYoutubeHandler(BaseHTTPRequestHandler):
+    missing_paths = {"/test_video_url", "/missing"}
+    hits = []
+    in_flight = 0
+    max_in_flight = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        self.hits.append(self.path)
+        if self.path == "/slow":
+            with self.lock:
+                StubYoutubeHandler.in_flight += 1
+                StubYoutubeHandler.max_in_flight = max(StubYoutubeHandler.max_in_flight, self.in_flight)
+            time.sleep(0.5)
+            with self.lock:
+                StubYoutubeHandler.in_flight -= 1
+        status = 404 if self.path in self.missing_paths else 200
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture(scope="session")
+def stub_youtube():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubYoutubeHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
 @pytest.fixture()
-def app():
+def app(stub_youtube):
     app = create_app()
     app.config.update({
         "TESTING": True,
+        "YOUTUBE_VERIFY_ORIGIN": stub_youtube,
     })
     db_cleanup()
+    limiter.reset()
+    verified_urls.clear()
+    idempotency_store.clear()
+    StubYoutubeHandler.hits.clear()
+    StubYoutubeHandler.max_in_flight = 0
 
     yield app
 
@@ -79,6 +192,201 @@ def client_with_comment(client_with_video):
     return client_with_video
 
 
+@pytest.fixture()
+def instrumented_client(client, monkeypatch):
+    monkeypatch.setitem(client.application.config, "INSTRUMENTATION", True)
+    request_metrics.reset()
+    return client
+
+
+def server_timing(response):
+    return {metric.split(";")[0]: metric for metric in response.headers["Server-Timing"].split(", ")}
+
+
+def test_instrumentation_is_off_by_default(client):
+    response = client.get('/Users/')
+    assert "Server-Timing" not in response.headers
+    assert client.get('/metrics').status_code == 404
+
+
+def test_server_timing_header(instrumented_client):
+    instrumented_client.post('/Users/', json={"username": TEST_USERNAME})
+    response = instrumented_client.post('/Videos/', json={"url": TEST_URL, "user_id": 1})
+    timings = server_timing(response)
+    assert set(timings) == {"db", "http", "serialize", "total"}
+    assert 'desc="0 queries"' not in timings["db"]
+    assert float(timings["http"].split("dur=")[1]) > 0
+
+
+def test_server_timing_counts_the_commit(app, instrumented_client):
+    api_key = convert_response_data(instrumented_client.post('/Users/', json={"username": TEST_USERNAME}))["key"]
+    statements = []
+
+    def record_statement(*args):
+        statements.append(args[2])
+
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", record_statement)
+        try:
+            response = instrumented_client.put('/Users/1', json={"username": NEW_TEST_USERNAME, "api_key": api_key})
+        finally:
+            event.remove(db.engine, "before_cursor_execute", record_statement)
+
+    assert response.status_code == 200
+    assert any(statement.startswith("UPDATE table_version") for statement in statements)
+    assert f'desc="{len(statements)} queries"' in server_timing(response)["db"]
+
+
+def test_metrics_endpoint_has_route_histograms(instrumented_client):
+    instrumented_client.get('/Users/')
+    instrumented_client.get('/Users/1')
+    response = instrumented_client.get('/metrics')
+    assert response.status_code == 200
+    text = response.get_data(as_text=True)
+    assert 'http_requests_total{method="GET",route="/Users/",status="200"} 1' in text
+    assert 'http_requests_total{method="GET",route="/Users/<int:id>",status="404"} 1' in text
+    assert 'http_request_duration_seconds_count{method="GET",route="/Users/"} 1' in text
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/Users/",le="+Inf"} 1' in text
+    assert 'db_statements_total{method="GET",route="/Users/"}' in text
+    assert "db_pool_checkout_wait_seconds_count" in text
+
+
+def test_sampled_profiles_keep_the_slowest(instrumented_client, monkeypatch, tmp_path):
+    monkeypatch.setitem(instrumented_client.application.config, "PROFILE_SAMPLE_RATE", 1)
+    monkeypatch.setitem(instrumented_client.application.config, "PROFILE_DIR", str(tmp_path))
+    monkeypatch.setitem(instrumented_client.application.config, "PROFILE_KEEP", 2)
+    monkeypatch.setattr(slowest_profiles, "kept", [])
+    for _ in range(4):
+        instrumented_client.get('/Users/')
+
+    profiles = sorted(tmp_path.glob("*.prof"))
+    assert len(profiles) == 2
+    assert sorted(path for _, path in slowest_profiles.kept) == [str(path) for path in profiles]
+
+
+def test_get_config_from_environment(monkeypatch):
+    monkeypatch.setenv("APP_CONFIG", "production")
+    assert get_config() is ProdConfig
+    monkeypatch.delenv("APP_CONFIG")
+    assert get_config() is DevConfig
+    monkeypatch.setenv("APP_CONFIG", "staging")
+    with pytest.raises(ValueError, match="Unknown APP_CONFIG 'staging'"):
+        get_config()
+
+
+def test_production_engine_options_work_with_sqlite(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'prod.db'}", poolclass=MeteredQueuePool,
+                           **ProdConfig.SQLALCHEMY_ENGINE_OPTIONS)
+    limit_statement_time(engine, ProdConfig.DB_STATEMENT_TIMEOUT_MS)
+    with engine.connect() as connection:
+        assert connection.execute(text("SELECT 1")).scalar() == 1
+
+
+def test_statement_timeout_is_set_on_postgres_connections(monkeypatch):
+    listeners = []
+    monkeypatch.setattr(event, "listen", lambda *args: listeners.append(args))
+    engine = SimpleNamespace(dialect=SimpleNamespace(name="postgresql"))
+    limit_statement_time(engine, 5000)
+    [(target, identifier, listener)] = listeners
+    assert (target, identifier) == (engine, "connect")
+
+    executed = []
+    cursor = SimpleNamespace(execute=executed.append, close=lambda: None)
+    dbapi_connection = SimpleNamespace(cursor=lambda: cursor, commit=lambda: executed.append("COMMIT"))
+    listener(dbapi_connection, None)
+    assert executed == ["SET statement_timeout = 5000", "COMMIT"]
+
+
+def test_pool_records_checkout_waits():
+    pool_metrics.reset()
+    pool = MeteredQueuePool(lambda: sqlite3.connect(":memory:"),
+                            pool_size=1, max_overflow=0, timeout=0.05)
+    connection = pool.connect()
+    with pytest.raises(PoolTimeoutError):
+        pool.connect()
+    connection.close()
+    pool.connect().close()
+    metrics = pool_metrics.snapshot()
+    assert metrics["checkouts"] == 3
+    assert metrics["timeouts"] == 1
+    assert metrics["max_wait"] >= 0.05
+
+
+BASELINE_SCHEMA = [
+    "CREATE TABLE city (id INTEGER PRIMARY KEY)",
+    "CREATE TABLE user (id INTEGER PRIMARY KEY, username VARCHAR(20) UNIQUE, key VARCHAR(80))",
+    "CREATE TABLE video (id INTEGER PRIMARY KEY, user_id INTEGER REFERENCES user (id), "
+    "url VARCHAR(2000) NOT NULL UNIQUE, date DATE, description TEXT, city_id INTEGER REFERENCES city (id))",
+    "CREATE TABLE comment (id INTEGER PRIMARY KEY, video_id INTEGER REFERENCES video (id), "
+    "user_id INTEGER REFERENCES user (id), body TEXT NOT NULL)",
+]
+
+
+def test_upgrade_migrates_baseline_schema(app):
+    with app.app_context():
+        db.drop_all()
+        with db.engine.begin() as connection:
+            for statement in BASELINE_SCHEMA:
+                connection.exec_driver_sql(statement)
+            connection.exec_driver_sql(
+                "INSERT INTO user (username, key) VALUES ('old_user', 'old_key')")
+            connection.exec_driver_sql(
+                "INSERT INTO video (user_id, url) VALUES (1, 'https://youtube.com/watch?v=old')")
+            connection.exec_driver_sql(
+                "INSERT INTO comment (video_id, user_id, body) VALUES (1, 1, 'kept')")
+
+    assert upgrade() == list(range(1, LATEST_VERSION + 1))
+    assert upgrade() == []
+    with app.app_context():
+        inspector = inspect(db.engine)
+        assert "status" in {column["name"]
+                            for column in inspector.get_columns("video")}
+        assert "ix_user_key" in {index["name"]
+                                 for index in inspector.get_indexes("user")}
+        assert db.session.get(Video, 1).status == Video.VERIFIED
+        assert {foreign_key["options"].get("ondelete") for foreign_key in inspector.get_foreign_keys("comment")} == \
+            {"CASCADE"}
+        assert not {column["name"]: column for column in inspector.get_columns("video")}["url_hash"]["nullable"]
+        assert db.session.get(Video, 1).url_hash == url_hash("https://youtube.com/watch?v=old")
+        assert db.session.execute(db.select(Comment.body)).scalars().all() == ["kept"]
+
+
+def test_upgrade_refuses_to_delete_orphaned_rows(app):
+    with app.app_context():
+        db.drop_all()
+        with db.engine.begin() as connection:
+            for statement in BASELINE_SCHEMA:
+                connection.exec_driver_sql(statement)
+            connection.exec_driver_sql(
+                "INSERT INTO video (user_id, url) VALUES (NULL, 'https://youtube.com/watch?v=old')")
+            connection.exec_driver_sql(
+                "INSERT INTO comment (video_id, user_id, body) VALUES (1, NULL, 'orphaned')")
+
+    with pytest.raises(SchemaOutOfDate, match="1 videos and 1 comments"):
+        upgrade()
+    with app.app_context():
+        assert db.session.execute(db.select(db.func.count()).select_from(Comment.__table__)).scalar() == 1
+        db.session.remove()
+    db_cleanup()
+
+
+def test_check_schema_rejects_old_version(app, monkeypatch):
+    monkeypatch.setitem(app.config, "AUTO_MIGRATE", False)
+    check_schema()
+    with app.app_context():
+        with db.engine.begin() as connection:
+            connection.execute(schema_version.delete().where(
+                schema_version.c.version == LATEST_VERSION))
+    with pytest.raises(SchemaOutOfDate):
+        check_schema()
+
+
+def test_db_cleanup_requires_testing(app, monkeypatch):
+    monkeypatch.setitem(app.config, "TESTING", False)
+    with pytest.raises(RuntimeError):
+        db_cleanup()
+
+
 def test_get_empty_users(client):
     response = client.get("/Users/")
     res = convert_response_data(response)
@@ -213,6 +521,32 @@ def test_user_delete(client_with_user):
     assert len(data) == 0
 
 
+def test_user_delete_cascades_to_videos_and_comments(client_with_comment):
+    assert len(convert_response_data(client_with_comment.get('/Comments/'))) == 1
+    del_response = client_with_comment.delete('/Users/1', json={"api_key": current_api_key})
+    assert del_response.status_code == 200
+    assert convert_response_data(client_with_comment.get('/Videos/')) == []
+    assert convert_response_data(client_with_comment.get('/Comments/')) == []
+    assert search_results(client_with_comment, q="comment") == []
+
+
+def test_user_delete_cost_does_not_grow_with_videos(app, client_with_two_users):
+    with app.app_context(), batch():
+        for user_id, count in ((1, 2), (2, 20)):
+            for index in range(count):
+                Video(url=f"https://youtube.com/watch?v={user_id}-{index}", user_id=user_id,
+                      date=datetime.date(2000, 1, 1)).save()
+
+    assert len(convert_response_data(client_with_two_users.get('/Videos/', query_string={"date": TEST_DATE}))) == 22
+    few = count_statements(app, client_with_two_users, '/Users/1', method="delete",
+                           json={"api_key": current_api_key})
+    assert len(convert_response_data(client_with_two_users.get('/Videos/', query_string={"date": TEST_DATE}))) == 20
+    many = count_statements(app, client_with_two_users, '/Users/2', method="delete",
+                            json={"api_key": second_current_api_key})
+    assert many == few
+    assert convert_response_data(client_with_two_users.get('/Videos/', query_string={"date": TEST_DATE})) == []
+
+
 def test_wrong_user_delete(client_with_user):
     user_data = {"api_key": current_api_key}
     del_response = client_with_user.delete('/Users/2', json=user_data)
@@ -222,6 +556,71 @@ def test_wrong_user_delete(client_with_user):
     assert len(data) == 1
 
 
+def test_deleted_user_key_rejected(client_with_user):
+    user_data = {"username": NEW_TEST_USERNAME, "api_key": current_api_key}
+    put_response = client_with_user.put('/Users/1', json=user_data)
+    assert put_response.status_code == 200
+    del_response = client_with_user.delete(
+        '/Users/1', json={"api_key": current_api_key})
+    assert del_response.status_code == 200
+    response = client_with_user.put('/Users/1', json=user_data)
+    assert response.status_code == 403
+
+
+def test_key_cache_evicts_least_recently_used():
+    cache = KeyCache(max_size=2, ttl=300)
+    cache.set("first", 1)
+    cache.set("second", 2)
+    cache.get("first")
+    cache.set("third", 3)
+    assert cache.get("first") == 1
+    assert cache.get("second") is None
+    assert cache.get("third") == 3
+
+
+def test_key_cache_expires_entries():
+    cache = KeyCache(max_size=2, ttl=-1)
+    cache.set("first", 1)
+    assert cache.get("first") is None
+
+
+def test_users_paginated_by_cursor(client_with_two_users):
+    client_with_two_users.post("/Users/", json={"username": "third_user"})
+    first_page = client_with_two_users.get(
+        "/Users/", query_string={"limit": 2})
+    first_data = convert_response_data(first_page)
+    assert [user["id"] for user in first_data] == [1, 2]
+    assert first_page.headers["X-Next-Cursor"] == "2"
+    second_page = client_with_two_users.get(
+        "/Users/", query_string={"limit": 2, "after": 2})
+    second_data = convert_response_data(second_page)
+    assert [user["id"] for user in second_data] == [3]
+    assert "X-Next-Cursor" not in second_page.headers
+
+
+def test_user_list_omits_videos_by_default(app, client):
+    seed_videos_with_comments(app, 2)
+    response = client.get("/Users/")
+    data = convert_response_data(response)
+    assert response.status_code == 200
+    assert all("videos" not in user for user in data)
+
+
+def test_user_list_expand_videos_statement_count_is_constant(app, client):
+    seed_videos_with_comments(app, 1)
+    single_count = count_statements(
+        app, client, "/Users/", query_string={"expand": "videos"})
+    db_cleanup()
+    seed_videos_with_comments(app, 10)
+    many_count = count_statements(
+        app, client, "/Users/", query_string={"expand": "videos"})
+    assert many_count == single_count
+    response = client.get("/Users/", query_string={"expand": "videos"})
+    data = convert_response_data(response)
+    assert data[0]["videos"][0]["url"] == "https://youtube.com/watch?v=0"
+    assert data[0]["videos"][0]["user"] == "user_0"
+
+
 def test_get_empty_videos(client):
     response = client.get('/Videos/')
     data = convert_response_data(response)
@@ -293,7 +692,8 @@ def test_put_new_url(client_with_video):
 def test_get_no_video_with_date(client_with_video):
     data = {"date": TEST_DATE}
     response = client_with_video.get('/Videos/', query_string=data)
-    assert response.status_code == 404
+    assert response.status_code == 200
+    assert convert_response_data(response) == []
 
 
 def test_get_video_with_date(client_with_user):
@@ -331,6 +731,131 @@ def test_patch_video(client_with_video):
     assert data["description"] == TEST_DESCRIPTION
 
 
+def test_video_get_not_modified(client_with_video):
+    response = client_with_video.get('/Videos/1')
+    etag = response.headers["ETag"]
+    assert response.headers["Last-Modified"]
+
+    response = client_with_video.get(
+        '/Videos/1', headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.data == b""
+
+    client_with_video.patch(
+        '/Videos/1', json={"description": TEST_DESCRIPTION, "api_key": current_api_key})
+    response = client_with_video.get(
+        '/Videos/1', headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_video_get_changes_etag_when_user_changes(client_with_video):
+    etag = client_with_video.get('/Videos/1').headers["ETag"]
+    client_with_video.patch(
+        '/Users/1', json={"username": NEW_TEST_USERNAME, "api_key": current_api_key})
+    response = client_with_video.get(
+        '/Videos/1', headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert convert_response_data(response)["user"] == NEW_TEST_USERNAME
+
+
+def test_video_list_not_modified(client_with_video):
+    response = client_with_video.get('/Videos/')
+    etag = response.headers["ETag"]
+    assert client_with_video.get(
+        '/Videos/', headers={"If-None-Match": etag}).status_code == 304
+    assert client_with_video.get(
+        '/Videos/', query_string={"limit": 1}, headers={"If-None-Match": etag}).status_code == 200
+
+    client_with_video.post('/Videos/', json={"url": NEW_TEST_URL, "user_id": 1,
+                                             "api_key": current_api_key})
+    response = client_with_video.get(
+        '/Videos/', headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert len(convert_response_data(response)) == 2
+
+
+def test_concurrent_updates_both_bump_the_entry_version(app, client_with_video):
+    with app.app_context():
+        video = db.session.get(Video, 1)
+        # another writer updates the row after this session loaded it
+        with db.engine.begin() as connection:
+            connection.execute(Video.__table__.update().where(Video.id == 1).values(
+                description="first", version=Video.version + 1))
+        video.description = "second"
+        db.session.commit()
+        assert db.session.execute(db.select(Video.description, Video.version).where(Video.id == 1)).one() == \
+            ("second", 3)
+
+
+def test_collection_versions_bumped_once_per_commit(app, client_with_user):
+    bumps = []
+
+    def record_bump(conn, cursor, statement, *args):
+        if statement.startswith("UPDATE table_version"):
+            bumps.append(statement)
+
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", record_bump)
+        try:
+            with batch():
+                for index in range(3):
+                    Video(url=f"https://youtube.com/watch?v={index}", user_id=1).save()
+        finally:
+            event.remove(db.engine, "before_cursor_execute", record_bump)
+
+    assert len(bumps) == 1
+
+
+def test_video_list_served_from_response_cache(app, client_with_user):
+    client_with_user.post(
+        '/Videos/', json={"url": TEST_URL, "user_id": 1, "date": TEST_DATE})
+    query = {"query_string": {"date": TEST_DATE}}
+    first = count_statements(app, client_with_user, '/Videos/', **query)
+    assert count_statements(app, client_with_user, '/Videos/', **query) < first
+
+    client_with_user.post(
+        '/Videos/', json={"url": NEW_TEST_URL, "user_id": 1, "date": TEST_DATE})
+    response = client_with_user.get('/Videos/', **query)
+    assert len(convert_response_data(response)) == 2
+
+
+def test_response_cache_invalidates_only_affected_lists(app, client_with_user):
+    other_date = "2001-01-01"
+    client_with_user.post(
+        '/Videos/', json={"url": TEST_URL, "user_id": 1, "date": other_date})
+    other_query = {"query_string": {"date": other_date}}
+    client_with_user.get('/Videos/', **other_query)
+    cached = count_statements(app, client_with_user, '/Videos/', **other_query)
+
+    client_with_user.post(
+        '/Videos/', json={"url": NEW_TEST_URL, "user_id": 1, "date": TEST_DATE})
+    assert count_statements(
+        app, client_with_user, '/Videos/', **other_query) == cached
+
+    client_with_user.patch(
+        '/Users/1', json={"username": NEW_TEST_USERNAME, "api_key": current_api_key})
+    response = client_with_user.get('/Videos/', **other_query)
+    assert convert_response_data(response)[0]["user"] == NEW_TEST_USERNAME
+
+
+def test_sqlite_response_cache_is_shared(tmp_path):
+    path = str(tmp_path / "responsecache.db")
+    writer = ResponseCache(SQLiteBackend(path, max_size=2, ttl=60))
+    reader = ResponseCache(SQLiteBackend(path, max_size=2, ttl=60))
+
+    writer.set("a", writer.generations({"videos"}), [[1], 200, {}])
+    assert reader.get("a", {"videos"}) == [[1], 200, {}]
+
+    writer.invalidate({"videos"})
+    assert reader.get("a", {"videos"}) is None
+
+    for key in ("b", "c", "d"):
+        writer.set(key, writer.generations({"comments"}), key)
+    assert reader.get("b", {"comments"}) is None
+    assert reader.get("d", {"comments"}) == "d"
+
+
 def test_patch_invalid_youtube_url(client_with_video):
     video_data = {"url": INVALID_YT_URL, "user_id": 1,
                   "date": TEST_DATE, "description": TEST_DESCRIPTION, "api_key": current_api_key}
@@ -339,6 +864,428 @@ def test_patch_invalid_youtube_url(client_with_video):
     assert response.status_code == 400
 
 
+def test_verify_url_against_stub(app):
+    assert verify_youtube_url("https://youtube.com/watch?v=abc")
+    assert not verify_youtube_url("https://youtube.com/missing")
+
+
+def test_verify_url_result_is_cached(app):
+    assert verify_youtube_url("https://youtube.com/watch?v=abc")
+    assert verify_youtube_url("https://youtube.com/watch?v=abc")
+    assert StubYoutubeHandler.hits == ["/watch?v=abc"]
+
+
+def test_verify_url_times_out(app, monkeypatch):
+    monkeypatch.setitem(app.config, "YOUTUBE_VERIFY_READ_TIMEOUT", 0.1)
+    assert not verify_youtube_url("https://youtube.com/slow")
+
+
+def test_patch_video_without_url_skips_verification(client_with_video):
+    StubYoutubeHandler.hits.clear()
+    video_data = {"description": TEST_DESCRIPTION, "api_key": current_api_key}
+    response = client_with_video.patch('/Videos/1', json=video_data)
+    assert response.status_code == 200
+    assert convert_response_data(response)["url"] == TEST_URL
+    assert StubYoutubeHandler.hits == []
+
+
+def test_async_video_verification(app, client_with_user, monkeypatch):
+    monkeypatch.setitem(app.config, "YOUTUBE_VERIFY_MODE", "async")
+    video_data = {"url": INVALID_YT_URL, "user_id": 1}
+    response = client_with_user.post('/Videos/', json=video_data)
+    assert response.status_code == 202
+    assert convert_response_data(response)["status"] == "pending"
+    for _ in range(50):
+        data = convert_response_data(client_with_user.get('/Videos/1'))
+        if data["status"] != "pending":
+            break
+        time.sleep(0.05)
+    assert data["status"] == "invalid"
+
+
+def asgi_request(asgi_app, method, path, query_string=b"", json_body=None):
+    body = json.dumps(json_body).encode() if json_body is not None else b""
+    headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())] \
+        if json_body is not None else []
+    scope = {"type": "http", "method": method, "path": path, "query_string": query_string, "headers": headers,
+             "http_version": "1.1", "scheme": "http", "server": ("localhost", 80), "client": ("127.0.0.1", 1)}
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    async def call():
+        await asgi_app(scope, receive, send)
+        return messages[0]["status"], dict(messages[0]["headers"]), \
+            b"".join(message.get("body", b"") for message in messages[1:])
+
+    return call()
+
+
+def serve_asgi(asgi_app, requests):
+    async def run():
+        received, sent = asyncio.Queue(), asyncio.Queue()
+        await received.put({"type": "lifespan.startup"})
+        lifespan = asyncio.create_task(asgi_app({"type": "lifespan"}, received.get, sent.put))
+        assert (await sent.get())["type"] == "lifespan.startup.complete"
+        try:
+            return await requests()
+        finally:
+            await received.put({"type": "lifespan.shutdown"})
+            await lifespan
+
+    return asyncio.run(run())
+
+
+@pytest.fixture()
+def asgi_app(app):
+    pytest.importorskip("aiosqlite")
+    pytest.importorskip("httpx")
+    from api.asgi import AsyncApp
+
+    return AsyncApp(app)
+
+
+def test_asgi_serves_the_same_responses(asgi_app, client_with_video):
+    wsgi_response = client_with_video.get('/Videos/')
+
+    async def requests():
+        return await asgi_request(asgi_app, "GET", "/Videos/")
+
+    status, headers, body = serve_asgi(asgi_app, requests)
+    assert status == 200
+    assert json.loads(body) == convert_response_data(wsgi_response)
+    assert headers[b"etag"].decode() == wsgi_response.headers["ETag"]
+
+
+def test_asgi_uses_production_engine_options(app, asgi_app, client_with_video, monkeypatch):
+    monkeypatch.setitem(app.config, "SQLALCHEMY_ENGINE_OPTIONS", ProdConfig.SQLALCHEMY_ENGINE_OPTIONS)
+    monkeypatch.setitem(app.config, "DB_POOL_METRICS", True)
+    pool_metrics.reset()
+
+    async def requests():
+        return await asgi_request(asgi_app, "GET", "/Videos/")
+
+    status, _, body = serve_asgi(asgi_app, requests)
+    assert status == 200
+    assert len(json.loads(body)) == 1
+    assert pool_metrics.snapshot()["checkouts"] > 0
+
+
+def test_asgi_awaits_database_and_verification(asgi_app, client_with_user):
+    urls = ["https://youtube.com/slow", "https://www.youtube.com/slow", "http://youtube.com/slow",
+            "http://www.youtube.com/slow"]
+
+    async def requests():
+        return await asyncio.gather(*(asgi_request(asgi_app, "POST", "/Videos/", json_body={
+            "url": url, "user_id": 1, "description": "slow verification"}) for url in urls))
+
+    responses = serve_asgi(asgi_app, requests)
+    assert [status for status, _, _ in responses] == [200] * len(urls)
+    assert StubYoutubeHandler.max_in_flight == len(urls)
+    assert StubYoutubeHandler.hits.count("/slow") == len(urls)
+    assert len(convert_response_data(client_with_user.get('/Videos/'))) == len(urls)
+    assert len(search_results(client_with_user, q="slow")) == len(urls)
+
+
+def test_sqlite_stores_run_off_the_event_loop(tmp_path, monkeypatch):
+    store = SQLiteStore(str(tmp_path / "idempotency.db"), max_size=10, ttl=60, lock_ttl=60)
+    threads = []
+    evict = store.evict
+    monkeypatch.setattr(store, "evict", lambda: threads.append(threading.get_ident()) or evict())
+
+    async def reserve():
+        start_serving(asyncio.get_running_loop())
+        try:
+            return await greenlet_spawn(store.reserve, "key", "fingerprint")
+        finally:
+            await stop_serving()
+
+    assert asyncio.run(reserve()) is None
+    assert len(threads) == 1 and threads[0] != threading.get_ident()
+    assert store.reserve("key", "fingerprint") == ("fingerprint", None)
+
+
+def test_asgi_verifies_in_background_tasks(app, asgi_app, client_with_user, monkeypatch):
+    monkeypatch.setitem(app.config, "YOUTUBE_VERIFY_MODE", "async")
+
+    async def requests():
+        return await asgi_request(asgi_app, "POST", "/Videos/", json_body={"url": INVALID_YT_URL, "user_id": 1})
+
+    status, _, body = serve_asgi(asgi_app, requests)
+    assert status == 202
+    assert json.loads(body)["status"] == "pending"
+    assert convert_response_data(client_with_user.get('/Videos/1'))["status"] == "invalid"
+
+
+def test_bulk_add_videos(client_with_user):
+    videos = [
+        {"url": "https://youtube.com/watch?v=1", "user_id": 1},
+        {"url": "https://youtube.com/watch?v=2", "user_id": 1, "date": TEST_DATE},
+        {"url": "https://youtube.com/watch?v=1", "user_id": 1},
+        {"url": INVALID_YT_URL, "user_id": 1},
+        {"url": "https://youtube.com/watch?v=3", "user_id": 2},
+        {"url": "www.wrong_url.com", "user_id": 1},
+    ]
+    response = client_with_user.post('/Videos/bulk', json=videos)
+    assert response.status_code == 200
+    data = convert_response_data(response)
+    assert data["created"] == 2
+    assert [result["status"] for result in data["results"]] == [
+        201, 201, 409, 400, 404, 400]
+    assert data["results"][1]["id"] == 2
+    list_data = convert_response_data(client_with_user.get('/Videos/'))
+    assert [video["url"] for video in list_data] == [
+        "https://youtube.com/watch?v=1", "https://youtube.com/watch?v=2"]
+
+
+def test_canonical_url():
+    for url in ("https://youtube.com/watch?v=abc_-1", "http://www.youtube.com/watch?v=abc_-1&t=42",
+                "https://m.youtube.com/watch/?feature=share&v=abc_-1", "https://youtu.be/abc_-1"):
+        assert canonical_url(url) == "https://www.youtube.com/watch?v=abc_-1"
+    for url in (TEST_URL, NEW_TEST_URL, INVALID_YT_URL, "https://youtube.com/watch?v=", "https://youtu.be/"):
+        assert canonical_url(url) == url
+
+
+def test_equivalent_video_urls_are_one_video(client_with_user):
+    response = client_with_user.post('/Videos/', json={"url": "https://youtube.com/watch?v=abc", "user_id": 1})
+    assert response.status_code == 200
+    hits = len(StubYoutubeHandler.hits)
+
+    response = client_with_user.post('/Videos/', json={"url": "https://youtu.be/abc", "user_id": 1})
+    assert response.status_code == 409
+    assert len(StubYoutubeHandler.hits) == hits
+
+    data = convert_response_data(client_with_user.get(
+        '/Videos/', query_string={"url": "http://www.youtube.com/watch?v=abc&t=10"}))
+    assert [video["url"] for video in data] == ["https://youtube.com/watch?v=abc"]
+
+    client_with_user.post('/Videos/', json={"url": "https://youtube.com/watch?v=other", "user_id": 1})
+    response = client_with_user.patch('/Videos/2', json={"api_key": current_api_key, "url": "https://youtu.be/abc"})
+    assert response.status_code == 409
+    response = client_with_user.patch('/Videos/2', json={"api_key": current_api_key,
+                                                         "url": "https://youtu.be/other"})
+    assert response.status_code == 200
+    assert len(StubYoutubeHandler.hits) == hits + 1
+
+    videos = [{"url": "https://www.youtube.com/watch?v=new", "user_id": 1},
+              {"url": "https://youtu.be/new", "user_id": 1},
+              {"url": "https://youtu.be/abc", "user_id": 1}]
+    data = convert_response_data(client_with_user.post('/Videos/bulk', json=videos))
+    assert [result["status"] for result in data["results"]] == [201, 409, 409]
+
+
+def test_video_url_race_is_a_conflict(client_with_user, monkeypatch):
+    from api.routes import video_routes
+
+    client_with_user.post('/Videos/', json={"url": "https://youtube.com/watch?v=abc", "user_id": 1})
+    client_with_user.post('/Videos/', json={"url": "https://youtube.com/watch?v=other", "user_id": 1})
+    # another request stores the same YouTube video between the check and the write
+    monkeypatch.setattr(video_routes, "check_url_is_free", lambda url, video=None: None)
+
+    response = client_with_user.post('/Videos/', json={"url": "https://youtu.be/abc", "user_id": 1})
+    assert response.status_code == 409
+    response = client_with_user.patch('/Videos/2', json={"api_key": current_api_key, "url": "https://youtu.be/abc"})
+    assert response.status_code == 409
+    assert [video["url"] for video in convert_response_data(client_with_user.get('/Videos/'))] == [
+        "https://youtube.com/watch?v=abc", "https://youtube.com/watch?v=other"]
+
+
+def test_video_url_hash_is_required(app, client_with_user):
+    with app.app_context():
+        with pytest.raises(IntegrityError):
+            db.session.execute(db.insert(Video), [{"url": TEST_URL, "user_id": 1}])
+        db.session.rollback()
+
+
+def test_url_lookup_uses_url_hash_index(app, client_with_video):
+    with app.app_context():
+        plan = db.session.execute(db.text("EXPLAIN QUERY PLAN SELECT * FROM video WHERE url_hash = :url_hash"),
+                                  {"url_hash": url_hash(TEST_URL)}).all()
+    assert "ix_video_url_hash" in " ".join(row[-1] for row in plan)
+
+
+def test_bulk_add_videos_ndjson_single_insert(app, client_with_user):
+    body = "\n".join(json.dumps({"url": f"https://youtube.com/watch?v={index}", "user_id": 1})
+                     for index in range(20))
+    inserts = []
+
+    def record_insert(conn, cursor, statement, *args):
+        if statement.startswith("INSERT"):
+            inserts.append(statement)
+
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", record_insert)
+        try:
+            response = client_with_user.post(
+                '/Videos/bulk', data=body, content_type="application/x-ndjson")
+        finally:
+            event.remove(db.engine, "before_cursor_execute", record_insert)
+
+    assert response.status_code == 200
+    assert convert_response_data(response)["created"] == 20
+    assert len(inserts) == 1
+
+
+def test_bulk_add_videos_indexes_descriptions_in_one_insert(app, client_with_user):
+    body = "\n".join(json.dumps({"url": f"https://youtube.com/watch?v={index}", "user_id": 1,
+                                 "description": f"bulk upload number {index}"}) for index in range(20))
+    writes = []
+
+    def record_write(conn, cursor, statement, *args):
+        if statement.startswith(("INSERT", "DELETE")):
+            writes.append(statement)
+
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", record_write)
+        try:
+            response = client_with_user.post(
+                '/Videos/bulk', data=body, content_type="application/x-ndjson")
+        finally:
+            event.remove(db.engine, "before_cursor_execute", record_write)
+
+    assert response.status_code == 200
+    assert convert_response_data(response)["created"] == 20
+    assert len(writes) == 2
+    assert writes[1].startswith("INSERT INTO search_index")
+    assert len(search_results(client_with_user, q="bulk upload")) == 20
+
+
+TEST_CITY = {"name": "Seattle", "lat": 47.6062, "lon": -122.3321}
+
+
+def test_city_post_requires_api_key(client_with_user):
+    assert client_with_user.post('/Cities/', json=TEST_CITY).status_code == 400
+    assert client_with_user.post('/Cities/', json={**TEST_CITY, "api_key": "made-up-key"}).status_code == 403
+    response = client_with_user.post('/Cities/', json={**TEST_CITY, "api_key": current_api_key})
+    assert response.status_code == 200
+    assert [city["name"] for city in convert_response_data(client_with_user.get('/Cities/'))] == [TEST_CITY["name"]]
+
+
+@pytest.fixture()
+def client_with_located_videos(client_with_user):
+    client_with_user.post('/Cities/', json={**TEST_CITY, "api_key": current_api_key})
+    client_with_user.post('/Videos/', json={"url": TEST_URL, "user_id": 1, "city": TEST_CITY["name"],
+                                            "lat": 47.6100, "lon": -122.3300})
+    client_with_user.post('/Videos/', json={"url": NEW_TEST_URL, "user_id": 1,
+                                            "lat": 47.6300, "lon": -122.3321})
+
+    return client_with_user
+
+
+def test_filter_videos_by_city(client_with_located_videos):
+    response = client_with_located_videos.get(
+        '/Videos/', query_string={"city": TEST_CITY["name"]})
+    data = convert_response_data(response)
+    assert response.status_code == 200
+    assert [video["url"] for video in data] == [TEST_URL]
+    assert data[0]["city"] == TEST_CITY["name"]
+
+    response = client_with_located_videos.get(
+        '/Videos/', query_string={"city": "Atlantis"})
+    assert response.status_code == 404
+
+
+def test_filter_videos_near_point(client_with_located_videos):
+    near = {"near": f"{TEST_CITY['lat']},{TEST_CITY['lon']}"}
+    response = client_with_located_videos.get(
+        '/Videos/', query_string={**near, "radius_km": 2})
+    assert [video["url"]
+            for video in convert_response_data(response)] == [TEST_URL]
+
+    response = client_with_located_videos.get(
+        '/Videos/', query_string={**near, "radius_km": 3})
+    assert len(convert_response_data(response)) == 2
+
+    response = client_with_located_videos.get('/Videos/', query_string=near)
+    assert response.status_code == 400
+
+
+def test_filter_videos_by_bbox(client_with_located_videos):
+    response = client_with_located_videos.get(
+        '/Videos/', query_string={"bbox": "-122.34,47.62,-122.32,47.64"})
+    assert [video["url"]
+            for video in convert_response_data(response)] == [NEW_TEST_URL]
+
+    response = client_with_located_videos.get(
+        '/Videos/', query_string={"bbox": "-122.32,47.62,-122.34,47.64"})
+    assert response.status_code == 400
+
+
+def test_video_coordinates_must_be_paired(client_with_user):
+    response = client_with_user.post(
+        '/Videos/', json={"url": TEST_URL, "user_id": 1, "lat": 47.61})
+    assert response.status_code == 400
+
+
+def test_near_query_uses_grid_cell_index(app):
+    query = db.select(Video.id).where(
+        *within_radius(Video, TEST_CITY["lat"], TEST_CITY["lon"], 2))
+
+    assert "ix_video_geo_cell" in query_plan(app, query)
+
+
+@pytest.fixture()
+def client_with_dated_videos(client_with_two_users):
+    for index, (user_id, date) in enumerate([(1, "2000-01-03"), (2, "2000-01-01"), (1, None),
+                                             (1, "2000-01-02"), (2, "2000-01-02")]):
+        client_with_two_users.post('/Videos/', json={"url": f"https://youtube.com/watch?v={index}",
+                                                     "user_id": user_id, "date": date})
+
+    return client_with_two_users
+
+
+def list_video_ids(client, **query):
+    ids = []
+    while True:
+        response = client.get('/Videos/', query_string={**query, "limit": 2})
+        assert response.status_code == 200
+        ids += [video["id"] for video in convert_response_data(response)]
+        if "X-Next-Cursor" not in response.headers:
+            return ids
+
+        query["after"] = response.headers["X-Next-Cursor"]
+
+
+def test_sort_videos_by_date(client_with_dated_videos):
+    assert list_video_ids(client_with_dated_videos, sort="date") == [
+        3, 2, 4, 5, 1]
+    assert list_video_ids(client_with_dated_videos, sort="-date") == [
+        1, 5, 4, 2, 3]
+    assert list_video_ids(client_with_dated_videos, sort="-id") == [
+        5, 4, 3, 2, 1]
+
+
+def test_filter_videos_by_date_range_and_user(client_with_dated_videos):
+    assert list_video_ids(client_with_dated_videos, date_from="2000-01-02") == [
+        1, 4, 5]
+    assert list_video_ids(client_with_dated_videos, date_from="2000-01-01", date_to="2000-01-02",
+                          user_id=2, sort="-date") == [5, 2]
+
+    response = client_with_dated_videos.get(
+        '/Videos/', query_string={"user_id": 3})
+    assert response.status_code == 404
+
+
+def test_video_cursor_must_match_sort(client_with_dated_videos):
+    response = client_with_dated_videos.get(
+        '/Videos/', query_string={"sort": "date", "after": "yesterday:1"})
+    assert response.status_code == 400
+
+
+def test_video_searches_use_composite_indexes(app):
+    args = {"sort": "-date", "after": f"{TEST_DATE}:10"}
+    by_date = keyset(db.select(Video).where(
+        Video.date >= datetime.date(1999, 1, 1)), Video, args)[0]
+    by_user = keyset(db.select(Video).where(Video.user_id == 1), Video, args)[0]
+
+    assert "ix_video_date_id" in query_plan(app, by_date)
+    assert "ix_video_user_id_date" in query_plan(app, by_user)
+
+
 def test_delete_video(client_with_video):
     video_data = {"api_key": current_api_key}
     response = client_with_video.delete('/Videos/1', json=video_data)
@@ -348,6 +1295,15 @@ def test_delete_video(client_with_video):
     assert len(video_list_data) == 0
 
 
+def test_delete_video_deletes_its_comments(client_with_comment):
+    assert len(convert_response_data(client_with_comment.get('/Comments/', query_string={"user_id": 1}))) == 1
+    response = client_with_comment.delete('/Videos/1', json={"api_key": current_api_key})
+    assert response.status_code == 200
+    assert convert_response_data(client_with_comment.get('/Comments/', query_string={"user_id": 1})) == []
+    assert client_with_comment.get('/Comments/1').status_code == 404
+    assert search_results(client_with_comment, q="comment") == []
+
+
 def test_get_empty_comment(client):
     response = client.get('/Comments/')
     assert response.status_code == 200
@@ -382,6 +1338,216 @@ def test_comment_get_by_user_id(client_with_comment):
     assert data[0]["body"] == TEST_COMMENT
 
 
+def test_comment_list_statement_count_is_constant(app, client):
+    seed_videos_with_comments(app, 1)
+    single_count = count_statements(app, client, '/Comments/')
+    db_cleanup()
+    seed_videos_with_comments(app, 10)
+    many_count = count_statements(app, client, '/Comments/')
+    assert many_count == single_count
+
+
+def test_video_list_statement_count_is_constant(app, client):
+    seed_videos_with_comments(app, 1)
+    single_count = count_statements(app, client, '/Videos/')
+    db_cleanup()
+    seed_videos_with_comments(app, 10)
+    many_count = count_statements(app, client, '/Videos/')
+    assert many_count == single_count
+
+
+def test_batch_get_keeps_request_order_and_reports_missing(app, client):
+    seed_videos_with_comments(app, 3)
+    response = client.get('/Videos/batch', query_string={"ids": "3,7,1,3"})
+    assert response.status_code == 200
+    data = convert_response_data(response)
+    assert [video["id"] for video in data["results"]] == [3, 1]
+    assert data["results"][0]["user"] == "user_2"
+    assert data["missing"] == [7]
+
+    data = convert_response_data(client.get('/Users/batch', query_string={"ids": "2,5", "expand": "videos"}))
+    assert [(user["username"], len(user["videos"])) for user in data["results"]] == [("user_1", 1)]
+    assert data["missing"] == [5]
+
+    data = convert_response_data(client.get('/Comments/batch', query_string={"ids": "4,2"}))
+    assert [comment["id"] for comment in data["results"]] == [2]
+    assert data["missing"] == [4]
+
+
+def test_batch_get_statement_count_is_constant(app, client):
+    seed_videos_with_comments(app, 10)
+    single_count = count_statements(app, client, '/Videos/batch', query_string={"ids": "1"})
+    many_count = count_statements(app, client, '/Videos/batch', query_string={"ids": "10,9,8,7,6,5,4,3,2,1"})
+    assert many_count == single_count
+
+
+def test_batch_get_rejects_bad_ids(app, client, monkeypatch):
+    monkeypatch.setitem(app.config, "BATCH_MAX_IDS", 2)
+    assert client.get('/Videos/batch', query_string={"ids": "1,2,3"}).status_code == 400
+    assert client.get('/Videos/batch', query_string={"ids": "1,two"}).status_code == 400
+    assert client.get('/Videos/batch').status_code == 400
+
+
+def count_commits(app, request):
+    commits = []
+
+    def record_commit(connection):
+        commits.append(connection)
+
+    with app.app_context():
+        event.listen(db.engine, "commit", record_commit)
+        try:
+            response = request()
+        finally:
+            event.remove(db.engine, "commit", record_commit)
+
+    return response, len(commits)
+
+
+def test_write_requests_commit_once(app, client_with_video):
+    response, commits = count_commits(app, lambda: client_with_video.post(
+        '/Comments/', json={"user_id": 1, "video_id": 1, "body": TEST_COMMENT}))
+    assert response.status_code == 200
+    assert commits == 1
+
+    response, commits = count_commits(app, lambda: client_with_video.delete(
+        '/Users/1', json={"api_key": current_api_key}))
+    assert response.status_code == 200
+    assert commits == 1
+
+
+def test_failed_request_rolls_back(client_with_two_users):
+    client_with_two_users.post('/Videos/', json={"url": TEST_URL, "user_id": 1})
+    client_with_two_users.post('/Comments/', json={"user_id": 1, "video_id": 1, "body": TEST_COMMENT})
+    response = client_with_two_users.put('/Comments/1', json={"api_key": current_api_key, "user_id": 2,
+                                                             "video_id": 99, "body": "moved"})
+    assert response.status_code == 404
+    comment = convert_response_data(client_with_two_users.get('/Comments/1'))
+    assert (comment["user"], comment["body"]) == (TEST_USERNAME, TEST_COMMENT)
+
+
+def test_batch_commits_once_and_defers_side_effects(app, client):
+    called = []
+    with app.app_context():
+        with batch():
+            for index in range(3):
+                User(username=f"batch_{index}", key=f"batch_key_{index}").save()
+            after_commit(called.append, "committed")
+            assert called == []
+        assert called == ["committed"]
+
+        with pytest.raises(ValueError):
+            with batch():
+                User(username="rolled_back", key="rolled_back_key").save()
+                after_commit(called.append, "rolled back")
+                raise ValueError()
+
+    assert called == ["committed"]
+    usernames = [user["username"] for user in convert_response_data(client.get('/Users/'))]
+    assert usernames == ["batch_0", "batch_1", "batch_2"]
+
+
+def test_idempotent_post_is_replayed(app, client_with_user):
+    video = {"url": TEST_URL, "user_id": 1}
+    headers = {"Idempotency-Key": "upload-1"}
+    response = client_with_user.post('/Videos/', json=video, headers=headers)
+    assert response.status_code == 200
+    hits = len(StubYoutubeHandler.hits)
+
+    assert count_statements(app, client_with_user, '/Videos/', "post", json=video, headers=headers) == 0
+    replay = client_with_user.post('/Videos/', json=video, headers=headers)
+    assert convert_response_data(replay) == convert_response_data(response)
+    assert replay.headers["Idempotent-Replayed"] == "true"
+    assert len(StubYoutubeHandler.hits) == hits
+    assert len(convert_response_data(client_with_user.get('/Videos/'))) == 1
+
+    response = client_with_user.post('/Videos/', json={**video, "description": "changed"}, headers=headers)
+    assert response.status_code == 422
+
+
+def test_idempotent_comment_writes_run_once(client_with_video):
+    headers = {"Idempotency-Key": "comment-1"}
+    comment = {"user_id": 1, "video_id": 1, "body": TEST_COMMENT}
+    for _ in range(3):
+        assert client_with_video.post('/Comments/', json=comment, headers=headers).status_code == 200
+    assert len(convert_response_data(client_with_video.get('/Comments/'))) == 1
+    assert convert_response_data(client_with_video.get('/Videos/'))[0]["comment_count"] == 1
+
+    assert client_with_video.post('/Comments/', json=comment, headers={"Idempotency-Key": "comment-2"}) \
+        .status_code == 200
+    assert len(convert_response_data(client_with_video.get('/Comments/'))) == 2
+
+
+def test_idempotency_keys_are_scoped_per_client(client_with_two_users):
+    headers = {"Idempotency-Key": "1"}
+    first = client_with_two_users.post('/Videos/', json={"url": TEST_URL, "user_id": 1}, headers=headers,
+                                       environ_base={"REMOTE_ADDR": "10.0.0.1"})
+    second = client_with_two_users.post('/Videos/', json={"url": NEW_TEST_URL, "user_id": 2}, headers=headers,
+                                        environ_base={"REMOTE_ADDR": "10.0.0.2"})
+    assert (first.status_code, second.status_code) == (200, 200)
+    assert "Idempotent-Replayed" not in second.headers
+
+    comment = {"user_id": 1, "video_id": 1, "body": TEST_COMMENT}
+    responses = [client_with_two_users.post('/Comments/', json=comment, headers={**headers, "X-API-Key": api_key})
+                 for api_key in (current_api_key, second_current_api_key)]
+    assert [response.status_code for response in responses] == [200, 200]
+    assert len(convert_response_data(client_with_two_users.get('/Comments/'))) == 2
+
+
+def test_idempotency_key_is_released_when_request_fails(client_with_user):
+    headers = {"Idempotency-Key": "comment-on-missing-video"}
+    comment = {"user_id": 1, "video_id": 1, "body": TEST_COMMENT}
+    assert client_with_user.post('/Comments/', json=comment, headers=headers).status_code == 404
+    client_with_user.post('/Videos/', json={"url": TEST_URL, "user_id": 1})
+    response = client_with_user.post('/Comments/', json=comment, headers=headers)
+    assert response.status_code == 200
+    assert "Idempotent-Replayed" not in response.headers
+
+
+def test_idempotency_store_reserves_and_expires(tmp_path):
+    store = SQLiteStore(str(tmp_path / "idempotency.db"), max_size=2, ttl=300, lock_ttl=0)
+    assert store.reserve("key", "fingerprint") is None
+    # the reservation outlived its lock_ttl, as if the request serving it had died
+    assert store.reserve("key", "fingerprint") is None
+    store.complete("key", "fingerprint", [{"id": 1}, 200, {}])
+    assert store.reserve("key", "fingerprint") == ("fingerprint", [{"id": 1}, 200, {}])
+    for key in ("other", "another"):
+        store.complete(key, "fingerprint", [{}, 200, {}])
+    assert store.reserve("key", "fingerprint") is None
+
+
+def test_stream_videos_as_ndjson(app, client):
+    seed_videos_with_comments(app, 3)
+    response = client.get('/Videos/', query_string={"stream": 1, "after": 1})
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    lines = [json.loads(line)
+             for line in response.data.decode('utf-8').splitlines()]
+    assert [video["id"] for video in lines] == [2, 3]
+    assert lines[0]["user"] == "user_1"
+
+
+def test_stream_comments_with_accept_header(app, client):
+    seed_videos_with_comments(app, 3)
+    response = client.get(
+        '/Comments/', headers={"Accept": "application/x-ndjson"})
+    assert response.mimetype == "application/x-ndjson"
+    lines = response.data.decode('utf-8').splitlines()
+    assert len(lines) == 3
+    assert json.loads(lines[2])["video"] == "https://youtube.com/watch?v=2"
+
+
+def test_stream_users_with_expanded_videos(app, client):
+    seed_videos_with_comments(app, 2)
+    response = client.get(
+        '/Users/', query_string={"stream": 1, "expand": "videos"})
+    lines = [json.loads(line)
+             for line in response.data.decode('utf-8').splitlines()]
+    assert [len(user["videos"]) for user in lines] == [1, 1]
+    plain = client.get('/Users/', query_string={"stream": 1})
+    assert "videos" not in json.loads(plain.data.decode('utf-8').splitlines()[0])
+
+
 def test_get_comment_by_id(client_with_comment):
     response = client_with_comment.get('/Comments/1')
     assert response.status_code == 200
@@ -418,6 +1584,296 @@ def test_delete_comment(client_with_comment):
     assert len(get_data) == 0
 
 
+def test_comment_counts_follow_comments(client_with_comment):
+    video = convert_response_data(client_with_comment.get('/Videos/'))[0]
+    assert video["comment_count"] == 1
+    assert video["last_comment_at"]
+    etag = client_with_comment.get('/Videos/1', json={"api_key": current_api_key}).headers["ETag"]
+
+    client_with_comment.post('/Comments/', json={"user_id": 1, "video_id": 1, "body": "second comment"})
+    assert convert_response_data(client_with_comment.get('/Videos/'))[0]["comment_count"] == 2
+    assert client_with_comment.get('/Videos/1', json={"api_key": current_api_key}).headers["ETag"] != etag
+
+    client_with_comment.delete('/Comments/2', json={"api_key": current_api_key})
+    client_with_comment.delete('/Comments/1', json={"api_key": current_api_key})
+    video = convert_response_data(client_with_comment.get('/Videos/'))[0]
+    assert video["comment_count"] == 0
+    assert video["last_comment_at"] is None
+
+
+def test_comment_counts_follow_moved_comments(client_with_comment):
+    client_with_comment.post('/Videos/', json={"url": NEW_TEST_URL, "user_id": 1})
+    response = client_with_comment.put('/Comments/1', json={"api_key": current_api_key, "user_id": 1,
+                                                            "video_id": 2, "body": TEST_COMMENT})
+    assert response.status_code == 200
+    videos = convert_response_data(client_with_comment.get('/Videos/'))
+    assert [video["comment_count"] for video in videos] == [0, 1]
+
+
+def test_deleting_commenter_updates_comment_counts(client_with_two_users):
+    client_with_two_users.post('/Videos/', json={"url": TEST_URL, "user_id": 1})
+    for user_id in (1, 2, 2):
+        client_with_two_users.post('/Comments/', json={"user_id": user_id, "video_id": 1, "body": TEST_COMMENT})
+    last_comment_at = convert_response_data(client_with_two_users.get('/Videos/'))[0]["last_comment_at"]
+
+    response = client_with_two_users.delete('/Users/2', json={"api_key": second_current_api_key})
+    assert response.status_code == 200
+    video = convert_response_data(client_with_two_users.get('/Videos/'))[0]
+    assert video["comment_count"] == 1
+    assert video["last_comment_at"] <= last_comment_at
+
+
+def test_user_delete_recounts_comments_in_one_update(app, client_with_two_users):
+    with app.app_context(), batch():
+        for index in range(20):
+            video = Video(url=f"https://youtube.com/watch?v={index}", user_id=1)
+            video.save()
+            Comment(user_id=2, video=video, body=TEST_COMMENT).save()
+    updates = []
+
+    def record_update(conn, cursor, statement, *args):
+        if statement.startswith("UPDATE video"):
+            updates.append(statement)
+
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", record_update)
+        try:
+            response = client_with_two_users.delete('/Users/2', json={"api_key": second_current_api_key})
+        finally:
+            event.remove(db.engine, "before_cursor_execute", record_update)
+
+    assert response.status_code == 200
+    assert len(updates) == 1
+    videos = convert_response_data(client_with_two_users.get('/Videos/'))
+    assert [video["comment_count"] for video in videos] == [0] * 20
+    assert {video["last_comment_at"] for video in videos} == {None}
+
+
+def test_video_comments_newest_first(client_with_comment):
+    for body in ("second comment", "third comment"):
+        client_with_comment.post('/Comments/', json={"user_id": 1, "video_id": 1, "body": body})
+
+    response = client_with_comment.get('/Videos/1/comments', query_string={"limit": 2})
+    assert [comment["id"] for comment in convert_response_data(response)] == [3, 2]
+    response = client_with_comment.get('/Videos/1/comments',
+                                       query_string={"limit": 2, "after": response.headers["X-Next-Cursor"]})
+    assert [comment["body"] for comment in convert_response_data(response)] == [TEST_COMMENT]
+    assert "X-Next-Cursor" not in response.headers
+    assert client_with_comment.get('/Videos/2/comments').status_code == 404
+
+
+def test_video_comments_use_video_id_index(app, client_with_comment):
+    query = db.select(Comment).where(Comment.video_id == 1).order_by(Comment.id.desc()).limit(10)
+    assert "ix_comment_video_id_id" in query_plan(app, query)
+
+
+@pytest.fixture()
+def client_with_searchable_entries(client_with_user):
+    for index, description in enumerate(["crash on the highway", "highway crash, highway closed",
+                                         "parking lot scrape"]):
+        client_with_user.post('/Videos/', json={"url": f"https://youtube.com/watch?v={index}",
+                                                "user_id": 1, "description": description})
+    client_with_user.post('/Comments/', json={"user_id": 1, "video_id": 3,
+                                              "body": "another crash on the same highway"})
+
+    return client_with_user
+
+
+def search_results(client, **query):
+    response = client.get('/Search/', query_string=query)
+    assert response.status_code == 200
+
+    return [(result["type"], result["id"]) for result in convert_response_data(response)]
+
+
+def test_search_ranks_videos_and_comments(client_with_searchable_entries):
+    response = client_with_searchable_entries.get('/Search/', query_string={"q": "Highway crashes"})
+    assert response.status_code == 200
+    data = convert_response_data(response)
+    assert [(result["type"], result["id"]) for result in data][0] == ("video", 2)
+    assert {(result["type"], result["id"]) for result in data} == {("video", 1), ("video", 2), ("comment", 1)}
+    assert "[highway]" in data[0]["snippet"]
+    assert data[0]["video"]["description"] == "highway crash, highway closed"
+    assert "comment" not in data[0]
+    assert search_results(client_with_searchable_entries, q="crash", type="comment") == [("comment", 1)]
+    assert client_with_searchable_entries.get('/Search/', query_string={"q": "?!"}).status_code == 400
+
+
+def test_search_follows_updates_and_deletes(client_with_searchable_entries):
+    client_with_searchable_entries.patch('/Videos/3', json={"description": "highway pileup",
+                                                            "api_key": current_api_key})
+    client_with_searchable_entries.delete('/Videos/1', json={"api_key": current_api_key})
+    client_with_searchable_entries.put('/Comments/1', json={"user_id": 1, "video_id": 3, "body": "no words in common",
+                                                            "api_key": current_api_key})
+
+    assert set(search_results(client_with_searchable_entries, q="highway")) == {("video", 2), ("video", 3)}
+    assert search_results(client_with_searchable_entries, q="parking") == []
+
+
+def test_search_is_paginated(client_with_searchable_entries):
+    results, query = [], {"q": "highway", "limit": 1}
+    while True:
+        response = client_with_searchable_entries.get('/Search/', query_string=query)
+        results += [(result["type"], result["id"]) for result in convert_response_data(response)]
+        if "X-Next-Cursor" not in response.headers:
+            break
+        query["after"] = response.headers["X-Next-Cursor"]
+
+    assert results == search_results(client_with_searchable_entries, q="highway")
+    assert len(results) == 3
+    bad_cursor = client_with_searchable_entries.get('/Search/', query_string={"q": "highway", "after": "x"})
+    assert bad_cursor.status_code == 400
+
+
+class RecordingConnection:
+    """
+    Stands in for a PostgreSQL connection, recording the SQL it is given and answering queries with the given rows.
+    Raw SQL is checked to have a pyformat parameter for every placeholder, and statements are compiled for PostgreSQL.
+    """
+
+    def __init__(self, rows=()):
+        self.rows = list(rows)
+        self.statements = []
+
+    def exec_driver_sql(self, sql, parameters=None):
+        for row in parameters if isinstance(parameters, list) else [parameters or {}]:
+            sql % {name: "" for name in row}
+        self.statements.append((sql, parameters))
+        return SimpleNamespace(all=lambda: self.rows)
+
+    def execute(self, statement):
+        self.statements.append((str(statement.compile(dialect=postgresql.dialect())), None))
+
+
+def test_postgres_search_backend_sql():
+    backend = PostgresSearchBackend()
+    connection = RecordingConnection()
+    backend.index_many(connection, "video", [(1, "crash on the highway"), (2, None), (3, "parking lot")])
+    [(sql, parameters)] = connection.statements
+    assert sql == "INSERT INTO search_index (id, body) VALUES (%(id)s, %(body)s)"
+    assert parameters == [{"id": 2, "body": "crash on the highway"}, {"id": 6, "body": "parking lot"}]
+
+    connection = RecordingConnection()
+    backend.index(connection, "comment", 1, "another crash")
+    assert [parameters for _, parameters in connection.statements] == [{"id": 3}, {"id": 3, "body": "another crash"}]
+
+    connection = RecordingConnection()
+    backend.remove_selected(connection, "comment", db.select(Comment.id).where(Comment.user_id == 1))
+    [(sql, _)] = connection.statements
+    assert sql.startswith("DELETE FROM search_index WHERE search_index.id IN (SELECT anon_2.id * %(id_1)s + %(param_1)s")
+    assert "WHERE comment.user_id = %(user_id_1)s" in sql
+
+    connection = RecordingConnection(rows=[(2, 0.5, "[crash] on the highway"), (3, 0.25, "another [crash]")])
+    hits, cursor = backend.search(connection, ["crash"], ["video", "comment"], limit=1)
+    assert hits == [SearchHit("video", 1, 0.5, "[crash] on the highway")]
+    backend.search(connection, ["crash"], ["video"], limit=1, after=cursor)
+    sql, parameters = connection.statements[-1]
+    assert "score < %(score)s" in sql
+    assert (parameters["score"], parameters["document"], parameters["kinds"]) == (0.5, 2, [0])
+
+
+@pytest.fixture()
+def unsearchable_database(app, monkeypatch):
+    monkeypatch.setitem(app.config, "SQLALCHEMY_DATABASE_URI", "mysql://localhost/dashcam")
+    get_search_backend.cache_clear()
+    yield
+    get_search_backend.cache_clear()
+
+
+def test_search_is_not_implemented_without_a_backend(unsearchable_database, client_with_user):
+    response = client_with_user.post('/Videos/', json={"url": TEST_URL, "user_id": 1, "description": "crash"})
+    assert response.status_code == 200
+    assert client_with_user.get('/Search/', query_string={"q": "crash"}).status_code == 501
+
+
+def test_unknown_search_backend_is_rejected(app, monkeypatch):
+    monkeypatch.setitem(app.config, "SEARCH_BACKEND", "elasticsearch")
+    get_search_backend.cache_clear()
+    try:
+        with pytest.raises(ValueError):
+            get_search_backend()
+    finally:
+        get_search_backend.cache_clear()
+
+
+def test_search_backends_must_implement_every_method():
+    class IndexOnlyBackend(SearchBackend):
+        def index(self, connection, kind, id, text):
+            pass
+
+    with pytest.raises(TypeError):
+        IndexOnlyBackend()
+
+
+def test_stores_are_picked_by_uri(tmp_path):
+    uri = f"sqlite:///{tmp_path / 'idempotency.db'}"
+    assert isinstance(get_store(uri, max_size=10, ttl=60, lock_ttl=60), SQLiteStore)
+    assert isinstance(get_backend("memory://", max_size=10, ttl=60), MemoryBackend)
+    with pytest.raises(ValueError, match="Unsupported response cache URI"):
+        get_backend("redis://localhost", max_size=10, ttl=60)
+
+
+def test_sqlite_limiter_storage_is_shared(tmp_path):
+    uri = f"sqlite:///{tmp_path / 'limits.db'}"
+    first_worker = storage_from_string(uri)
+    second_worker = storage_from_string(uri)
+    assert isinstance(first_worker, SQLiteStorage)
+    assert first_worker.incr("key", 60) == 1
+    assert second_worker.incr("key", 60) == 2
+    assert first_worker.get("key") == 2
+    first_worker.clear("key")
+    assert second_worker.get("key") == 0
+
+
+def test_sqlite_limiter_storage_expires_counters(tmp_path):
+    storage = SQLiteStorage(f"sqlite:///{tmp_path / 'limits.db'}")
+    storage.incr("key", -1)
+    assert storage.get("key") == 0
+    assert storage.incr("key", 60) == 1
+
+
+def test_sqlite_limiter_storage_sliding_window(tmp_path):
+    uri = f"sqlite:///{tmp_path / 'limits.db'}"
+    first_worker = SlidingWindowCounterRateLimiter(storage_from_string(uri))
+    second_worker = SlidingWindowCounterRateLimiter(storage_from_string(uri))
+    limit = parse("2/hour")
+    assert first_worker.hit(limit, "client")
+    assert second_worker.hit(limit, "client")
+    assert not first_worker.hit(limit, "client")
+    assert second_worker.hit(limit, "other_client")
+
+
+def test_api_key_in_header(client_with_user):
+    user_data = {"username": NEW_TEST_USERNAME}
+    response = client_with_user.put(
+        '/Users/1', json=user_data, headers={"X-API-Key": current_api_key})
+    assert response.status_code == 200
+    response = client_with_user.put(
+        '/Users/1', json=user_data, headers={"X-API-Key": "wrong_key"})
+    assert response.status_code == 403
+
+
+def test_anonymous_rate_limit_is_per_client(client):
+    for _ in range(30):
+        response = client.get(
+            "/Videos/", environ_base={"REMOTE_ADDR": "10.0.0.1"})
+        assert response.status_code == 200
+    response = client.get("/Videos/", environ_base={"REMOTE_ADDR": "10.0.0.1"})
+    assert response.status_code == 429
+    response = client.get("/Videos/", environ_base={"REMOTE_ADDR": "10.0.0.2"})
+    assert response.status_code == 200
+
+
+def test_invalid_api_keys_share_the_client_rate_limit(client):
+    for i in range(30):
+        response = client.get(
+            "/Videos/", headers={"X-API-Key": f"made-up-{i}"}, environ_base={"REMOTE_ADDR": "10.0.0.1"})
+        assert response.status_code == 200
+    response = client.get(
+        "/Videos/", query_string={"api_key": "another-made-up-key"}, environ_base={"REMOTE_ADDR": "10.0.0.1"})
+    assert response.status_code == 429
+
+
 def test_api_rate_limit(client_with_user):
     user_data = {"api_key": current_api_key}
     for _ in range(1000):